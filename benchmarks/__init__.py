@@ -0,0 +1,7 @@
+"""
+Micro-benchmarks for the ORM hot paths in store, subscriptions and core.
+
+Runs against a throwaway test database seeded with synthetic data and
+writes JSON results that can be compared across commits. See
+`python -m benchmarks --help`.
+"""
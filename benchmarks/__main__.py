@@ -0,0 +1,236 @@
+"""
+Command line entry point.
+
+    python -m benchmarks run --scale 1000 --scale 100000
+    python -m benchmarks compare results/abc123-1000.json \\
+        results/def456-1000.json --threshold 10
+    python -m benchmarks connections --requests 500
+    python -m benchmarks templates
+    python -m benchmarks imports --users 100000 --batch-size 5000
+    python -m benchmarks webhooks --events 600 --threads 8
+
+`run` builds a fresh test database (never the configured one), seeds it
+for each scale and writes benchmarks/results/<commit>-<scale>.json.
+`compare` exits with status 1 when any case regressed. `connections`
+measures per-request connect overhead against DATABASE_URL with and
+without persistent connections and pooling. `templates` compares
+first-request render time with and without template warm-up against
+the steady state. `imports` compares saving users and profiles one
+by one with bulk_create() on a throwaway database. `webhooks` delivers
+Stripe webhooks from parallel threads, checks the stock, subscription
+and order invariants and exits with status 1 if any broke.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import django
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+
+@contextmanager
+def throwaway_database():
+    """Create the test database for the duration of the block."""
+    from django.test.utils import setup_databases, teardown_databases
+
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+def cmd_run(args):
+    from django.test.utils import (
+        setup_test_environment, teardown_test_environment,
+    )
+    from benchmarks import runner
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    setup_test_environment()
+    for scale in args.scale:
+        with throwaway_database():
+            print(f"== scale {scale} ==")
+            result = runner.run(scale, repeat=args.repeat, names=args.case)
+        path = args.output or RESULTS_DIR / (
+            f"{result['commit']}-{scale}.json"
+        )
+        runner.save(result, path)
+        print(f"Wrote {path}")
+    teardown_test_environment()
+
+
+def cmd_templates(args):
+    from django.test.utils import (
+        setup_test_environment, teardown_test_environment,
+    )
+    from benchmarks import templates
+    from benchmarks.seed import seed
+
+    setup_test_environment()
+    with throwaway_database():
+        results = templates.run(seed(args.scale), repeat=args.repeat)
+    teardown_test_environment()
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    return 0
+
+
+def cmd_imports(args):
+    from benchmarks import imports
+
+    with throwaway_database():
+        results = imports.run(args.users, batch_size=args.batch_size)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    return 0
+
+
+def cmd_webhooks(args):
+    from django.db import connection
+    from django.test.utils import (
+        setup_test_environment, teardown_test_environment,
+    )
+    from benchmarks import webhooks
+
+    setup_test_environment()
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite':
+            # Threads can't share the in-memory test database
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                directory, 'webhooks.sqlite3'
+            )
+        with throwaway_database():
+            results = webhooks.run(
+                args.events, threads=args.threads, members=args.members
+            )
+    teardown_test_environment()
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    return 1 if results['problems'] or results['failures'] else 0
+
+
+def cmd_compare(args):
+    from benchmarks import runner
+
+    rows, regressions = runner.compare(
+        runner.load(args.old), runner.load(args.new), args.threshold
+    )
+    print(f"{'case':<24} {'before':>10} {'after':>10} {'change':>8}")
+    for name, before, after, change in rows:
+        flag = '  REGRESSION' if change > args.threshold else ''
+        print(f"{name:<24} {before:>10.3f} {after:>10.3f} "
+              f"{change:>+7.1f}%{flag}")
+    return 1 if regressions else 0
+
+
+def cmd_connections(args):
+    from benchmarks import connections
+
+    if args.child:
+        print(json.dumps(connections.measure(args.requests)))
+        return 0
+    results = connections.run(args.mode, args.requests)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    return 0 if len(results) == len(args.mode) else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='seed and time the cases')
+    run_parser.add_argument(
+        '--scale', type=int, action='append',
+        help='rows per table; repeatable (default: 1000)',
+    )
+    run_parser.add_argument('--repeat', type=int, default=10)
+    run_parser.add_argument(
+        '--case', action='append', help='only run this case; repeatable'
+    )
+    run_parser.add_argument('--output', help='result file (single scale)')
+    run_parser.set_defaults(func=cmd_run)
+
+    compare_parser = commands.add_parser(
+        'compare', help='compare two result files'
+    )
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument(
+        '--threshold', type=float, default=10.0,
+        help='percent slowdown in the median that counts as a regression',
+    )
+    compare_parser.set_defaults(func=cmd_compare)
+
+    connections_parser = commands.add_parser(
+        'connections', help='measure per-request connection overhead'
+    )
+    connections_parser.add_argument('--requests', type=int, default=500)
+    connections_parser.add_argument(
+        '--mode', action='append',
+        choices=['per-request', 'persistent', 'pool'],
+        help='repeatable (default: all three)',
+    )
+    connections_parser.add_argument('--output', help='write results here')
+    connections_parser.add_argument(
+        '--child', action='store_true', help=argparse.SUPPRESS
+    )
+    connections_parser.set_defaults(func=cmd_connections)
+
+    templates_parser = commands.add_parser(
+        'templates', help='first-request vs steady-state render time'
+    )
+    templates_parser.add_argument('--scale', type=int, default=100)
+    templates_parser.add_argument('--repeat', type=int, default=20)
+    templates_parser.add_argument('--output', help='write results here')
+    templates_parser.set_defaults(func=cmd_templates)
+
+    imports_parser = commands.add_parser(
+        'imports', help='per-row vs bulk user and profile inserts'
+    )
+    imports_parser.add_argument('--users', type=int, default=100000)
+    imports_parser.add_argument('--batch-size', type=int, default=5000)
+    imports_parser.add_argument('--output', help='write results here')
+    imports_parser.set_defaults(func=cmd_imports)
+
+    webhooks_parser = commands.add_parser(
+        'webhooks', help='concurrent webhook deliveries and invariants'
+    )
+    webhooks_parser.add_argument('--events', type=int, default=600)
+    webhooks_parser.add_argument('--threads', type=int, default=8)
+    webhooks_parser.add_argument(
+        '--members', type=int, default=20,
+        help='users the subscription checkouts are spread over',
+    )
+    webhooks_parser.add_argument('--output', help='write results here')
+    webhooks_parser.set_defaults(func=cmd_webhooks)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run' and not args.scale:
+        args.scale = [1000]
+    if args.command == 'connections' and not args.mode:
+        args.mode = ['per-request', 'persistent', 'pool']
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fithub.settings')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # Pages render without running collectstatic first.
+    os.environ.setdefault(
+        'STATICFILES_BACKEND',
+        'django.contrib.staticfiles.storage.StaticFilesStorage',
+    )
+    django.setup()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
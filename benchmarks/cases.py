@@ -0,0 +1,141 @@
+"""
+Benchmark cases.
+
+Each case is a function taking a Context and exercising one code path
+once. Register new cases with the @case decorator.
+
+Pages wrapped in fithub.page_cache.public_page() are served from the
+page cache to requests without a session cookie, so a case would time
+a cache hit from its second run on. Requests from Context.get() carry
+a session cookie, as a signed-in visitor's do; anonymous cases add a
+query string of their own to every request, so each run renders the
+page.
+"""
+import itertools
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+
+from core import views as core_views
+from store import views as store_views
+from store.models import Product
+from store.utils import get_cart_products
+from subscriptions import views as subscription_views
+from subscriptions.models import Plan
+
+CASES = {}
+
+CART_SIZE = 50
+
+
+def case(name):
+    def register(func):
+        CASES[name] = func
+        return func
+    return register
+
+
+class Context:
+    """Shared state for a benchmark run.
+
+    `event` is what the patched stripe.Webhook.construct_event returns,
+    so webhook cases set it before calling their view.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.factory = RequestFactory()
+        product_ids = Product.objects.values_list('id', flat=True)
+        self.cart = {
+            str(pk): 1 for pk in product_ids.order_by('-id')[:CART_SIZE]
+        }
+        self.plan_id = Plan.objects.values_list('id', flat=True).first()
+        self.event = None
+        self._counter = itertools.count()
+
+    def next_id(self):
+        return next(self._counter)
+
+    def get(self, path, user=None):
+        request = self.factory.get(path)
+        request.user = user or self.user
+        if request.user.is_authenticated:
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = 'bench'
+        return request
+
+    def uncached_path(self, path):
+        """`path` with a query string no earlier request used, which
+        misses the page cache."""
+        return f"{path}?run={self.next_id()}"
+
+    def webhook(self, event):
+        self.event = event
+        return self.factory.post(
+            '/webhook/', data=b'{}', content_type='application/json',
+            HTTP_STRIPE_SIGNATURE='t=0,v1=bench',
+        )
+
+
+@case('cart_resolution')
+def cart_resolution(ctx):
+    get_cart_products(ctx.cart)
+
+
+@case('oneoff_webhook')
+def oneoff_webhook(ctx):
+    cart = dict(list(ctx.cart.items())[:3])
+    request = ctx.webhook({
+        'id': f"evt_order_{ctx.next_id()}",
+        'type': 'checkout.session.completed',
+        'data': {'object': {'metadata': {
+            'user_id': str(ctx.user.id),
+            'cart': str(cart),
+        }}},
+    })
+    store_views.oneoff_webhook(request)
+
+
+@case('stripe_webhook_upsert')
+def stripe_webhook_upsert(ctx):
+    n = ctx.next_id()
+    request = ctx.webhook({
+        'id': f"evt_sub_{n}",
+        'type': 'checkout.session.completed',
+        'data': {'object': {
+            'customer_email': ctx.user.email,
+            'subscription': f"sub_bench_{n}",
+            'metadata': {
+                'plan_id': str(ctx.plan_id),
+                'user_id': str(ctx.user.id),
+            },
+        }},
+    })
+    subscription_views.stripe_webhook(request)
+
+
+@case('plan_list')
+def plan_list(ctx):
+    subscription_views.plan_list(ctx.get('/subscriptions/plans/'))
+
+
+@case('plan_list_anonymous')
+def plan_list_anonymous(ctx):
+    subscription_views.plan_list(ctx.get(
+        ctx.uncached_path('/subscriptions/plans/'), user=AnonymousUser()
+    ))
+
+
+@case('progress_list')
+def progress_list(ctx):
+    core_views.progress_list(ctx.get('/core/'))
+
+
+@case('order_history')
+def order_history(ctx):
+    store_views.order_history(ctx.get('/store/orders/'))
+
+
+@case('admin_dashboard')
+def admin_dashboard(ctx):
+    store_views.admin_dashboard(ctx.get('/store/admin-dashboard/'))
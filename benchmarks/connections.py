@@ -0,0 +1,79 @@
+"""
+Per-request database connection overhead.
+
+Each mode runs in a child process with the DB_* environment variables
+that fithub.settings reads, so the connection settings are exactly what
+a deployment would get. A simulated request fires request_started, runs
+`SELECT 1` and fires request_finished, which is where Django opens and
+closes connections for a real request.
+
+Point DATABASE_URL at PostgreSQL; the pool mode needs psycopg 3.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+MODES = {
+    'per-request': {'DB_CONN_MAX_AGE': '0', 'DB_POOL': ''},
+    'persistent': {'DB_CONN_MAX_AGE': '600', 'DB_POOL': ''},
+    'pool': {'DB_CONN_MAX_AGE': '0', 'DB_POOL': '1'},
+}
+
+
+def measure(requests):
+    """Run `requests` simulated requests in this process."""
+    from django.core.signals import request_finished, request_started
+    from django.db import connection
+    from django.db.backends.signals import connection_created
+
+    connects = []
+    connection_created.connect(
+        lambda **kwargs: connects.append(1), weak=False
+    )
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        request_started.send(sender=None)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        request_finished.send(sender=None)
+        timings.append((time.perf_counter() - start) * 1000)
+    connection.close()
+
+    pool = getattr(connection, 'pool', None)
+    return {
+        'database': connection.vendor,
+        'requests': requests,
+        # With a pool every checkout fires connection_created; the pool
+        # itself knows how many server connections were opened.
+        'connects': (
+            pool.get_stats()['connections_num'] if pool else len(connects)
+        ),
+        'median_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'max_ms': round(max(timings), 3),
+    }
+
+
+def run(modes, requests, log=print):
+    """Measure each mode in a child process; returns {mode: result}."""
+    results = {}
+    for mode in modes:
+        env = {**os.environ, **MODES[mode]}
+        completed = subprocess.run(
+            [sys.executable, '-m', 'benchmarks', 'connections', '--child',
+             '--requests', str(requests)],
+            env=env, capture_output=True, text=True,
+        )
+        if completed.returncode:
+            log(f"{mode:<12} failed: {completed.stderr.strip()[-200:]}")
+            continue
+        results[mode] = json.loads(completed.stdout.splitlines()[-1])
+        result = results[mode]
+        log(f"{mode:<12} {result['connects']:>6} connects  "
+            f"median {result['median_ms']:>8.3f} ms  "
+            f"mean {result['mean_ms']:>8.3f} ms")
+    return results
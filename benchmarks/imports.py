@@ -0,0 +1,80 @@
+"""
+Importing users: one save at a time against bulk_create().
+
+`per-row` creates each user and its profile with their own INSERTs, the
+way a loop over User.objects.create_user() would. It is timed on a
+sample of the rows and reported as a rate, since saving 100,000 users
+one by one takes minutes. `bulk` inserts the users with bulk_create()
+and their profiles with Profile.objects.bulk_create_for(), two
+statements per batch inside one transaction.
+
+Passwords are set unusable with make_password(None): hashing is
+deliberately slow and would swamp the insert times being compared.
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from users.models import Profile
+
+User = get_user_model()
+
+PER_ROW_SAMPLE = 2000
+
+
+def build_users(prefix, count, password):
+    return [
+        User(
+            username=f'{prefix}{i}',
+            email=f'{prefix}{i}@example.com',
+            password=password,
+        )
+        for i in range(count)
+    ]
+
+
+def per_row(users):
+    with transaction.atomic():
+        for user in users:
+            user.save()
+            Profile.objects.create(user=user)
+
+
+def bulk(users, batch_size):
+    with transaction.atomic():
+        for start in range(0, len(users), batch_size):
+            batch = User.objects.bulk_create(users[start:start + batch_size])
+            Profile.objects.bulk_create_for(batch)
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def run(users, batch_size=5000, log=print):
+    password = make_password(None)
+    sample = min(users, PER_ROW_SAMPLE)
+    results = {}
+    for name, count, func, extra in (
+        ('per-row', sample, per_row, ()),
+        ('bulk', users, bulk, (batch_size,)),
+    ):
+        rows = build_users(f'import-{name}-', count, password)
+        seconds = timed(func, rows, *extra)
+        results[name] = {
+            'users': count,
+            'seconds': seconds,
+            'rows_per_sec': count / seconds if seconds else 0.0,
+        }
+        log(f"{name:<8} {count:>8} users in {seconds:>8.2f}s  "
+            f"{results[name]['rows_per_sec']:>10.0f} rows/s")
+    per_row_rate = results['per-row']['rows_per_sec']
+    if per_row_rate:
+        log(f"bulk is {results['bulk']['rows_per_sec'] / per_row_rate:.1f}x "
+            f"faster; {users} users one by one would take about "
+            f"{users / per_row_rate:.0f}s")
+    return results
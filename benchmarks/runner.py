@@ -0,0 +1,102 @@
+import json
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from django.db import connection
+
+from benchmarks.cases import CASES, Context
+from benchmarks.seed import seed
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def time_case(func, ctx, repeat, warmup=1):
+    """Run `func` warmup + repeat times; return timings in ms."""
+    for _ in range(warmup):
+        func(ctx)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(ctx)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'runs': repeat,
+        'min_ms': round(min(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'max_ms': round(max(timings), 3),
+    }
+
+
+def run(scale, repeat=10, names=None, log=print):
+    """Seed `scale` rows and time each case. Returns a result dict."""
+    start = time.perf_counter()
+    user = seed(scale)
+    log(f"Seeded {scale} rows per table in "
+        f"{time.perf_counter() - start:.1f}s")
+
+    ctx = Context(user)
+    results = {}
+    # Each subscription checkout cancels the one before it on Stripe
+    with patch(
+        'stripe.Webhook.construct_event',
+        side_effect=lambda *args, **kwargs: ctx.event,
+    ), patch('stripe.Subscription.delete'):
+        for name, func in CASES.items():
+            if names and name not in names:
+                continue
+            results[name] = time_case(func, ctx, repeat)
+            log(f"{name:<24} median {results[name]['median_ms']:>10.3f} ms")
+
+    return {
+        'commit': git_commit(),
+        'scale': scale,
+        'database': connection.vendor,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'results': results,
+    }
+
+
+def compare(old, new, threshold=10.0):
+    """Compare two result dicts by median time.
+
+    Returns (rows, regressions) where a regression is a case whose median
+    grew by more than `threshold` percent.
+    """
+    rows = []
+    regressions = []
+    for name, result in new['results'].items():
+        before = old['results'].get(name)
+        if before is None:
+            continue
+        change = (
+            (result['median_ms'] - before['median_ms'])
+            / before['median_ms'] * 100
+            if before['median_ms'] else 0.0
+        )
+        row = (name, before['median_ms'], result['median_ms'], change)
+        rows.append(row)
+        if change > threshold:
+            regressions.append(row)
+    return rows, regressions
+
+
+def load(path):
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def save(result, path):
+    with open(path, 'w') as fh:
+        json.dump(result, fh, indent=2)
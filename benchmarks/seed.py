@@ -0,0 +1,117 @@
+"""
+Synthetic data for the benchmarks.
+
+`scale` is the row count of each large table: products, reviews,
+orders (one item each), subscriptions and progress updates. The
+benchmark user owns a fixed slice of it, so per-user views measure how
+lookups behave as the tables grow.
+"""
+from datetime import date
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+
+from core.models import ProgressUpdate
+from store.models import Product, Order, OrderItem, Review
+from subscriptions.models import Plan, Subscription
+
+BATCH_SIZE = 5000
+PLAN_COUNT = 10
+USER_ROWS = 20
+
+
+def _bulk(model, rows):
+    """bulk_create a generator in BATCH_SIZE chunks."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def seed(scale):
+    password = make_password(None)
+    user_count = max(1, scale // 100)
+    _bulk(User, (
+        User(username=f"bench_{i}", email=f"bench{i}@example.com",
+             password=password)
+        for i in range(user_count)
+    ))
+    user_ids = list(User.objects.values_list('id', flat=True))
+
+    _bulk(Product, (
+        Product(name=f"Product {i}", description="Synthetic product.",
+                price=10 + i % 90, stock=1_000_000)
+        for i in range(scale)
+    ))
+    product_ids = list(Product.objects.values_list('id', flat=True))
+
+    _bulk(Review, (
+        Review(user_id=user_ids[i % len(user_ids)],
+               product_id=product_ids[i % len(product_ids)],
+               rating=1 + i % 5, comment="Synthetic review.")
+        for i in range(scale)
+    ))
+
+    _bulk(Order, (
+        Order(user_id=user_ids[i % len(user_ids)], total_cents=1000,
+              status='paid')
+        for i in range(scale)
+    ))
+    _bulk(OrderItem, (
+        OrderItem(order_id=order_id,
+                  product_id=product_ids[i % len(product_ids)],
+                  quantity=1, unit_price=10)
+        for i, order_id in enumerate(
+            Order.objects.values_list('id', flat=True)
+        )
+    ))
+
+    _bulk(Plan, (
+        Plan(name=f"Plan {i}", description="Synthetic plan.",
+             price=9.99 + i, interval='monthly',
+             stripe_price_id=f"price_bench_{i}")
+        for i in range(PLAN_COUNT)
+    ))
+    plan_ids = list(Plan.objects.values_list('id', flat=True))
+    _bulk(Subscription, (
+        Subscription(user_id=user_ids[i % len(user_ids)],
+                     plan_id=plan_ids[i % len(plan_ids)],
+                     stripe_sub_id=f"sub_seed_{i}",
+                     start_date=date(2025, 1, 1),
+                     status='canceled')
+        for i in range(scale)
+    ))
+
+    _bulk(ProgressUpdate, (
+        ProgressUpdate(user_id=user_ids[i % len(user_ids)],
+                       title=f"Update {i}", content="Synthetic progress.")
+        for i in range(scale)
+    ))
+
+    # The user the per-user benchmarks run as.
+    user = User.objects.create_user(
+        username='bench_user', email='bench_user@example.com',
+        is_staff=True,
+    )
+    orders = Order.objects.bulk_create(
+        Order(user=user, total_cents=2000, status='paid')
+        for _ in range(USER_ROWS)
+    )
+    OrderItem.objects.bulk_create(
+        OrderItem(order=order, product_id=product_ids[i % len(product_ids)],
+                  quantity=2, unit_price=10)
+        for i, order in enumerate(orders)
+    )
+    ProgressUpdate.objects.bulk_create(
+        ProgressUpdate(user=user, title=f"My update {i}", content="Mine.")
+        for i in range(USER_ROWS)
+    )
+    Subscription.objects.create(
+        user=user, plan_id=plan_ids[0], stripe_sub_id='sub_bench_active',
+        start_date=date(2025, 1, 1), status='active',
+    )
+    return user
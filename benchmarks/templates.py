@@ -0,0 +1,68 @@
+"""
+First-request and steady-state page render times.
+
+For each page the cached template loader is emptied, then the page is
+requested once cold, once after fithub.warmup.warm_templates() has run,
+and `repeat` more times to get a steady-state median. Timings come from
+the Server-Timing header set by RequestMetricsMiddleware: `total` is
+the whole request and `tpl` the time spent rendering templates.
+"""
+import re
+import statistics
+
+from django.test import Client
+from django.urls import reverse
+
+from fithub.warmup import django_engine, warm_templates
+
+PAGES = (
+    'home',
+    'store:product_list',
+    'store:cart',
+    'store:order_history',
+    'subscriptions:plan_list',
+    'subscriptions:my_subscription',
+    'core:progress_list',
+    'users:profile',
+)
+
+TIMING_RE = re.compile(r'(\w+);dur=([\d.]+)')
+
+
+def reset_templates():
+    for loader in django_engine().engine.template_loaders:
+        loader.reset()
+
+
+def timed_get(client, path):
+    response = client.get(path)
+    assert response.status_code == 200, (path, response.status_code)
+    timings = dict(TIMING_RE.findall(response['Server-Timing']))
+    return float(timings['total']), float(timings['tpl'])
+
+
+def run(user, repeat=20, log=print):
+    client = Client()
+    client.force_login(user)
+    results = {}
+    for name in PAGES:
+        path = reverse(name)
+        reset_templates()
+        cold = timed_get(client, path)
+        reset_templates()
+        warm_templates()
+        warmed = timed_get(client, path)
+        steady = [timed_get(client, path) for _ in range(repeat)]
+        results[name] = {
+            'cold_ms': cold[0],
+            'cold_tpl_ms': cold[1],
+            'warmed_ms': warmed[0],
+            'warmed_tpl_ms': warmed[1],
+            'steady_ms': statistics.median(t[0] for t in steady),
+            'steady_tpl_ms': statistics.median(t[1] for t in steady),
+        }
+        result = results[name]
+        log(f"{name:<32} cold {result['cold_tpl_ms']:>7.1f}  "
+            f"warmed {result['warmed_tpl_ms']:>7.1f}  "
+            f"steady {result['steady_tpl_ms']:>7.1f}  (tpl ms)")
+    return results
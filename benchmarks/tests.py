@@ -0,0 +1,135 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from . import connections, imports, runner, templates, webhooks
+from .cases import CASES, Context
+from .seed import seed
+from store.models import Order, Product
+from subscriptions.models import Plan, Subscription
+from users.models import Profile
+
+
+class BenchmarkRunTests(TestCase):
+    """The benchmark runner against a small seeded database."""
+
+    def test_every_case_runs(self):
+        # Each registered case gets a timing and the webhooks create rows
+        result = runner.run(20, repeat=1, log=lambda message: None)
+        self.assertEqual(set(result['results']), set(CASES))
+        self.assertEqual(result['scale'], 20)
+        for timing in result['results'].values():
+            self.assertLessEqual(timing['min_ms'], timing['max_ms'])
+        # Seeded orders plus the bench user's plus one per webhook call
+        self.assertEqual(Order.objects.count(), 20 + 20 + 2)
+
+    def test_page_cases_miss_the_page_cache(self):
+        # Every run of a public_page() view renders it again
+        cache.clear()
+        ctx = Context(seed(5))
+        for name in ('plan_list', 'plan_list_anonymous', 'progress_list'):
+            CASES[name](ctx)
+            with self.subTest(case=name):
+                with CaptureQueriesContext(connection) as queries:
+                    CASES[name](ctx)
+                self.assertTrue(queries.captured_queries)
+
+
+class CompareTests(SimpleTestCase):
+    """Comparing two result files by median time."""
+
+    def result(self, **medians):
+        return {'results': {
+            name: {'median_ms': median} for name, median in medians.items()
+        }}
+
+    def test_regression_over_threshold(self):
+        # A 20% slowdown is flagged at the default 10% threshold
+        rows, regressions = runner.compare(
+            self.result(a=10.0, b=10.0), self.result(a=12.0, b=10.5)
+        )
+        self.assertEqual(len(rows), 2)
+        self.assertEqual([row[0] for row in regressions], ['a'])
+
+    def test_new_cases_are_skipped(self):
+        # Cases missing from the old file are not compared
+        rows, regressions = runner.compare(
+            self.result(a=10.0), self.result(a=5.0, b=99.0)
+        )
+        self.assertEqual([row[0] for row in rows], ['a'])
+        self.assertEqual(regressions, [])
+
+
+class ConnectionBenchmarkTests(TestCase):
+    """The per-request connection benchmark, run in-process."""
+
+    def test_measure(self):
+        # Every simulated request is timed
+        result = connections.measure(3)
+        self.assertEqual(result['requests'], 3)
+        self.assertEqual(result['database'], 'sqlite')
+        self.assertLessEqual(result['median_ms'], result['max_ms'])
+
+
+class TemplateBenchmarkTests(TestCase):
+    """The first-request render benchmark."""
+
+    def test_every_page_timed(self):
+        # Each page reports cold, warmed and steady-state timings
+        results = templates.run(seed(5), repeat=1, log=lambda message: None)
+        self.assertEqual(set(results), set(templates.PAGES))
+        for timing in results.values():
+            self.assertGreaterEqual(timing['cold_ms'], timing['cold_tpl_ms'])
+
+
+class ImportBenchmarkTests(TestCase):
+    """The per-row vs bulk user import benchmark."""
+
+    def test_both_methods_import_users_with_profiles(self):
+        # Every imported user ends up with exactly one profile
+        results = imports.run(7, batch_size=3, log=lambda message: None)
+        self.assertEqual(results['per-row']['users'], 7)
+        self.assertEqual(results['bulk']['users'], 7)
+        self.assertEqual(
+            Profile.objects.filter(user__username__startswith='import-')
+            .count(),
+            14,
+        )
+
+
+class WebhookStressTests(TransactionTestCase):
+    """The concurrent webhook delivery harness."""
+
+    def test_invariants_hold_after_retried_deliveries(self):
+        # One worker: threads sharing the in-memory test database fail
+        # with "table is locked"; `python -m benchmarks webhooks` runs
+        # them in parallel on a WAL database file
+        results = webhooks.run(24, threads=1, members=2, log=lambda m: None)
+        self.assertEqual(results['deliveries'], 24)
+        self.assertEqual(results['failures'], 0)
+        self.assertEqual(results['problems'], [])
+        # 4 reserved checkouts and 2 of the 4 unreserved ones
+        self.assertEqual(results['orders'], 6)
+        self.assertEqual(results['active_subscriptions'], 2)
+
+    def test_broken_invariants_reported(self):
+        user = User.objects.create_user('twice')
+        plan = Plan.objects.create(
+            name='P', description='P', price=1, interval='monthly'
+        )
+        for i in range(2):
+            Subscription.objects.create(
+                user=user, plan=plan, stripe_sub_id=f'sub_{i}',
+                start_date='2025-01-01', status='active',
+            )
+        product = Product.objects.create(
+            name='P', description='P', price=1, stock=2
+        )
+        problems = webhooks.check_invariants({product.pk: 3})
+        self.assertEqual(problems, [
+            f"product {product.pk} started with 3 units but 2 left + "
+            "0 held + 0 sold = 2",
+            f"user {user.pk} has 2 active subscriptions",
+        ])
@@ -0,0 +1,311 @@
+"""
+Both Stripe webhooks under concurrent delivery.
+
+Stripe sends webhooks in parallel and retries an event that has not yet
+been answered, so the same checkout can be handled twice at once. This
+fires signed checkout.session.completed events from `threads` threads,
+each with its own database connection, then checks the invariants the
+webhooks must keep:
+
+- no product's stock goes negative, and every unit is accounted for:
+  stock left + units held by unpaid reservations + units sold = stock
+  at the start;
+- no user has more than one active subscription;
+- no checkout becomes more than one order.
+
+Each checkout's event is delivered twice, and the deliveries are
+shuffled. The events are split evenly between:
+
+- reserved checkouts, each holding one unit of a product as
+  checkout_view does before redirecting to Stripe, each for its own
+  buyer (a user's new checkout gives back their earlier one's stock);
+- checkouts without a reservation (started before reservations existed,
+  or paid after theirs expired), for a product with stock for only half
+  of them;
+- subscription checkouts, spread over `members` users, so several of
+  each user's checkouts complete together.
+
+Events carry real signatures for a throwaway STRIPE_WEBHOOK_SECRET and
+go through the test client, so construct_event is not patched.
+Subscriptions that a newer checkout supersedes are canceled through
+the loadtest Stripe stand-in.
+
+Lock wait is the time spent in statements that can wait for a lock:
+SELECT ... FOR UPDATE, UPDATE, and SQLite's BEGIN IMMEDIATE. It includes
+their own run time, which is small when nothing is contended. Point
+DATABASE_URL at PostgreSQL to measure row locks; SQLite runs one writer
+at a time.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from queue import Empty, Queue
+from unittest.mock import patch
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count, Q, Sum
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from fithub.metrics import quantile
+from fithub.stripe_client import stripe
+from loadtest.stripe_stub import StripeStub, sign_payload
+from store.models import Order, OrderItem, Product, StockReservation
+from store.stock import reserve
+from subscriptions.models import Plan, Subscription
+
+WEBHOOK_SECRET = 'whsec_stress'
+DELIVERIES = 2
+
+
+def locking(sql):
+    sql = sql.lstrip().upper()
+    return sql.startswith(('UPDATE', 'BEGIN')) or 'FOR UPDATE' in sql
+
+
+class LockTimer:
+    """Execute wrapper adding up the time spent in locking statements."""
+
+    def __init__(self):
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        if not locking(sql):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+def seed(checkouts, members):
+    """Create the buyers, products and plan, and reserve stock for the
+    reserved checkouts. Returns the (path, event) list and the stock
+    each product started with."""
+    password = make_password(None)
+    users = User.objects.bulk_create(
+        User(
+            username=f'stress-{i}', email=f'stress-{i}@example.com',
+            password=password,
+        )
+        for i in range(max(members, checkouts))
+    )
+    reserved = Product.objects.create(
+        name='Reserved', description='Stress test.', price=10,
+        stock=checkouts,
+    )
+    scarce = Product.objects.create(
+        name='Scarce', description='Stress test.', price=10,
+        stock=checkouts // 2,
+    )
+    initial_stock = {reserved.pk: reserved.stock, scarce.pk: scarce.stock}
+    plan = Plan.objects.create(
+        name='Stress', description='Stress test.', price=9.99,
+        interval='monthly',
+    )
+
+    oneoff = reverse('store:oneoff_webhook')
+    subscriptions = reverse('stripe_webhook')
+    events = []
+
+    def checkout(path, kind, i, session):
+        session.update(id=f'cs_stress_{kind}{i}', object='checkout.session')
+        events.append((path, {
+            'id': f'evt_stress_{kind}{i}',
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'data': {'object': session},
+        }))
+
+    for i in range(checkouts):
+        user, buyer = users[i % members], users[i]
+        token, _ = reserve(buyer, [(reserved, 1)])
+        checkout(oneoff, 'r', i, {'mode': 'payment', 'metadata': {
+            'user_id': str(buyer.pk),
+            'product_id': str(reserved.pk),
+            'reservation': str(token),
+        }})
+        checkout(oneoff, 'u', i, {'mode': 'payment', 'metadata': {
+            'user_id': str(user.pk),
+            'product_id': str(scarce.pk),
+        }})
+        checkout(subscriptions, 's', i, {
+            'mode': 'subscription',
+            'customer_email': user.email,
+            'subscription': f'sub_stress_{i}',
+            'metadata': {'plan_id': str(plan.pk), 'user_id': str(user.pk)},
+        })
+    return events, initial_stock
+
+
+def deliver(deliveries, threads):
+    """Post every (path, event) in `deliveries` from `threads` threads.
+
+    Returns [(seconds, lock wait seconds, status code)] per delivery.
+    """
+    queue = Queue()
+    for delivery in deliveries:
+        queue.put(delivery)
+    results = []
+    lock = threading.Lock()
+    # Start together, so the first deliveries contend too
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        client = Client(raise_request_exception=False)
+        timer = LockTimer()
+        done = []
+        try:
+            with connection.execute_wrapper(timer):
+                barrier.wait()
+                while True:
+                    try:
+                        path, event = queue.get_nowait()
+                    except Empty:
+                        break
+                    payload = json.dumps(event)
+                    waited = timer.seconds
+                    started = time.perf_counter()
+                    response = client.post(
+                        path, data=payload, content_type='application/json',
+                        HTTP_STRIPE_SIGNATURE=sign_payload(
+                            payload, WEBHOOK_SECRET
+                        ),
+                    )
+                    done.append((
+                        time.perf_counter() - started,
+                        timer.seconds - waited,
+                        response.status_code,
+                    ))
+        finally:
+            connection.close()
+            with lock:
+                results.extend(done)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return results
+
+
+def check_invariants(initial_stock):
+    """Descriptions of every broken invariant; empty if all hold."""
+    problems = []
+    for pk, stock in Product.objects.filter(stock__lt=0).values_list(
+        'pk', 'stock'
+    ):
+        problems.append(f"product {pk} has stock {stock}")
+
+    stock = dict(
+        Product.objects.filter(pk__in=initial_stock)
+        .values_list('pk', 'stock')
+    )
+    held = dict(
+        StockReservation.objects.filter(order__isnull=True)
+        .values('product').annotate(units=Sum('quantity'))
+        .values_list('product', 'units')
+    )
+    sold = dict(
+        OrderItem.objects.values('product').annotate(units=Sum('quantity'))
+        .values_list('product', 'units')
+    )
+    for pk, initial in initial_stock.items():
+        counted = stock[pk] + held.get(pk, 0) + sold.get(pk, 0)
+        if counted != initial:
+            problems.append(
+                f"product {pk} started with {initial} units but "
+                f"{stock[pk]} left + {held.get(pk, 0)} held + "
+                f"{sold.get(pk, 0)} sold = {counted}"
+            )
+
+    for user_id, active in (
+        Subscription.objects.values('user')
+        .annotate(active=Count('pk', filter=Q(status='active')))
+        .filter(active__gt=1).values_list('user', 'active')
+    ):
+        problems.append(f"user {user_id} has {active} active subscriptions")
+
+    for token, orders in (
+        StockReservation.objects.values('token')
+        .annotate(orders=Count('order', distinct=True))
+        .filter(orders__gt=1).values_list('token', 'orders')
+    ):
+        problems.append(f"reservation {token} became {orders} orders")
+    for session, orders in (
+        Order.objects.exclude(stripe_session_id=None)
+        .values('stripe_session_id').annotate(orders=Count('pk'))
+        .filter(orders__gt=1).values_list('stripe_session_id', 'orders')
+    ):
+        problems.append(f"checkout {session} became {orders} orders")
+    return problems
+
+
+def run(events=600, threads=8, members=20, seed_value=0, log=print):
+    """Deliver about `events` webhooks and check the invariants."""
+    checkouts = max(1, events // (3 * DELIVERIES))
+    checkout_events, initial_stock = seed(checkouts, members)
+    deliveries = checkout_events * DELIVERIES
+    random.Random(seed_value).shuffle(deliveries)
+
+    stub = StripeStub('http://testserver', WEBHOOK_SECRET).start()
+    # Half the unreserved checkouts can't be filled, by design; each
+    # would log an error
+    stock_log = logging.getLogger('store.stock')
+    stock_log_level = stock_log.level
+    stock_log.setLevel(logging.CRITICAL)
+    try:
+        with override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET), \
+                patch.object(stripe, 'api_base', stub.url), \
+                patch.object(stripe, 'api_key', 'sk_test_stress'):
+            started = time.perf_counter()
+            timings = deliver(deliveries, threads)
+            elapsed = time.perf_counter() - started
+    finally:
+        stock_log.setLevel(stock_log_level)
+        stub.stop()
+
+    statuses = Counter(status for _, _, status in timings)
+    seconds = [t for t, _, _ in timings]
+    waits = [w for _, w, _ in timings]
+    problems = check_invariants(initial_stock)
+    results = {
+        'database': connection.vendor,
+        'threads': threads,
+        'deliveries': len(timings),
+        'failures': len(timings) - statuses[200],
+        'statuses': {str(code): n for code, n in sorted(statuses.items())},
+        'seconds': elapsed,
+        'per_sec': len(timings) / elapsed if elapsed else 0.0,
+        'p50_ms': quantile(seconds, 0.5) * 1000,
+        'p95_ms': quantile(seconds, 0.95) * 1000,
+        'lock_wait_ms': sum(waits) * 1000,
+        'lock_wait_p95_ms': quantile(waits, 0.95) * 1000,
+        'lock_wait_share': sum(waits) / sum(seconds) if seconds else 0.0,
+        'orders': Order.objects.count(),
+        'active_subscriptions': Subscription.objects.filter(
+            status='active'
+        ).count(),
+        'problems': problems,
+    }
+    log(f"{results['deliveries']} deliveries from {threads} threads on "
+        f"{results['database']} in {elapsed:.2f}s: "
+        f"{results['per_sec']:.0f}/s, p50 {results['p50_ms']:.1f}ms, "
+        f"p95 {results['p95_ms']:.1f}ms")
+    log(f"lock wait {results['lock_wait_ms']:.0f}ms in total, p95 "
+        f"{results['lock_wait_p95_ms']:.1f}ms per delivery, "
+        f"{results['lock_wait_share']:.0%} of request time")
+    log(f"{results['orders']} orders, {results['active_subscriptions']} "
+        f"active subscriptions; responses {results['statuses']}")
+    for problem in problems:
+        log(f"BROKEN: {problem}")
+    if not problems and not results['failures']:
+        log("All invariants held.")
+    return results
@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import ProgressUpdate, NewsletterSubscriber
+
+from fithub.exports import admin_actions
+
+from .models import NewsletterCampaign, NewsletterSubscriber, ProgressUpdate
 
 
 @admin.register(ProgressUpdate)
@@ -26,27 +29,73 @@ class ProgressUpdateAdmin(admin.ModelAdmin):
 class NewsletterSubscriberAdmin(admin.ModelAdmin):
     list_display = ('email', 'subscribed_at', 'is_active')
     search_fields = ('email',)
-    list_filter = ('subscribed_at',)
+    list_filter = ('is_active', 'subscribed_at')
     readonly_fields = ('subscribed_at',)
     ordering = ('-subscribed_at',)
-    actions = ['mark_as_active', 'mark_as_inactive']
-
-    def is_active(self, obj):
-        return format_html(
-            '<span style="color: green; font-weight: bold;">✓ Active</span>'
-        )
-    is_active.short_description = 'Status'
+    actions = [
+        'mark_as_active',
+        'mark_as_inactive',
+        *admin_actions('newsletter'),
+    ]
 
     def mark_as_active(self, request, queryset):
+        updated = queryset.update(is_active=True)
         self.message_user(
             request,
-            f"{queryset.count()} subscribers marked as active."
+            f"{updated} subscribers marked as active."
         )
     mark_as_active.short_description = "Mark selected as active"
 
     def mark_as_inactive(self, request, queryset):
+        updated = queryset.update(is_active=False)
         self.message_user(
             request,
-            f"{queryset.count()} subscribers marked as inactive."
+            f"{updated} subscribers marked as inactive."
         )
     mark_as_inactive.short_description = "Mark selected as inactive"
+
+
+@admin.register(NewsletterCampaign)
+class NewsletterCampaignAdmin(admin.ModelAdmin):
+    list_display = (
+        'subject', 'status', 'sent_count', 'failed_count', 'created_at',
+        'finished_at',
+    )
+    search_fields = ('subject',)
+    list_filter = ('status', 'created_at')
+    readonly_fields = (
+        'status', 'created_at', 'started_at', 'finished_at',
+        'send_command', 'last_recipient_id', 'checkpoint_id', 'sent_count',
+        'failed_count', 'heartbeat_at',
+    )
+    ordering = ('-created_at',)
+
+    fieldsets = (
+        ('Message', {
+            'fields': ('subject', 'body_text', 'body_html')
+        }),
+        ('Sending', {
+            'fields': (
+                'status', 'send_command', 'sent_count', 'failed_count',
+                'created_at', 'started_at', 'finished_at',
+            )
+        }),
+        ('Checkpoint', {
+            'fields': ('last_recipient_id', 'checkpoint_id', 'heartbeat_at'),
+            'classes': ('collapse',)
+        }),
+    )
+
+    def send_command(self, obj):
+        if obj.pk is None or obj.status == 'sent':
+            return '-'
+        return format_html(
+            '<code>python manage.py send_newsletter {}</code>', obj.pk
+        )
+    send_command.short_description = 'Send with'
+
+    def has_change_permission(self, request, obj=None):
+        # The message can't change once it has started going out
+        if obj is not None and obj.status != 'draft':
+            return False
+        return super().has_change_permission(request, obj)
@@ -9,7 +9,10 @@ class ProgressUpdateForm(forms.ModelForm):
         fields = ['title', 'content']
 
 
-class NewsletterForm(forms.ModelForm):
-    class Meta:
-        model = NewsletterSubscriber
-        fields = ['email']
+class NewsletterForm(forms.Form):
+    """Only validates the address; the view inserts it (see
+    core.views.newsletter_subscribe), so there is no uniqueness query."""
+    email = forms.EmailField()
+
+    def clean_email(self):
+        return NewsletterSubscriber.normalize_email(self.cleaned_data['email'])
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import NewsletterCampaign
+from core.newsletter import LEASE, claim, send_campaign
+
+
+class Command(BaseCommand):
+    help = (
+        "Send a newsletter campaign to every active subscriber. Progress is "
+        "saved as it goes, so running the command again after a failure "
+        "resumes where the last run stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('campaign_id', type=int)
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.NEWSLETTER_BATCH_SIZE,
+            help="Subscribers read and sent per SMTP connection.",
+        )
+        parser.add_argument(
+            '--rate', type=float, default=settings.NEWSLETTER_SEND_RATE,
+            help="Maximum messages per second (0 for no limit).",
+        )
+
+    def handle(self, *args, campaign_id, batch_size, rate, **options):
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+        if rate < 0:
+            raise CommandError("--rate can't be negative")
+        try:
+            campaign = NewsletterCampaign.objects.get(pk=campaign_id)
+        except NewsletterCampaign.DoesNotExist:
+            raise CommandError(f"No newsletter campaign {campaign_id}")
+        if campaign.status == 'sent':
+            raise CommandError(f"Campaign {campaign_id} was already sent")
+        if not claim(campaign):
+            raise CommandError(
+                f"Campaign {campaign_id} is being sent by another process. "
+                f"If that process died, retry in "
+                f"{int(LEASE.total_seconds() // 60)} minutes."
+            )
+        if campaign.checkpoint_id:
+            self.stdout.write(
+                f"Resuming after subscriber {campaign.checkpoint_id}"
+            )
+
+        def report(campaign):
+            self.stdout.write(
+                f"Up to subscriber {campaign.checkpoint_id}: "
+                f"{campaign.sent_count} sent, {campaign.failed_count} failed"
+            )
+
+        send_campaign(campaign, batch_size, rate, on_batch=report)
+        self.stdout.write(self.style.SUCCESS(
+            f"Campaign {campaign_id} sent to {campaign.sent_count} "
+            f"subscribers ({campaign.failed_count} failed)"
+        ))
@@ -0,0 +1,130 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from custom_storages import s3_etag
+
+
+def local_files():
+    """{name: path} of every static file, first finder wins.
+
+    The same files, in the same precedence, that collectstatic would copy.
+    """
+    ignore_patterns = apps.get_app_config('staticfiles').ignore_patterns
+    files = {}
+    for finder in finders.get_finders():
+        for path, storage in finder.list(ignore_patterns):
+            name = path
+            if getattr(storage, 'prefix', None):
+                name = os.path.join(storage.prefix, path)
+            files.setdefault(name.replace(os.sep, '/'), storage.path(path))
+    return files
+
+
+class Command(BaseCommand):
+    help = (
+        "Upload static files to the S3 static storage in parallel, skipping "
+        "files whose content is already there. A local manifest of what "
+        "was last uploaded avoids listing the bucket when nothing changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.STATIC_SYNC_WORKERS,
+            help="Number of concurrent uploads.",
+        )
+        parser.add_argument(
+            '--manifest', default=settings.STATIC_SYNC_MANIFEST,
+            help="Path of the local manifest of uploaded ETags.",
+        )
+        parser.add_argument(
+            '--full', action='store_true',
+            help="Ignore the manifest and compare every file with the bucket.",
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="List the files that would be uploaded without uploading.",
+        )
+
+    def handle(self, *args, workers, manifest, full, dry_run, **options):
+        storage = staticfiles_storage
+        if not hasattr(storage, 'remote_etags'):
+            raise CommandError(
+                "syncstatic needs custom_storages.StaticStorage (set "
+                "USE_AWS); use collectstatic for local static files."
+            )
+        files = local_files()
+        etags = {
+            name: s3_etag(path, storage.transfer_config)
+            for name, path in files.items()
+        }
+        target = {'bucket': storage.bucket_name, 'location': storage.location}
+        uploaded = {} if full else self.load_manifest(manifest, target)
+
+        changed = [name for name in etags if uploaded.get(name) != etags[name]]
+        if changed:
+            remote = storage.remote_etags()
+            changed = [name for name in changed
+                       if remote.get(name) != etags[name]]
+        changed.sort()
+
+        if dry_run:
+            for name in changed:
+                self.stdout.write(f"Would upload {name}")
+            self.stdout.write(
+                f"{len(changed)} to upload, {len(etags) - len(changed)} "
+                f"unchanged"
+            )
+            return
+
+        failed = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(storage.upload_path, name, files[name]): name
+                for name in changed
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failed[name] = e
+                    self.stderr.write(f"Failed to upload {name}: {e}")
+                else:
+                    self.stdout.write(f"Uploaded {name}")
+
+        for name in failed:
+            if name in uploaded:
+                etags[name] = uploaded[name]
+            else:
+                del etags[name]
+        self.save_manifest(manifest, target, etags)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(changed) - len(failed)} uploaded, "
+            f"{len(files) - len(changed)} unchanged"
+        ))
+        if failed:
+            raise CommandError(f"{len(failed)} files failed to upload")
+
+    def load_manifest(self, path, target):
+        """ETags last uploaded to `target`, or {} if unknown."""
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if manifest.get('target') != target:
+            return {}
+        return manifest.get('files', {})
+
+    def save_manifest(self, path, target, etags):
+        with open(path, 'w') as f:
+            json.dump({'target': target, 'files': etags}, f, indent=2,
+                      sort_keys=True)
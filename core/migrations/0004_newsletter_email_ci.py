@@ -0,0 +1,48 @@
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+def lowercase_emails(apps, schema_editor):
+    """Lowercase stored addresses so the case-insensitive unique index
+    can be built.
+
+    Subscribers whose addresses then collide are deleted, keeping one per
+    address: an active one if there is one, else the oldest.
+    """
+    NewsletterSubscriber = apps.get_model('core', 'NewsletterSubscriber')
+    seen = set()
+    subscribers = NewsletterSubscriber.objects.order_by('-is_active', 'pk')
+    for subscriber in subscribers:
+        email = subscriber.email.strip().lower()
+        if email in seen:
+            subscriber.delete()
+        else:
+            seen.add(email)
+    for subscriber in NewsletterSubscriber.objects.order_by('pk'):
+        email = subscriber.email.strip().lower()
+        if subscriber.email != email:
+            subscriber.email = email
+            subscriber.save(update_fields=['email'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_newsletter_campaign'),
+    ]
+
+    operations = [
+        migrations.RunPython(lowercase_emails, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='newslettersubscriber',
+            name='email',
+            field=models.EmailField(max_length=254),
+        ),
+        migrations.AddConstraint(
+            model_name='newslettersubscriber',
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.text.Lower('email'),
+                name='core_newsletter_email_ci_unique',
+            ),
+        ),
+    ]
@@ -1,6 +1,11 @@
 from django.db import models
+from django.db.models.functions import Lower
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 
+from fithub.cache_versions import bump_after_commit
+
 
 class ProgressUpdate(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -14,8 +19,70 @@ class ProgressUpdate(models.Model):
 
 
 class NewsletterSubscriber(models.Model):
-    email = models.EmailField(unique=True)
+    email = models.EmailField()
     subscribed_at = models.DateTimeField(auto_now_add=True)
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                Lower('email'), name='core_newsletter_email_ci_unique'
+            ),
+        ]
 
     def __str__(self):
         return self.email
+
+    @staticmethod
+    def normalize_email(email):
+        return email.strip().lower()
+
+    def save(self, *args, **kwargs):
+        self.email = self.normalize_email(self.email)
+        super().save(*args, **kwargs)
+
+
+class NewsletterCampaign(models.Model):
+    """One newsletter sent to every active subscriber.
+
+    core.newsletter.send_campaign() sends it in subscriber id order and
+    records the last id it got through, so a send that stops part way
+    carries on from there when run again.
+    """
+    STATUS_CHOICES = [
+        ('draft', 'Draft'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+    ]
+
+    subject = models.CharField(max_length=200)
+    body_text = models.TextField()
+    body_html = models.TextField(
+        blank=True, help_text="Optional HTML alternative to the text body."
+    )
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default='draft'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # The audience is fixed when sending starts: subscribers up to this id
+    last_recipient_id = models.BigIntegerField(null=True, blank=True)
+    # Checkpoint: every subscriber up to this id has been handled
+    checkpoint_id = models.BigIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    # Renewed after every batch while a sender is working on the campaign
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.subject
+
+
+@receiver(post_save, sender=ProgressUpdate)
+@receiver(post_delete, sender=ProgressUpdate)
+def bump_progress_version(sender, **kwargs):
+    bump_after_commit('progress')
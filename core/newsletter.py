@@ -0,0 +1,164 @@
+"""
+Sending newsletter campaigns to every active subscriber.
+
+Subscribers are read in batches in id order (WHERE id > last id, never
+OFFSET, so each batch costs the same however far into the list it is),
+and each batch goes out over one SMTP connection. Messages are spaced
+to NEWSLETTER_SEND_RATE a second to stay under the mail provider's
+sending limits.
+
+The campaign records the last subscriber id handled after every batch
+(and at least every CHECKPOINT_INTERVAL seconds). If the sender dies,
+running it again carries on from there: only messages sent since the
+last checkpoint can go out twice. While a sender is working it renews
+the campaign's heartbeat, so a second sender started at the same time
+is refused instead of mailing everyone again.
+"""
+import logging
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import NewsletterCampaign, NewsletterSubscriber
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_INTERVAL = 30
+# A campaign whose heartbeat is older than this has no live sender
+LEASE = timedelta(minutes=5)
+
+# Refusals of one message; anything else means the connection is gone
+RECIPIENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError)
+
+
+class Throttle:
+    """Spaces calls to wait() at least 1 / rate seconds apart."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_at = 0
+
+    def wait(self):
+        now = time.monotonic()
+        if now < self.next_at:
+            time.sleep(self.next_at - now)
+            now = self.next_at
+        self.next_at = now + self.interval
+
+
+def claim(campaign):
+    """Take the lease on `campaign` for this process.
+
+    Returns False if the campaign has been sent or another sender holds
+    a live lease. The first claim also fixes the audience: subscribers
+    who join after sending starts get the next campaign instead.
+    """
+    now = timezone.now()
+    claimed = NewsletterCampaign.objects.filter(
+        Q(heartbeat_at__isnull=True) | Q(heartbeat_at__lt=now - LEASE),
+        pk=campaign.pk,
+        status__in=['draft', 'sending'],
+    ).update(status='sending', heartbeat_at=now)
+    if not claimed:
+        return False
+    if campaign.last_recipient_id is None:
+        last_id = NewsletterSubscriber.objects.aggregate(
+            last_id=Max('pk')
+        )['last_id'] or 0
+        NewsletterCampaign.objects.filter(
+            pk=campaign.pk, last_recipient_id__isnull=True
+        ).update(last_recipient_id=last_id, started_at=now)
+    campaign.refresh_from_db()
+    return True
+
+
+def recipients(campaign, batch_size):
+    """The next batch of (id, email) after the campaign's checkpoint."""
+    return list(
+        NewsletterSubscriber.objects.filter(
+            is_active=True,
+            pk__gt=campaign.checkpoint_id,
+            pk__lte=campaign.last_recipient_id,
+        ).order_by('pk').values_list('pk', 'email')[:batch_size]
+    )
+
+
+def save_progress(campaign, **fields):
+    NewsletterCampaign.objects.filter(pk=campaign.pk).update(
+        checkpoint_id=campaign.checkpoint_id,
+        sent_count=campaign.sent_count,
+        failed_count=campaign.failed_count,
+        **fields,
+    )
+
+
+def build_message(campaign, email, connection):
+    message = EmailMultiAlternatives(
+        campaign.subject,
+        campaign.body_text,
+        settings.DEFAULT_FROM_EMAIL,
+        [email],
+        connection=connection,
+    )
+    if campaign.body_html:
+        message.attach_alternative(campaign.body_html, 'text/html')
+    return message
+
+
+def send_batch(campaign, batch, throttle):
+    """Send one message per recipient in `batch` over one connection."""
+    saved_at = time.monotonic()
+    with get_connection() as connection:
+        for pk, email in batch:
+            throttle.wait()
+            try:
+                connection.send_messages(
+                    [build_message(campaign, email, connection)]
+                )
+            except RECIPIENT_ERRORS as e:
+                logger.warning(
+                    "Newsletter %s not delivered to subscriber %s: %s",
+                    campaign.pk, pk, e,
+                )
+                campaign.failed_count += 1
+            else:
+                campaign.sent_count += 1
+            campaign.checkpoint_id = pk
+            if time.monotonic() - saved_at >= CHECKPOINT_INTERVAL:
+                save_progress(campaign, heartbeat_at=timezone.now())
+                saved_at = time.monotonic()
+
+
+def send_campaign(campaign, batch_size=None, rate=None, on_batch=None):
+    """Send `campaign`, which must have been claim()ed, to the rest of
+    its audience, calling on_batch(campaign) after every batch.
+    """
+    if batch_size is None:
+        batch_size = settings.NEWSLETTER_BATCH_SIZE
+    if rate is None:
+        rate = settings.NEWSLETTER_SEND_RATE
+    throttle = Throttle(rate)
+    try:
+        while batch := recipients(campaign, batch_size):
+            send_batch(campaign, batch, throttle)
+            save_progress(campaign, heartbeat_at=timezone.now())
+            if on_batch is not None:
+                on_batch(campaign)
+    except BaseException:
+        # Keep what got through and let the next run resume right away
+        save_progress(campaign, heartbeat_at=None)
+        raise
+    campaign.status = 'sent'
+    campaign.finished_at = timezone.now()
+    save_progress(
+        campaign,
+        status=campaign.status,
+        finished_at=campaign.finished_at,
+        heartbeat_at=None,
+    )
+    return campaign
@@ -1,5 +1,21 @@
+from hashlib import md5
+
 from django.contrib.sitemaps import Sitemap
+from django.contrib.sitemaps import views as sitemap_views
+from django.core.cache import cache
+from django.db.models import Max
+from django.http import HttpResponse
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import parse_http_date_safe
+
+from fithub.cache_versions import get_versions
+from store.models import Product
+from subscriptions.models import Plan
+
+# Rendered sitemaps are rebuilt when a product or plan changes; this only
+# bounds how long an unused page stays in the cache.
+SITEMAP_CACHE_TIMEOUT = 60 * 60 * 24
 
 
 class StaticViewSitemap(Sitemap):
@@ -10,9 +26,116 @@ class StaticViewSitemap(Sitemap):
         return [
             'home',
             'store:product_list',
-            'subscriptions:plan_list',
             'core:progress_list',
         ]
 
     def location(self, item):
         return reverse(item)
+
+
+class ProductSitemap(Sitemap):
+    """Every product page; split into pages of `limit` (50,000) URLs,
+    each listed in the sitemap index."""
+    priority = 0.8
+    changefreq = 'weekly'
+
+    def items(self):
+        return Product.objects.order_by('pk').only('pk', 'updated_at')
+
+    def location(self, product):
+        return reverse('store:product_detail', args=[product.pk])
+
+    def lastmod(self, product):
+        return product.updated_at
+
+    def get_latest_lastmod(self):
+        # The default would load every product to find the newest
+        return Product.objects.aggregate(
+            latest=Max('updated_at')
+        )['latest']
+
+
+class PlanSitemap(Sitemap):
+    """The plan list, the only page plans have, last modified when an
+    active plan last changed."""
+    priority = 0.9
+    changefreq = 'weekly'
+
+    def items(self):
+        return ['subscriptions:plan_list']
+
+    def location(self, item):
+        return reverse(item)
+
+    def lastmod(self, item):
+        return Plan.objects.filter(is_active=True).aggregate(
+            latest=Max('updated_at')
+        )['latest']
+
+
+SITEMAPS = {
+    'static': StaticViewSitemap,
+    'products': ProductSitemap,
+    'plans': PlanSitemap,
+}
+
+
+def cached_sitemap(request, view, **kwargs):
+    """Serve `view`'s sitemap XML from the cache, with conditional GET.
+
+    Entries are keyed by the product and plan versions (see
+    fithub.cache_versions), so any change to either renders a fresh
+    copy. A request whose If-None-Match or If-Modified-Since still
+    matches gets a 304 without a body.
+    """
+    page = request.GET.get('p', '1')
+    key = 'sitemap:' + md5(
+        repr((
+            get_versions('products', 'plans'),
+            request.scheme,
+            request.get_host(),
+            kwargs.get('section'),
+            page,
+        )).encode(),
+        usedforsecurity=False,
+    ).hexdigest()
+    entry = cache.get(key)
+    if entry is None:
+        response = view(request, sitemaps=SITEMAPS, **kwargs)
+        response.render()
+        content = response.content
+        entry = {
+            'content': content,
+            'content_type': response['Content-Type'],
+            'etag': quote_etag(
+                md5(content, usedforsecurity=False).hexdigest()
+            ),
+            'last_modified': response.get('Last-Modified'),
+        }
+        cache.set(key, entry, SITEMAP_CACHE_TIMEOUT)
+
+    last_modified = None
+    if entry['last_modified']:
+        last_modified = parse_http_date_safe(entry['last_modified'])
+    response = get_conditional_response(
+        request, etag=entry['etag'], last_modified=last_modified
+    )
+    if response is None:
+        response = HttpResponse(
+            entry['content'], content_type=entry['content_type']
+        )
+    response['ETag'] = entry['etag']
+    if entry['last_modified']:
+        response['Last-Modified'] = entry['last_modified']
+    response['X-Robots-Tag'] = 'noindex, noodp, noarchive'
+    return response
+
+
+def sitemap_index(request):
+    return cached_sitemap(
+        request, sitemap_views.index, sitemap_url_name='sitemap_section'
+    )
+
+
+def sitemap_section(request, section):
+    return cached_sitemap(request, sitemap_views.sitemap, section=section)
@@ -1,7 +1,27 @@
+import smtplib
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError
+from django.test import RequestFactory, override_settings
 from django.urls import reverse
-from .models import ProgressUpdate, NewsletterSubscriber
+from django.utils import timezone
+
+from fithub.ratelimit import client_ip
+
+from store.models import Product
+from subscriptions.models import Plan
+
+from . import newsletter
+from .sitemaps import ProductSitemap
+from .models import NewsletterCampaign, NewsletterSubscriber, ProgressUpdate
 
 # Get the active user model (custom or default)
 User = get_user_model()
@@ -144,6 +164,8 @@ class CoreViewTests(TestCase):
     list/create/delete and newsletter actions."""
 
     def setUp(self):
+        # Signups are rate limited per IP in the cache
+        cache.clear()
         # Create a user and a sample progress update for view tests
         self.user = User.objects.create_user(
             username='coreuser',
@@ -366,6 +388,40 @@ class CoreViewTests(TestCase):
             1
         )
 
+    def test_newsletter_subscribe_is_case_insensitive(self):
+        # A repeat signup in another case is one INSERT that changes nothing
+        NewsletterSubscriber.objects.create(email='Fan@Example.com')
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                reverse('core:newsletter_subscribe'),
+                {'email': ' FAN@example.COM '},
+                follow=False,
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            list(NewsletterSubscriber.objects.values_list('email', flat=True)),
+            ['fan@example.com'],
+        )
+
+    def test_newsletter_subscriber_unique_ignores_case(self):
+        NewsletterSubscriber.objects.create(email='fan@example.com')
+        with self.assertRaises(IntegrityError):
+            NewsletterSubscriber.objects.bulk_create(
+                [NewsletterSubscriber(email='FAN@example.com')]
+            )
+
+    @override_settings(NEWSLETTER_SIGNUP_LIMIT=2)
+    def test_newsletter_subscribe_rate_limited_by_ip(self):
+        url = reverse('core:newsletter_subscribe')
+        for i in range(3):
+            self.client.post(url, {'email': f'fan{i}@example.com'})
+        self.assertEqual(NewsletterSubscriber.objects.count(), 2)
+        # Another address still gets through
+        self.client.post(
+            url, {'email': 'other@example.com'}, REMOTE_ADDR='10.0.0.9'
+        )
+        self.assertEqual(NewsletterSubscriber.objects.count(), 3)
+
     def test_progress_create_view_invalid_post(self):
         # Missing required title should return form with errors (status 200)
         self.client.login(username='coreuser', password='pass')
@@ -413,3 +469,280 @@ class CoreViewTests(TestCase):
                 title='Progress with émojis & symbols! 💪'
             ).exists()
         )
+
+
+class NewsletterSendTests(TestCase):
+    """send_newsletter: batches, checkpoints and resuming."""
+
+    def setUp(self):
+        self.subscribers = [
+            NewsletterSubscriber.objects.create(email=f'fan{i}@example.com')
+            for i in range(7)
+        ]
+        NewsletterSubscriber.objects.filter(
+            pk=self.subscribers[3].pk
+        ).update(is_active=False)
+        self.campaign = NewsletterCampaign.objects.create(
+            subject='Spring plans',
+            body_text='New plans are live.',
+            body_html='<p>New plans are live.</p>',
+        )
+
+    def send(self, batch_size=3):
+        call_command(
+            'send_newsletter', self.campaign.pk,
+            batch_size=batch_size, rate=0, stdout=StringIO(),
+        )
+        self.campaign.refresh_from_db()
+
+    def recipients(self):
+        return [message.to[0] for message in mail.outbox]
+
+    def test_sends_to_active_subscribers_in_id_order(self):
+        self.send()
+        expected = [
+            s.email for s in self.subscribers if s.email != 'fan3@example.com'
+        ]
+        self.assertEqual(self.recipients(), expected)
+        self.assertEqual(self.campaign.status, 'sent')
+        self.assertEqual(self.campaign.sent_count, 6)
+        self.assertEqual(
+            self.campaign.checkpoint_id, self.subscribers[-1].pk
+        )
+        self.assertIsNotNone(self.campaign.finished_at)
+        self.assertIsNone(self.campaign.heartbeat_at)
+        html, mimetype = mail.outbox[0].alternatives[0]
+        self.assertEqual(mimetype, 'text/html')
+
+    def test_one_connection_per_batch(self):
+        with mock.patch(
+            'core.newsletter.get_connection',
+            wraps=newsletter.get_connection,
+        ) as get_connection:
+            self.send(batch_size=4)
+        self.assertEqual(get_connection.call_count, 2)
+
+    def test_resumes_after_connection_failure(self):
+        send_messages = EmailBackend.send_messages
+        calls = []
+
+        def flaky(backend, messages):
+            calls.append(messages)
+            if len(calls) == 3:
+                raise smtplib.SMTPServerDisconnected('gone')
+            return send_messages(backend, messages)
+
+        with mock.patch.object(EmailBackend, 'send_messages', flaky):
+            with self.assertRaises(smtplib.SMTPServerDisconnected):
+                self.send()
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'sending')
+        self.assertEqual(
+            self.campaign.checkpoint_id, self.subscribers[1].pk
+        )
+        self.assertIsNone(self.campaign.heartbeat_at)
+
+        self.send()
+        self.assertEqual(len(self.recipients()), 6)
+        self.assertEqual(len(set(self.recipients())), 6)
+        self.assertEqual(self.campaign.status, 'sent')
+        self.assertEqual(self.campaign.sent_count, 6)
+
+    def test_refused_recipient_is_counted_and_skipped(self):
+        send_messages = EmailBackend.send_messages
+
+        def refuse_fan1(backend, messages):
+            if messages[0].to == ['fan1@example.com']:
+                raise smtplib.SMTPRecipientsRefused({})
+            return send_messages(backend, messages)
+
+        with mock.patch.object(EmailBackend, 'send_messages', refuse_fan1), \
+                self.assertLogs('core.newsletter', 'WARNING'):
+            self.send()
+        self.assertEqual(self.campaign.sent_count, 5)
+        self.assertEqual(self.campaign.failed_count, 1)
+        self.assertNotIn('fan1@example.com', self.recipients())
+
+    def test_audience_is_fixed_when_sending_starts(self):
+        self.assertTrue(newsletter.claim(self.campaign))
+        NewsletterSubscriber.objects.create(email='late@example.com')
+        newsletter.send_campaign(self.campaign, batch_size=3, rate=0)
+        self.assertNotIn('late@example.com', self.recipients())
+
+    def test_refuses_campaign_with_live_sender(self):
+        NewsletterCampaign.objects.filter(pk=self.campaign.pk).update(
+            status='sending', heartbeat_at=timezone.now()
+        )
+        with self.assertRaisesMessage(CommandError, 'another process'):
+            self.send()
+        self.assertEqual(mail.outbox, [])
+
+    def test_takes_over_expired_lease(self):
+        NewsletterCampaign.objects.filter(pk=self.campaign.pk).update(
+            status='sending',
+            heartbeat_at=timezone.now() - newsletter.LEASE - timedelta(1),
+        )
+        self.send()
+        self.assertEqual(self.campaign.status, 'sent')
+
+    def test_refuses_sent_campaign(self):
+        self.send()
+        with self.assertRaisesMessage(CommandError, 'already sent'):
+            self.send()
+        self.assertEqual(len(mail.outbox), 6)
+
+    def test_throttle_spaces_messages(self):
+        clock = [100.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            clock[0] += seconds
+
+        with mock.patch('core.newsletter.time.monotonic',
+                        lambda: clock[0]), \
+                mock.patch('core.newsletter.time.sleep', sleep):
+            throttle = newsletter.Throttle(rate=4)
+            for _ in range(3):
+                throttle.wait()
+        self.assertEqual(sleeps, [0.25, 0.25])
+
+
+class NewsletterAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass'
+        ))
+        self.subscriber = NewsletterSubscriber.objects.create(
+            email='fan@example.com'
+        )
+
+    def test_mark_as_inactive_updates_subscribers(self):
+        url = reverse('admin:core_newslettersubscriber_changelist')
+        self.client.post(url, {
+            'action': 'mark_as_inactive',
+            '_selected_action': [self.subscriber.pk],
+        })
+        self.subscriber.refresh_from_db()
+        self.assertFalse(self.subscriber.is_active)
+        self.client.post(url, {
+            'action': 'mark_as_active',
+            '_selected_action': [self.subscriber.pk],
+        })
+        self.subscriber.refresh_from_db()
+        self.assertTrue(self.subscriber.is_active)
+
+    def test_campaign_is_read_only_once_sending(self):
+        campaign = NewsletterCampaign.objects.create(
+            subject='Hi', body_text='Hello', status='sending'
+        )
+        url = reverse(
+            'admin:core_newslettercampaign_change', args=[campaign.pk]
+        )
+        response = self.client.post(url, {
+            'subject': 'Changed', 'body_text': 'Changed',
+        })
+        self.assertEqual(response.status_code, 403)
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.subject, 'Hi')
+
+
+class ClientIPTests(TestCase):
+    def request(self, forwarded=None):
+        meta = {'REMOTE_ADDR': '10.0.0.1'}
+        if forwarded is not None:
+            meta['HTTP_X_FORWARDED_FOR'] = forwarded
+        return RequestFactory().get('/', **meta)
+
+    @override_settings(TRUSTED_PROXY_COUNT=0)
+    def test_ignores_forwarded_for_without_proxies(self):
+        self.assertEqual(client_ip(self.request('1.2.3.4')), '10.0.0.1')
+
+    @override_settings(TRUSTED_PROXY_COUNT=1)
+    def test_trusts_only_the_proxy_added_entry(self):
+        self.assertEqual(
+            client_ip(self.request('6.6.6.6, 1.2.3.4')), '1.2.3.4'
+        )
+        self.assertEqual(client_ip(self.request()), '10.0.0.1')
+
+
+class SitemapTests(TestCase):
+    """Sitemap index, product and plan sections, caching and 304s."""
+
+    def setUp(self):
+        cache.clear()
+        self.products = [
+            Product.objects.create(name=f'Product {i}', description='x')
+            for i in range(3)
+        ]
+        Plan.objects.create(
+            name='Monthly', description='x', price=10, interval='monthly'
+        )
+
+    def test_index_lists_every_section(self):
+        response = self.client.get(reverse('sitemap_index'))
+        self.assertEqual(response.status_code, 200)
+        for section in ('static', 'products', 'plans'):
+            self.assertContains(
+                response,
+                reverse('sitemap_section', kwargs={'section': section}),
+            )
+
+    def test_product_section_lists_products_with_lastmod(self):
+        response = self.client.get(
+            reverse('sitemap_section', kwargs={'section': 'products'})
+        )
+        for product in self.products:
+            self.assertContains(
+                response, reverse('store:product_detail', args=[product.pk])
+            )
+        self.assertContains(response, '<lastmod>', count=3)
+        self.assertIn('Last-Modified', response)
+
+    def test_plan_section_lists_plan_list(self):
+        response = self.client.get(
+            reverse('sitemap_section', kwargs={'section': 'plans'})
+        )
+        self.assertContains(response, reverse('subscriptions:plan_list'))
+
+    def test_unknown_section_404s(self):
+        response = self.client.get(
+            reverse('sitemap_section', kwargs={'section': 'nope'})
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_index_paginates_large_sections(self):
+        with mock.patch.object(ProductSitemap, 'limit', 2):
+            index = self.client.get(reverse('sitemap_index'))
+            url = reverse('sitemap_section', kwargs={'section': 'products'})
+            self.assertContains(index, f'{url}?p=2')
+            page = self.client.get(url, {'p': 2})
+        self.assertContains(page, '<url>', count=1)
+
+    def test_served_from_cache_until_products_change(self):
+        url = reverse('sitemap_section', kwargs={'section': 'products'})
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='New', description='x')
+        response = self.client.get(url)
+        self.assertContains(
+            response, reverse('store:product_detail', args=[product.pk])
+        )
+
+    def test_conditional_get_returns_304(self):
+        url = reverse('sitemap_section', kwargs={'section': 'products'})
+        response = self.client.get(url)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='New', description='x')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
@@ -1,16 +1,26 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from .models import ProgressUpdate
+from .models import NewsletterSubscriber, ProgressUpdate
 from .forms import ProgressUpdateForm, NewsletterForm
+from fithub.decorators import query_budget
+from fithub.page_cache import public_page
+from fithub.ratelimit import client_ip, is_limited
 
 
+@query_budget(3)
+@public_page('progress')
 def progress_list(request):
     """Display all community progress updates."""
-    updates = ProgressUpdate.objects.all().order_by('-created_at')
+    updates = (
+        ProgressUpdate.objects.select_related('user')
+        .order_by('-created_at')
+    )
     return render(request, 'core/progress_list.html', {'updates': updates})
 
 
+@query_budget(2)
 @login_required
 def progress_create(request):
     """Allow logged-in users to post a new progress update."""
@@ -24,6 +34,7 @@ def progress_create(request):
     return render(request, 'core/progress_form.html', {'form': form})
 
 
+@query_budget(3)
 @login_required
 def progress_delete(request, pk):
     """Allow users to delete their own progress update."""
@@ -39,12 +50,31 @@ def progress_delete(request, pk):
     )
 
 
+@query_budget(1)
 def newsletter_subscribe(request):
-    """Handle newsletter signup form in footer."""
+    """Handle newsletter signup form in footer.
+
+    The address is stored with a single INSERT that skips addresses
+    already on the list (in any case), so subscribing twice is not an
+    error and concurrent signups can't race a uniqueness check. An
+    address deactivated in the admin stays deactivated.
+    """
     if request.method == 'POST':
         form = NewsletterForm(request.POST)
-        if form.is_valid():
-            form.save()
+        if is_limited(
+            'newsletter',
+            client_ip(request),
+            settings.NEWSLETTER_SIGNUP_LIMIT,
+            settings.NEWSLETTER_SIGNUP_WINDOW,
+        ):
+            messages.error(
+                request, "Too many signups. Please try again later."
+            )
+        elif form.is_valid():
+            NewsletterSubscriber.objects.bulk_create(
+                [NewsletterSubscriber(email=form.cleaned_data['email'])],
+                ignore_conflicts=True,
+            )
             messages.success(request, "Subscribed to newsletter!")
         else:
             messages.error(request, "Invalid email address.")
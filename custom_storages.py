@@ -1,10 +1,109 @@
+"""
+S3 storages, used when USE_AWS is set.
+
+MediaStorage can hand out presigned POSTs so the admin uploads product
+images straight from the browser to the bucket. StaticStorage exposes
+what core's syncstatic command needs to upload only changed files, in
+parallel: the remote ETags and a thread-safe single-file upload.
+"""
+import hashlib
+import os
+import uuid
+from pathlib import PurePosixPath
+
 from django.conf import settings
 from storages.backends.s3boto3 import S3Boto3Storage
+from storages.utils import clean_name
+
+# Form field names for the object parameters a presigned POST can set
+POST_FIELDS = {
+    'ACL': 'acl',
+    'CacheControl': 'Cache-Control',
+    'ContentType': 'Content-Type',
+    'Expires': 'Expires',
+}
+
+
+def s3_etag(path, transfer_config):
+    """The ETag S3 will report for `path` once uploaded with `transfer_config`.
+
+    Single-part uploads get the MD5 of the content; multipart uploads get
+    the MD5 of the part digests followed by the part count.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < transfer_config.multipart_threshold:
+            return hashlib.md5(f.read(), usedforsecurity=False).hexdigest()
+        chunksize = transfer_config.multipart_chunksize
+        digests = [
+            hashlib.md5(chunk, usedforsecurity=False).digest()
+            for chunk in iter(lambda: f.read(chunksize), b'')
+        ]
+    digest = hashlib.md5(b''.join(digests), usedforsecurity=False)
+    return f'{digest.hexdigest()}-{len(digests)}'
 
 
 class StaticStorage(S3Boto3Storage):
-    location = settings.STATICFILES_LOCATION
+    location = getattr(settings, 'STATICFILES_LOCATION', 'static')
+
+    def remote_etags(self):
+        """{name: ETag} for every object under this storage's location."""
+        prefix = f'{self.location}/' if self.location else ''
+        client = self.connection.meta.client
+        paginator = client.get_paginator('list_objects_v2')
+        etags = {}
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', ()):
+                etags[obj['Key'][len(prefix):]] = obj['ETag'].strip('"')
+        return etags
+
+    def upload_path(self, name, path):
+        """Upload the local file `path` as `name`.
+
+        Goes through the (thread-safe) low-level client rather than the
+        bucket resource so it can run from several threads at once.
+        """
+        key = self._normalize_name(clean_name(name))
+        self.connection.meta.client.upload_file(
+            path,
+            self.bucket_name,
+            key,
+            ExtraArgs=self._get_write_parameters(key),
+            Config=self.transfer_config,
+        )
 
 
 class MediaStorage(S3Boto3Storage):
-    location = settings.MEDIAFILES_LOCATION
+    location = getattr(settings, 'MEDIAFILES_LOCATION', 'media')
+
+    def presigned_post(self, name, content_type, max_size, expires):
+        """Let a browser upload a file as `name` directly to the bucket.
+
+        A random suffix keeps the stored name unique. Returns the stored
+        name together with the URL and form fields of the POST; the policy
+        pins the content type and caps the size at `max_size` bytes.
+        """
+        path = PurePosixPath(clean_name(name))
+        name = str(path.with_name(
+            f'{path.stem}-{uuid.uuid4().hex[:12]}{path.suffix.lower()}'
+        ))
+        key = self._normalize_name(name)
+        params = {
+            **self._get_write_parameters(key),
+            'ContentType': content_type,
+        }
+        fields = {
+            POST_FIELDS[param]: value
+            for param, value in params.items()
+            if param in POST_FIELDS
+        }
+        post = self.connection.meta.client.generate_presigned_post(
+            self.bucket_name,
+            key,
+            Fields=fields,
+            Conditions=[
+                *({field: value} for field, value in fields.items()),
+                ['content-length-range', 1, max_size],
+            ],
+            ExpiresIn=expires,
+        )
+        return {'name': name, 'url': post['url'], 'fields': post['fields']}
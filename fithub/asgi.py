@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fithub.settings')
 
 application = get_asgi_application()
+
+# Compile every template in this worker before it takes traffic.
+if settings.TEMPLATE_WARMUP:
+    from fithub.warmup import warm_templates
+    warm_templates()
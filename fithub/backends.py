@@ -0,0 +1,85 @@
+"""
+Cache and template backends that report into fithub.metrics.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from django.template.backends.django import DjangoTemplates, Template
+
+from fithub.metrics import record_cache, record_template
+
+_MISSING = object()
+_reading = ContextVar('instrumented_cache_reading', default=False)
+
+
+@contextmanager
+def _outermost_read():
+    if _reading.get():
+        yield False
+        return
+    token = _reading.set(True)
+    try:
+        yield True
+    finally:
+        _reading.reset(token)
+
+
+class InstrumentedCacheMixin:
+    """Counts the cache's hits and misses per request.
+
+    Some backends implement get() with get_many() or the other way round,
+    so only the outermost of the two is counted.
+    """
+
+    def get(self, key, default=None, version=None):
+        with _outermost_read() as outermost:
+            value = super().get(key, _MISSING, version)
+        if outermost:
+            hit = value is not _MISSING
+            record_cache(int(hit), int(not hit))
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        with _outermost_read() as outermost:
+            found = super().get_many(keys, version)
+        if outermost:
+            record_cache(len(found), len(keys) - len(found))
+        return found
+
+
+class InstrumentedLocMemCache(InstrumentedCacheMixin, LocMemCache):
+    """Local-memory cache, private to each process."""
+
+
+class InstrumentedDatabaseCache(InstrumentedCacheMixin, DatabaseCache):
+    """Cache table shared by every worker; see createcachetable."""
+
+
+class InstrumentedRedisCache(InstrumentedCacheMixin, RedisCache):
+    """Redis cache shared by every worker."""
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            record_template(time.perf_counter() - start)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Django template backend that times top-level template renders."""
+
+    def from_string(self, template_code):
+        template = super().from_string(template_code)
+        return InstrumentedTemplate(template.template, self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return InstrumentedTemplate(template.template, self)
@@ -0,0 +1,61 @@
+"""
+Version counters for cached content derived from the database.
+
+Cache keys and ETags built from get_version(name) change as soon as
+bump_version(name) runs. The models' post_save and post_delete
+receivers bump through bump_after_commit(), once the change is
+committed: bumped any earlier, a request could read the new version
+with the old rows and cache stale content under the new key, where no
+later bump would move it. Entries under an old version are never read
+again and simply expire. Updates that bypass signals
+(QuerySet.update(), bulk_create()) don't bump the version.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _key(name):
+    return f'version:{name}'
+
+
+def get_version(name):
+    """The current version of `name`, starting one if there is none.
+
+    New versions are taken from the clock, so a cache that was cleared
+    or evicted never hands out a version that was used before.
+    """
+    key = _key(name)
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def get_versions(*names):
+    """get_version() for several names, in one cache round trip."""
+    found = cache.get_many([_key(name) for name in names])
+    return tuple(
+        found.get(_key(name)) or get_version(name) for name in names
+    )
+
+
+def bump_version(name):
+    try:
+        cache.incr(_key(name))
+    except ValueError:
+        # No version yet; the next get_version() starts a new one
+        pass
+
+
+def bump_after_commit(*names):
+    """bump_version() each of `names` once the current transaction
+    commits, or at once outside a transaction. Nothing is bumped if it
+    rolls back."""
+    def bump():
+        for name in names:
+            bump_version(name)
+    transaction.on_commit(bump)
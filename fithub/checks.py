@@ -0,0 +1,24 @@
+"""
+System checks for settings that only go wrong with more than one worker.
+"""
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, register
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """The default cache must be shared by every process.
+
+    Version counters in it invalidate cached pages, ETags and the
+    sitemap; a per-process cache leaves other workers serving stale
+    pages and handing out different ETags for the same one.
+    """
+    if isinstance(caches['default'], LocMemCache):
+        return [Error(
+            "The default cache is local to each process.",
+            hint="Set REDIS_URL, or use the database cache outside "
+                 "development (run createcachetable).",
+            id='fithub.E001',
+        )]
+    return []
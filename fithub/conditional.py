@@ -0,0 +1,70 @@
+"""
+Conditional GET for public pages.
+
+Only visitors without a session or messages cookie get an ETag. For them
+a page is the same for everyone apart from the CSRF token, which comes
+from their csrftoken cookie. The ETag hashes:
+
+- the versions of the data the page shows (fithub.cache_versions);
+- the view's arguments and query string;
+- the CSRF cookie;
+- the deployed release.
+
+Computing it only reads the cache, so a revalidation that matches is
+answered with a 304 before the view queries or renders anything.
+"""
+from hashlib import md5
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.views.decorators.http import condition
+
+from fithub.cache_versions import get_versions
+
+# Stands in for RELEASE_VERSION when it isn't set, so a restart with new
+# templates or static files can't match ETags of the old code.
+BOOT_ID = uuid4().hex
+
+
+def is_public_request(request):
+    """True if nothing about the response depends on who is asking."""
+    return (
+        settings.SESSION_COOKIE_NAME not in request.COOKIES
+        and CookieStorage.cookie_name not in request.COOKIES
+    )
+
+
+def release():
+    return settings.RELEASE_VERSION or BOOT_ID
+
+
+def digest(parts):
+    return md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+
+
+def public_etag(*version_names, csrf=True):
+    """ETag function for condition(), or None for personal requests.
+
+    csrf=False leaves out the CSRF cookie, for pages that don't embed
+    the token (see fithub.page_cache).
+    """
+    def etag(request, *args, **kwargs):
+        if not is_public_request(request):
+            return None
+        return digest((
+            get_versions(*version_names),
+            args,
+            sorted(kwargs.items()),
+            request.GET.urlencode(),
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME, '') if csrf else '',
+            release(),
+        ))
+    return etag
+
+
+def conditional_page(*version_names):
+    """Answer anonymous revalidations of a page built from the data in
+    `version_names` with 304 Not Modified while none of it has changed.
+    """
+    return condition(etag_func=public_etag(*version_names))
@@ -1,7 +1,98 @@
+"""
+Context for templates/base.html.
+
+Everything here is lazy: a value is only computed when a template uses
+it, so pages that never show it pay nothing. The navbar's user and cart
+badge are also cached, so the header alone does not load the session or
+the user row on every page.
+"""
+from collections import namedtuple
+
 from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+from fithub.page_cache import CSRF_PLACEHOLDER
+from store.utils import cart_count
+
+NavUser = namedtuple('NavUser', 'is_authenticated username is_staff')
+ANONYMOUS = NavUser(False, '', False)
+
+# How long a session is assumed to belong to the same user. Login and
+# logout both start a new session, so this only bounds how long an expired
+# or deleted session can still show its user's name.
+NAV_SESSION_TIMEOUT = 300
+
+
+def _session_key(session_key):
+    return f'nav-session:{session_key}'
+
+
+def _user_key(user_id):
+    return f'nav-user:{user_id}'
+
+
+def forget_nav_user(user_id):
+    """Drop the cached navbar entry for a user; see users.models."""
+    cache.delete(_user_key(user_id))
+
+
+def nav_user(request):
+    """The signed-in user as the navbar shows it.
+
+    The cache remembers which user a session belongs to and each user's
+    name and staff flag. Cached entries are only trusted while the
+    session's auth hash matches the user's, the same check
+    django.contrib.auth.get_user() makes; otherwise request.user decides.
+    """
+    session = getattr(request, 'session', None)
+    if session is None or session.session_key is None:
+        return ANONYMOUS
+    session_key = session.session_key
+    session_entry = cache.get(_session_key(session_key))
+    if session_entry is not None:
+        user_id, session_hash = session_entry
+        if user_id is None:
+            return ANONYMOUS
+        user_entry = cache.get(_user_key(user_id))
+        if user_entry is not None and user_entry[0] == session_hash:
+            return NavUser(*user_entry[1])
+
+    user = request.user
+    if not user.is_authenticated:
+        cache.set(_session_key(session_key), (None, None), NAV_SESSION_TIMEOUT)
+        return ANONYMOUS
+    entry = NavUser(True, user.get_username(), user.is_staff)
+    cache.set(
+        _session_key(session_key),
+        (user.pk, session.get(HASH_SESSION_KEY)),
+        NAV_SESSION_TIMEOUT,
+    )
+    cache.set(
+        _user_key(user.pk),
+        (user.get_session_auth_hash(), tuple(entry)),
+        settings.SESSION_COOKIE_AGE,
+    )
+    return entry
+
+
+def navbar(request):
+    return {
+        'nav_user': SimpleLazyObject(lambda: nav_user(request)),
+        'cart_count': SimpleLazyObject(lambda: cart_count(request)),
+    }
 
 
-def stripe_keys(request):
+def public_page(request):
+    """On fithub.page_cache.public_page() renders, stand a placeholder in
+    for the CSRF token; static/js/csrf.js fills in the visitor's own."""
+    if not getattr(request, 'public_page', False):
+        return {}
     return {
-        'STRIPE_PUBLIC_KEY': settings.STRIPE_PUBLIC_KEY
+        'csrf_token': CSRF_PLACEHOLDER,
+        'public_page': {
+            'csrf_placeholder': CSRF_PLACEHOLDER,
+            'csrf_cookie': settings.CSRF_COOKIE_NAME,
+        },
     }
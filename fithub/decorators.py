@@ -0,0 +1,22 @@
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+
+
+def query_budget(max_queries):
+    """Declare the maximum number of SQL queries a view may run.
+
+    The budget is enforced by the query-count harness in fithub/tests.py,
+    which crawls every named route at several data sizes.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            async def _wrapped_view(request, *args, **kwargs):
+                return await view_func(request, *args, **kwargs)
+        else:
+            def _wrapped_view(request, *args, **kwargs):
+                return view_func(request, *args, **kwargs)
+        _wrapped_view = wraps(view_func)(_wrapped_view)
+        _wrapped_view.query_budget = max_queries
+        return _wrapped_view
+    return decorator
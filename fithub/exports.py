@@ -0,0 +1,167 @@
+"""
+Streaming CSV and JSON Lines exports for staff.
+
+Each export is a fixed list of columns read with values_list() and
+iterated in chunks, one line per row, so memory use does not grow with
+the table. The same exports are served at /exports/<name>/ (see
+fithub.views.export) and as admin actions on the selected rows.
+
+Under ASGI a StreamingHttpResponse would read a synchronous iterator
+into a list before sending it, so there the lines come from an async
+generator instead.
+"""
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.contrib import admin
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from core.models import NewsletterSubscriber
+from store.models import Order, Review
+from subscriptions.models import Subscription
+
+CHUNK_SIZE = 2000
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# Spreadsheets run cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class Echo:
+    """File-like object whose write() returns what was written."""
+
+    def write(self, value):
+        return value
+
+
+def csv_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class Export:
+    def __init__(self, model, columns):
+        self.model = model
+        self.headers = [header for header, _ in columns]
+        self.lookups = [lookup for _, lookup in columns]
+
+    def rows(self, queryset=None):
+        if queryset is None:
+            queryset = self.model._default_manager.all()
+        return queryset.order_by('pk').values_list(*self.lookups)
+
+    def formatter(self, fmt):
+        """(first line or None, row -> line) for `fmt`."""
+        if fmt == 'csv':
+            writer = csv.writer(Echo())
+            return (
+                writer.writerow(self.headers),
+                lambda row: writer.writerow([csv_cell(v) for v in row]),
+            )
+        return None, lambda row: json.dumps(
+            dict(zip(self.headers, row)), cls=DjangoJSONEncoder
+        ) + '\n'
+
+    def lines(self, fmt, queryset=None):
+        first, format_row = self.formatter(fmt)
+        if first is not None:
+            yield first
+        for row in self.rows(queryset).iterator(chunk_size=CHUNK_SIZE):
+            yield format_row(row)
+
+    async def alines(self, fmt, queryset=None):
+        # QuerySet.aiterator() runs values_list() queries on the event loop
+        # (ValuesListIterable.__iter__ isn't a generator), so pull chunks
+        # of iterator() through sync_to_async the way aiterator() means to.
+        first, format_row = self.formatter(fmt)
+        if first is not None:
+            yield first
+        rows = self.rows(queryset).iterator(chunk_size=CHUNK_SIZE)
+        next_chunk = sync_to_async(lambda: list(islice(rows, CHUNK_SIZE)))
+        while chunk := await next_chunk():
+            for row in chunk:
+                yield format_row(row)
+
+    def response(self, request, name, fmt, queryset=None):
+        if isinstance(request, ASGIRequest):
+            content = self.alines(fmt, queryset)
+        else:
+            content = self.lines(fmt, queryset)
+        response = StreamingHttpResponse(
+            content, content_type=CONTENT_TYPES[fmt]
+        )
+        filename = f'{name}-{timezone.localdate():%Y-%m-%d}.{fmt}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+EXPORTS = {
+    # One line per order item; orders without items get one empty line
+    'orders': Export(Order, (
+        ('order_id', 'pk'),
+        ('username', 'user__username'),
+        ('email', 'user__email'),
+        ('status', 'status'),
+        ('total_cents', 'total_cents'),
+        ('created_at', 'created_at'),
+        ('product_id', 'items__product_id'),
+        ('product', 'items__product__name'),
+        ('quantity', 'items__quantity'),
+        ('unit_price', 'items__unit_price'),
+    )),
+    'subscriptions': Export(Subscription, (
+        ('id', 'pk'),
+        ('username', 'user__username'),
+        ('email', 'user__email'),
+        ('plan', 'plan__name'),
+        ('status', 'status'),
+        ('start_date', 'start_date'),
+        ('end_date', 'end_date'),
+        ('next_payment_date', 'next_payment_date'),
+        ('stripe_sub_id', 'stripe_sub_id'),
+        ('created_at', 'created_at'),
+    )),
+    'reviews': Export(Review, (
+        ('id', 'pk'),
+        ('product_id', 'product_id'),
+        ('product', 'product__name'),
+        ('username', 'user__username'),
+        ('rating', 'rating'),
+        ('comment', 'comment'),
+        ('created_at', 'created_at'),
+    )),
+    'newsletter': Export(NewsletterSubscriber, (
+        ('email', 'email'),
+        ('subscribed_at', 'subscribed_at'),
+        ('is_active', 'is_active'),
+    )),
+}
+
+
+def admin_actions(name):
+    """Admin actions exporting the selected rows as CSV and JSON Lines."""
+    export = EXPORTS[name]
+
+    def make_action(fmt):
+        @admin.action(
+            description=f"Export selected as {fmt.upper()}",
+            permissions=['view'],
+        )
+        def action(modeladmin, request, queryset):
+            return export.response(request, name, fmt, queryset)
+        action.__name__ = f'export_{fmt}'
+        return action
+
+    return [make_action('csv'), make_action('jsonl')]
@@ -0,0 +1,413 @@
+"""
+Bulk CSV and JSON Lines imports, for loading a partner gym's members,
+order history and subscriptions.
+
+Files are read a line at a time, so memory use does not grow with the
+input. Rows are validated a batch at a time: the users, products and
+plans they name are looked up with one query per batch, and the fields
+are checked with the model's own validation. Each batch's valid rows
+are then written with bulk_create() in one transaction. A row that
+fails validation is reported with its line number and left out; the
+rest of its batch is still written.
+
+Usernames and Stripe subscription ids that already exist are skipped,
+so an interrupted user or subscription import can be run again. Orders
+have no such key and would be imported twice.
+
+bulk_create() sends no signals, so imported users get their profiles
+here, in bulk. Orders and subscriptions use the columns of
+fithub.exports, so an export can be loaded back.
+"""
+import csv
+import json
+import sys
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from functools import cached_property
+from itertools import groupby, islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from store.models import Order, OrderItem, Product
+from subscriptions.models import Plan, Subscription
+from users.models import Profile
+from users.summary import forget_summary
+
+User = get_user_model()
+
+JSONL_SUFFIXES = ('.jsonl', '.ndjson')
+
+
+class InvalidFile(ValueError):
+    """The input can't be read as CSV or JSON Lines."""
+
+
+def read_rows(path, fmt=None):
+    """Yield (line number, row dict) from a CSV file with a header line
+    or a JSON Lines file; '-' reads standard input."""
+    if fmt is None:
+        fmt = 'jsonl' if path.endswith(JSONL_SUFFIXES) else 'csv'
+    if path == '-':
+        fh = sys.stdin
+    else:
+        fh = open(path, newline='', encoding='utf-8-sig')
+    try:
+        if fmt == 'csv':
+            reader = csv.DictReader(fh)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for number, line in enumerate(fh, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise InvalidFile(f"line {number}: {e}") from None
+            if not isinstance(row, dict):
+                raise InvalidFile(f"line {number}: not a JSON object")
+            yield number, row
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+
+def text(row, column):
+    value = row.get(column)
+    return '' if value is None else str(value).strip()
+
+
+def assign(obj, row, columns):
+    """Set the non-empty `columns` of `row` on `obj`, as strings for
+    check() to convert; empty ones keep the model default."""
+    for column in columns:
+        value = text(row, column)
+        if value:
+            setattr(obj, column, value)
+
+
+def check(obj, exclude=()):
+    """Validate and convert `obj`'s fields.
+
+    Foreign keys and uniqueness would cost a query per row, so they are
+    left to the importers, which check them a batch at a time.
+    """
+    obj.full_clean(
+        exclude=exclude, validate_unique=False, validate_constraints=False
+    )
+    for field in obj._meta.concrete_fields:
+        value = getattr(obj, field.attname)
+        if isinstance(value, datetime) and timezone.is_naive(value):
+            setattr(obj, field.attname, timezone.make_aware(value))
+
+
+def describe(error):
+    if hasattr(error, 'error_dict'):
+        return '; '.join(
+            f"{field}: {' '.join(messages)}"
+            for field, messages in error.message_dict.items()
+        )
+    return ' '.join(error.messages)
+
+
+def user_id(users, row):
+    username = text(row, 'username')
+    try:
+        return users[username]
+    except KeyError:
+        raise ValidationError({'username': f"No user {username!r}"}) from None
+
+
+def bulk_create_dated(model, objects):
+    """bulk_create() `objects`, keeping the created_at that auto_now_add
+    overwrites on insert where the file gave one."""
+    dates = [obj.created_at for obj in objects]
+    model.objects.bulk_create(objects)
+    dated = []
+    for obj, created_at in zip(objects, dates):
+        if created_at is not None:
+            obj.created_at = created_at
+            dated.append(obj)
+    if dated:
+        model.objects.bulk_update(dated, ['created_at'])
+
+
+class Stats:
+    def __init__(self):
+        self.rows = self.created = self.skipped = self.invalid = 0
+        self.started = time.monotonic()
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.rows} rows: {self.created} created, {self.skipped} "
+            f"skipped, {self.invalid} invalid ({self.rate:.0f} rows/s)"
+        )
+
+
+class Importer(ABC):
+    """Builds objects from batches of rows and writes the valid ones.
+
+    Subclasses must implement build() and write(), and may override
+    records() to group several rows into one object and prefetch() to
+    look up what a batch refers to.
+    """
+
+    def __init__(self, batch_size=None, on_error=None, on_batch=None):
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.on_error = on_error or (lambda line, message: None)
+        self.on_batch = on_batch or (lambda stats: None)
+
+    def records(self, rows):
+        """(first line, rows) for each object to build; one row each."""
+        for line, row in rows:
+            yield line, [row]
+
+    def prefetch(self, batch):
+        """What build() needs to know about a batch of records, looked up
+        in a few queries; passed to build() as `found`."""
+        return None
+
+    @abstractmethod
+    def build(self, rows, found):
+        """The object for one record's rows, or None to skip it.
+
+        Raises ValidationError if the record is invalid.
+        """
+
+    @abstractmethod
+    def write(self, objects):
+        """Save a batch of built objects."""
+
+    def run(self, rows):
+        stats = Stats()
+        records = self.records(rows)
+        while batch := list(islice(records, self.batch_size)):
+            found = self.prefetch(batch)
+            objects = []
+            for line, record in batch:
+                stats.rows += len(record)
+                try:
+                    obj = self.build(record, found)
+                except ValidationError as e:
+                    stats.invalid += 1
+                    self.on_error(line, describe(e))
+                    continue
+                if obj is None:
+                    stats.skipped += 1
+                else:
+                    objects.append(obj)
+            if objects:
+                with transaction.atomic():
+                    self.write(objects)
+            stats.created += len(objects)
+            self.on_batch(stats)
+        return stats
+
+
+class UserImporter(Importer):
+    """Members, with username, email, first_name, last_name and
+    date_joined columns.
+
+    Imported users have an unusable password and choose one through
+    password reset. Each gets an empty profile.
+    """
+    columns = ('email', 'first_name', 'last_name', 'date_joined')
+
+    @cached_property
+    def password(self):
+        return make_password(None)
+
+    def prefetch(self, batch):
+        usernames = [text(record[0], 'username') for _, record in batch]
+        return set(
+            User.objects.filter(username__in=usernames)
+            .values_list('username', flat=True)
+        )
+
+    def build(self, rows, taken):
+        username = text(rows[0], 'username')
+        if username in taken:
+            return None
+        user = User(username=username, password=self.password)
+        assign(user, rows[0], self.columns)
+        check(user)
+        taken.add(username)
+        return user
+
+    def write(self, users):
+        User.objects.bulk_create(users)
+        Profile.objects.bulk_create_for(users)
+
+
+class OrderImporter(Importer):
+    """Order history, one row per order item as in the orders export.
+
+    Consecutive rows with the same order_id make up one order; the id
+    only groups them, and imported orders are numbered afresh. A row
+    with no product_id, quantity or unit_price is an order without
+    items. total_cents defaults to the sum of the items.
+    """
+    item_columns = ('product_id', 'quantity', 'unit_price')
+
+    def records(self, rows):
+        def order_key(pair):
+            line, row = pair
+            return text(row, 'order_id') or line
+
+        for _, group in groupby(rows, key=order_key):
+            group = list(group)
+            yield group[0][0], [row for _, row in group]
+
+    def prefetch(self, batch):
+        rows = [row for _, record in batch for row in record]
+        product_ids = {
+            int(text(row, 'product_id')) for row in rows
+            if text(row, 'product_id').isdigit()
+        }
+        return {
+            'users': dict(
+                User.objects.filter(
+                    username__in={text(row, 'username') for row in rows}
+                ).values_list('username', 'pk')
+            ),
+            'products': set(
+                Product.objects.filter(pk__in=product_ids)
+                .values_list('pk', flat=True)
+            ),
+        }
+
+    def build_item(self, row, products):
+        item = OrderItem()
+        product_id = text(row, 'product_id')
+        if product_id:
+            if not product_id.isdigit() or int(product_id) not in products:
+                raise ValidationError(
+                    {'product_id': f"No product {product_id!r}"}
+                )
+            item.product_id = int(product_id)
+        assign(item, row, ('quantity', 'unit_price'))
+        check(item, exclude=['order', 'product'])
+        return item
+
+    def build(self, rows, found):
+        order = Order(user_id=user_id(found['users'], rows[0]))
+        assign(order, rows[0], ('status', 'total_cents', 'created_at'))
+        check(order, exclude=['user'])
+        items = [
+            self.build_item(row, found['products']) for row in rows
+            if any(text(row, column) for column in self.item_columns)
+        ]
+        if not text(rows[0], 'total_cents'):
+            order.total_cents = round(
+                sum(item.line_total() for item in items) * 100
+            )
+        return order, items
+
+    def write(self, records):
+        bulk_create_dated(Order, [order for order, _ in records])
+        items = []
+        for order, order_items in records:
+            for item in order_items:
+                item.order = order
+                items.append(item)
+        OrderItem.objects.bulk_create(items)
+
+
+class SubscriptionImporter(Importer):
+    """Subscriptions in the layout of the subscriptions export, with
+    the plan given by name. Rows whose stripe_sub_id is already taken
+    are skipped.
+    """
+    columns = (
+        'stripe_sub_id', 'status', 'start_date', 'end_date',
+        'next_payment_date', 'created_at',
+    )
+
+    @cached_property
+    def plans(self):
+        return dict(Plan.objects.values_list('name', 'pk'))
+
+    def prefetch(self, batch):
+        rows = [record[0] for _, record in batch]
+        return {
+            'users': dict(
+                User.objects.filter(
+                    username__in={text(row, 'username') for row in rows}
+                ).values_list('username', 'pk')
+            ),
+            'taken': set(
+                Subscription.objects.filter(
+                    stripe_sub_id__in={
+                        text(row, 'stripe_sub_id') for row in rows
+                    }
+                ).values_list('stripe_sub_id', flat=True)
+            ),
+        }
+
+    def build(self, rows, found):
+        row = rows[0]
+        stripe_sub_id = text(row, 'stripe_sub_id')
+        if stripe_sub_id and stripe_sub_id in found['taken']:
+            return None
+        subscription = Subscription(user_id=user_id(found['users'], row))
+        plan = text(row, 'plan')
+        if plan:
+            subscription.plan_id = self.plans.get(plan)
+            if subscription.plan_id is None:
+                raise ValidationError({'plan': f"No plan {plan!r}"})
+        assign(subscription, row, self.columns)
+        check(subscription, exclude=['user', 'plan'])
+        found['taken'].add(stripe_sub_id)
+        return subscription
+
+    def write(self, subscriptions):
+        bulk_create_dated(Subscription, subscriptions)
+        # bulk_create() skips the receiver that does this
+        forget_summary(*{sub.user_id for sub in subscriptions})
+
+
+class ImportCommand(BaseCommand):
+    """Base for the import_* commands; set `importer`."""
+    importer = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help="CSV or JSON Lines file, or - for standard input.",
+        )
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl'],
+            help="Input format (default: jsonl for .jsonl and .ndjson "
+                 "files, otherwise csv).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.IMPORT_BATCH_SIZE,
+            help="Records validated and written per transaction.",
+        )
+
+    def handle(self, *args, path, format, batch_size, **options):
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+        importer = self.importer(
+            batch_size=batch_size,
+            on_error=lambda line, message: self.stderr.write(
+                f"line {line}: {message}"
+            ),
+            on_batch=lambda stats: self.stdout.write(str(stats)),
+        )
+        try:
+            stats = importer.run(read_rows(path, format))
+        except (OSError, InvalidFile) as e:
+            raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS(f"Imported {stats}"))
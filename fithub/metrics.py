@@ -0,0 +1,215 @@
+"""
+In-process request metrics.
+
+Each request gets a RequestMetrics object holding its SQL, template,
+cache and Stripe counters. Finished requests are folded into a per-view
+registry that the staff metrics endpoint renders in the Prometheus text
+format.
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Recent wall times kept per view for quantile estimates.
+SAMPLE_SIZE = 1024
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Counters collected while a single request is being handled."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.stripe_calls = 0
+        self.stripe_time = 0.0
+
+    def sql_wrapper(self, execute, sql, params, many, context):
+        """connection.execute_wrapper hook timing every query."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.sql_count += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self, elapsed):
+        """Build a Server-Timing header value (durations in ms)."""
+        return ', '.join([
+            f'db;dur={self.sql_time * 1000:.1f};'
+            f'desc="{self.sql_count} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'cache;desc="{self.cache_hits} hits, '
+            f'{self.cache_misses} misses"',
+            f'stripe;dur={self.stripe_time * 1000:.1f};'
+            f'desc="{self.stripe_calls} calls"',
+            f'total;dur={elapsed * 1000:.1f}',
+        ])
+
+    def as_dict(self, elapsed):
+        return {
+            'duration_ms': round(elapsed * 1000, 2),
+            'sql_queries': self.sql_count,
+            'sql_ms': round(self.sql_time * 1000, 2),
+            'template_ms': round(self.template_time * 1000, 2),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'stripe_calls': self.stripe_calls,
+            'stripe_ms': round(self.stripe_time * 1000, 2),
+        }
+
+
+def start_request():
+    """Begin collecting metrics; returns (metrics, token)."""
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def record_template(seconds):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.template_time += seconds
+
+
+def record_cache(hits, misses):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
+
+
+def record_stripe(seconds):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.stripe_calls += 1
+        metrics.stripe_time += seconds
+
+
+def quantile(samples, q):
+    """Nearest-rank quantile of an unsorted sample list."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+class ViewStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.sql_queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.stripe_calls = 0
+        self.stripe_time = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+
+def _label(value):
+    return (
+        value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    )
+
+
+class Registry:
+    """Thread-safe per-view aggregates for finished requests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = defaultdict(ViewStats)
+
+    def observe(self, view, metrics, elapsed):
+        with self._lock:
+            stats = self._views[view]
+            stats.count += 1
+            stats.duration += elapsed
+            stats.sql_queries += metrics.sql_count
+            stats.sql_time += metrics.sql_time
+            stats.template_time += metrics.template_time
+            stats.cache_hits += metrics.cache_hits
+            stats.cache_misses += metrics.cache_misses
+            stats.stripe_calls += metrics.stripe_calls
+            stats.stripe_time += metrics.stripe_time
+            stats.samples.append(elapsed)
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def render_prometheus(self):
+        """Render all views in the Prometheus text exposition format."""
+        with self._lock:
+            views = sorted(
+                (view, stats, list(stats.samples))
+                for view, stats in self._views.items()
+            )
+
+        lines = [
+            '# HELP fithub_request_duration_seconds '
+            'Request wall time per view.',
+            '# TYPE fithub_request_duration_seconds summary',
+        ]
+        for view, stats, samples in views:
+            label = _label(view)
+            for q in QUANTILES:
+                lines.append(
+                    f'fithub_request_duration_seconds'
+                    f'{{view="{label}",quantile="{q}"}} '
+                    f'{quantile(samples, q):.6f}'
+                )
+            lines.append(
+                f'fithub_request_duration_seconds_sum{{view="{label}"}} '
+                f'{stats.duration:.6f}'
+            )
+            lines.append(
+                f'fithub_request_duration_seconds_count{{view="{label}"}} '
+                f'{stats.count}'
+            )
+
+        counters = [
+            ('fithub_sql_queries_total', 'SQL queries run.', 'sql_queries'),
+            ('fithub_sql_seconds_total', 'Time spent in SQL.', 'sql_time'),
+            (
+                'fithub_template_seconds_total',
+                'Time spent rendering templates.',
+                'template_time',
+            ),
+            ('fithub_cache_hits_total', 'Cache hits.', 'cache_hits'),
+            ('fithub_cache_misses_total', 'Cache misses.', 'cache_misses'),
+            ('fithub_stripe_calls_total', 'Stripe API calls.', 'stripe_calls'),
+            (
+                'fithub_stripe_seconds_total',
+                'Time spent in Stripe API calls, including retries.',
+                'stripe_time',
+            ),
+        ]
+        for name, help_text, attr in counters:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for view, stats, _ in views:
+                value = getattr(stats, attr)
+                if isinstance(value, float):
+                    value = f'{value:.6f}'
+                lines.append(f'{name}{{view="{_label(view)}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
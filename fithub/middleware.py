@@ -0,0 +1,73 @@
+import logging
+
+from asgiref.sync import (
+    iscoroutinefunction, markcoroutinefunction, sync_to_async,
+)
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+from fithub import metrics
+
+logger = logging.getLogger('fithub.metrics')
+
+
+class RequestMetricsMiddleware:
+    """Time each request and record its SQL, template and cache usage.
+
+    Adds a Server-Timing header, logs one structured line per request and
+    feeds the per-view registry exposed by fithub.views.metrics.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_metrics, token = metrics.start_request()
+        try:
+            with connection.execute_wrapper(request_metrics.sql_wrapper):
+                response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        return self.process_metrics(request, response, request_metrics)
+
+    async def __acall__(self, request):
+        request_metrics, token = metrics.start_request()
+        # Connections are per thread and the async ORM runs queries in the
+        # request's sync_to_async thread, so wrap that thread's connection.
+        db = await sync_to_async(connections.__getitem__)(DEFAULT_DB_ALIAS)
+        try:
+            with db.execute_wrapper(request_metrics.sql_wrapper):
+                response = await self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        return self.process_metrics(request, response, request_metrics)
+
+    def process_metrics(self, request, response, request_metrics):
+        elapsed = request_metrics.elapsed()
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        metrics.registry.observe(view, request_metrics, elapsed)
+
+        response['Server-Timing'] = request_metrics.server_timing(elapsed)
+        logger.info(
+            '%s %s %s view=%s %.1fms sql=%d/%.1fms',
+            request.method,
+            request.path,
+            response.status_code,
+            view,
+            elapsed * 1000,
+            request_metrics.sql_count,
+            request_metrics.sql_time * 1000,
+            extra={
+                'view': view,
+                'status': response.status_code,
+                **request_metrics.as_dict(elapsed),
+            },
+        )
+        return response
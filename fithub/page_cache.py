@@ -0,0 +1,116 @@
+"""
+Shared page cache for anonymous visitors.
+
+A page wrapped in public_page() is the same for every visitor without a
+session or messages cookie (fithub.conditional.is_public_request). For
+those requests:
+
+- The rendered HTML is cached under the versions of the data it shows,
+  so a hit runs no queries and renders no templates.
+- CSRF tokens are rendered as CSRF_PLACEHOLDER, which static/js/csrf.js
+  swaps for the visitor's own token once the page loads.
+- PublicPageMiddleware marks the response Cache-Control: public and
+  drops Vary: Cookie, so a caching proxy can share it.
+
+A proxy in front of the app must pass requests carrying the session or
+messages cookie straight through; those responses stay private.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.translation import get_language
+from django.views.decorators.http import condition
+
+from fithub.cache_versions import get_versions
+from fithub.conditional import digest, is_public_request, public_etag, release
+
+CSRF_PLACEHOLDER = 'csrf-token-from-cookie'
+
+
+def _cached(view_func, version_names):
+    def view(request, *args, **kwargs):
+        key = 'page:' + digest((
+            get_versions(*version_names),
+            request.build_absolute_uri(),
+            get_language(),
+            release(),
+        ))
+        entry = cache.get(key)
+        if entry is not None:
+            content, content_type = entry
+            return HttpResponse(content, content_type=content_type)
+        response = view_func(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        if (
+            response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+        ):
+            cache.set(
+                key,
+                (response.content, response['Content-Type']),
+                settings.PUBLIC_PAGE_CACHE_TIMEOUT,
+            )
+        return response
+    return view
+
+
+def public_page(*version_names):
+    """Serve anonymous GETs of a page built from the data in
+    `version_names` from the page cache, with conditional GET.
+
+    Requests from visitors with a session run the view as usual.
+    """
+    def decorator(view_func):
+        cached_view = condition(
+            etag_func=public_etag(*version_names, csrf=False)
+        )(_cached(view_func, version_names))
+
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            if (
+                request.method not in ('GET', 'HEAD')
+                or not is_public_request(request)
+            ):
+                return view_func(request, *args, **kwargs)
+            request.public_page = True
+            response = cached_view(request, *args, **kwargs)
+            response.public_page = True
+            return response
+        return wrapped
+    return decorator
+
+
+class PublicPageMiddleware(MiddlewareMixin):
+    """Let shared caches store public_page() responses.
+
+    Listed above SessionMiddleware so it sees the response after the
+    session and CSRF middleware have added their Vary: Cookie. A
+    response that sets a cookie is left private.
+    """
+
+    def process_response(self, request, response):
+        if not getattr(response, 'public_page', False) or response.cookies:
+            return response
+        if response.status_code in (200, 304):
+            patch_cache_control(
+                response,
+                public=True,
+                max_age=0,
+                s_maxage=settings.PUBLIC_PAGE_MAX_AGE,
+            )
+        vary = [
+            header.strip()
+            for header in response.get('Vary', '').split(',')
+            if header.strip() and header.strip().lower() != 'cookie'
+        ]
+        if vary:
+            response['Vary'] = ', '.join(vary)
+        elif 'Vary' in response:
+            del response['Vary']
+        return response
@@ -0,0 +1,47 @@
+"""
+Fixed-window rate limits counted in the cache.
+
+Each (scope, key) gets a counter per window of `window` seconds. Counters
+are created with cache.add() and bumped with cache.incr(). They live in
+the shared cache, so a limit holds across workers. Redis increments
+atomically; the database cache reads and writes, so hits arriving at
+the same moment can be counted once.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def client_ip(request):
+    """The address the request came from.
+
+    Behind TRUSTED_PROXY_COUNT proxies (Heroku's router is one) that is
+    the entry they appended to X-Forwarded-For; anything earlier in the
+    header came from the client and can't be trusted.
+    """
+    proxies = settings.TRUSTED_PROXY_COUNT
+    if proxies:
+        forwarded = [
+            address.strip()
+            for address in request.META.get(
+                'HTTP_X_FORWARDED_FOR', ''
+            ).split(',')
+            if address.strip()
+        ]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def is_limited(scope, key, limit, window):
+    """Count a hit; True once `key` has more than `limit` in this window."""
+    cache_key = f'rate:{scope}:{key}:{int(time.time() // window)}'
+    cache.add(cache_key, 0, window)
+    try:
+        hits = cache.incr(cache_key)
+    except ValueError:
+        # Expired between add() and incr()
+        cache.set(cache_key, 1, window)
+        hits = 1
+    return hits > limit
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 import dj_database_url
 if os.path.isfile('env.py'):
     import env
@@ -28,6 +29,7 @@ SECRET_KEY = os.environ.get('SECRET_KEY')
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = 'DEVELOPMENT' in os.environ
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
 
 ALLOWED_HOSTS = [
     'localhost',
@@ -46,6 +48,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.sites',
+    'django.contrib.sitemaps',
     'crispy_forms',
     'crispy_bootstrap4',
     'allauth',
@@ -59,7 +62,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'fithub.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Static files are answered here, before sessions, auth and the rest.
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # Sees responses after the session and CSRF middleware below.
+    'fithub.page_cache.PublicPageMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -68,7 +76,6 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
     'django.middleware.locale.LocaleMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
 ]
 
 ROOT_URLCONF = 'fithub.urls'
@@ -77,31 +84,64 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'fithub.backends.InstrumentedDjangoTemplates',
         'DIRS': [
             os.path.join(BASE_DIR, 'templates'),
-            os.path.join(BASE_DIR, 'templates', 'allauth'),
         ],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Compiled templates are kept in memory and preloaded at worker
+            # boot by fithub.warmup (see TEMPLATE_WARMUP).
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',  # required by allauth
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'django.template.context_processors.media',
-                'fithub.context_processors.stripe_keys',
+                'fithub.context_processors.navbar',
+                'fithub.context_processors.public_page',
 
             ],
-            'builtins': [
-                'crispy_forms.templatetags.crispy_forms_tags',
-                'crispy_forms.templatetags.crispy_forms_field',
-            ],
         },
     },
 ]
+TEMPLATE_WARMUP = os.getenv('TEMPLATE_WARMUP', str(not DEBUG)) == 'True'
 
 WSGI_APPLICATION = 'fithub.wsgi.application'
+ASGI_APPLICATION = 'fithub.asgi.application'
+
+# Cached pages, ETags, the sitemap, rate limits and the low-stock index
+# are invalidated through version counters kept in the cache
+# (fithub.cache_versions), so every worker and management command must
+# share one cache: Redis if REDIS_URL is set, otherwise a database table
+# (run createcachetable). Process-local memory is only for development
+# and tests; `check --deploy` rejects it. Cache hits and misses are
+# counted per request by fithub.metrics.
+if 'REDIS_URL' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'fithub.backends.InstrumentedRedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+elif DEBUG or TESTING:
+    CACHES = {
+        'default': {
+            'BACKEND': 'fithub.backends.InstrumentedLocMemCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'fithub.backends.InstrumentedDatabaseCache',
+            'LOCATION': 'fithub_cache',
+        }
+    }
 CSRF_COOKIE_SECURE = False
 SESSION_COOKIE_SECURE = False
 
@@ -109,19 +149,99 @@ SESSION_COOKIE_SECURE = False
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# On PostgreSQL, requests borrow connections from psycopg 3's pool, so
+# they skip the TCP/TLS/auth handshake. The app runs under ASGI, where
+# each request runs in its own thread: persistent per-thread connections
+# (DB_CONN_MAX_AGE) would never be reused or closed, and would use up
+# the server's connection limit. They are off by default; only turn
+# them on with DB_POOL=0 under a WSGI server. The two cannot be combined.
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '0'))
+DB_POOL = os.getenv('DB_POOL', '1').lower() in ('1', 'true', 'yes')
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+
 if 'DATABASE_URL' in os.environ:
     DATABASES = {
-        'default': dj_database_url.parse(os.environ.get('DATABASE_URL'))
+        'default': dj_database_url.parse(
+            os.environ.get('DATABASE_URL'),
+            conn_max_age=0 if DB_POOL else DB_CONN_MAX_AGE,
+            conn_health_checks=not DB_POOL,
+        )
     }
+    if DB_POOL and 'postgresql' in DATABASES['default']['ENGINE']:
+        DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': DB_POOL_TIMEOUT,
+        }
 else:
+    # WAL lets readers run alongside the writer, and IMMEDIATE makes a
+    # transaction take the write lock when it begins. Otherwise one that
+    # read first can't start writing while another writer is active, and
+    # fails with "database is locked" instead of waiting its turn.
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': 'PRAGMA journal_mode=WAL;',
+                'timeout': 20,
+            },
         }
     }
 
 
+# Logging
+# Records are queued and written as JSON lines by a background listener
+# thread, so request workers never block on stdout.
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'ERROR' if TESTING else 'INFO')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'fithub.log.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'queue': {
+            '()': 'fithub.log.QueueListenerHandler',
+            'formatter': 'json',
+        },
+    },
+    'root': {
+        'handlers': ['queue'],
+        'level': 'WARNING',
+    },
+    'loggers': {
+        'django': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        'fithub': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        'store': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        'subscriptions': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -173,7 +293,26 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# collectstatic writes hashed file names plus gzip and Brotli variants;
+# WhiteNoise serves the hashed files with immutable far-future caching.
+# Development and tests use the plain storage so no manifest is needed.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': os.getenv(
+            'STATICFILES_BACKEND',
+            'django.contrib.staticfiles.storage.StaticFilesStorage'
+            if DEBUG or TESTING
+            else 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+        ),
+    },
+}
+
 if 'USE_AWS' in os.environ:
+    from boto3.s3.transfer import TransferConfig
+
     # Cache control
     AWS_S3_OBJECT_PARAMETERS = {
         'Expires': 'Thu, 31 Dec 2099 20:00:00 GMT',
@@ -187,16 +326,71 @@ if 'USE_AWS' in os.environ:
     AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
     AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
 
+    # Uploads over 8MB go up as parallel multipart transfers
+    AWS_S3_TRANSFER_CONFIG = TransferConfig(
+        multipart_threshold=8 * 1024 * 1024,
+        multipart_chunksize=8 * 1024 * 1024,
+        max_concurrency=int(os.getenv('AWS_S3_MAX_CONCURRENCY', '10')),
+    )
+
     # Static and media files
-    STATICFILES_STORAGE = 'custom_storages.StaticStorage'
+    STORAGES['staticfiles']['BACKEND'] = 'custom_storages.StaticStorage'
     STATICFILES_LOCATION = 'static'
-    DEFAULT_FILE_STORAGE = 'custom_storages.MediaStorage'
+    STORAGES['default']['BACKEND'] = 'custom_storages.MediaStorage'
     MEDIAFILES_LOCATION = 'media'
 
     # Override static and media URLs in production
     STATIC_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{STATICFILES_LOCATION}/'
     MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{MEDIAFILES_LOCATION}/'
 
+# Admin image uploads go straight from the browser to S3 when the media
+# storage supports presigned POSTs (custom_storages.MediaStorage).
+DIRECT_UPLOAD_MAX_SIZE = int(
+    os.getenv('DIRECT_UPLOAD_MAX_SIZE', str(10 * 1024 * 1024))
+)
+DIRECT_UPLOAD_EXPIRES = int(os.getenv('DIRECT_UPLOAD_EXPIRES', '600'))
+
+# core's syncstatic command: what was last uploaded, and how many uploads
+# run at once.
+STATIC_SYNC_MANIFEST = os.getenv(
+    'STATIC_SYNC_MANIFEST', str(BASE_DIR / '.static-sync.json')
+)
+STATIC_SYNC_WORKERS = int(os.getenv('STATIC_SYNC_WORKERS', '8'))
+
+# core's send_newsletter command: subscribers per batch (one SMTP
+# connection each) and messages per second; 0 sends unthrottled.
+NEWSLETTER_BATCH_SIZE = int(os.getenv('NEWSLETTER_BATCH_SIZE', '500'))
+NEWSLETTER_SEND_RATE = float(os.getenv('NEWSLETTER_SEND_RATE', '10'))
+
+# Newsletter signups allowed per client IP in each window of seconds
+NEWSLETTER_SIGNUP_LIMIT = int(os.getenv('NEWSLETTER_SIGNUP_LIMIT', '5'))
+NEWSLETTER_SIGNUP_WINDOW = int(os.getenv('NEWSLETTER_SIGNUP_WINDOW', '600'))
+
+# Rows validated and written per transaction by the import_* commands
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+
+# Seconds an unpaid Stripe Checkout Session stays open (store.stock);
+# its stock is reserved a few minutes longer. Stripe needs at least 30
+# minutes, which shorter values are raised to, and at most 24 hours.
+STOCK_RESERVATION_TTL = int(os.getenv('STOCK_RESERVATION_TTL', '1800'))
+# Products with fewer units than this are listed as low on stock
+LOW_STOCK_THRESHOLD = int(os.getenv('LOW_STOCK_THRESHOLD', '10'))
+
+# Proxies in front of the app that append to X-Forwarded-For (Heroku's
+# router in production); see fithub.ratelimit.client_ip.
+TRUSTED_PROXY_COUNT = int(
+    os.getenv('TRUSTED_PROXY_COUNT', '0' if DEBUG else '1')
+)
+
+# Identifies the deployed code in ETags (see fithub.conditional); Heroku
+# sets HEROKU_SLUG_COMMIT with runtime dyno metadata enabled.
+RELEASE_VERSION = os.getenv('HEROKU_SLUG_COMMIT', '')
+
+# Anonymous page cache (fithub.page_cache): how long a rendered page is
+# kept, and how long shared caches in front of the app may serve it.
+PUBLIC_PAGE_CACHE_TIMEOUT = int(os.getenv('PUBLIC_PAGE_CACHE_TIMEOUT', '600'))
+PUBLIC_PAGE_MAX_AGE = int(os.getenv('PUBLIC_PAGE_MAX_AGE', '60'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -207,6 +401,13 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 STRIPE_PUBLIC_KEY = os.getenv('STRIPE_PUBLIC_KEY', '')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
+# Override to point at a local Stripe stand-in (see loadtest/)
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+# Used by the pooled HTTP client in fithub.stripe_client
+STRIPE_TIMEOUT = float(os.getenv('STRIPE_TIMEOUT', '10'))
+STRIPE_CONNECT_TIMEOUT = float(os.getenv('STRIPE_CONNECT_TIMEOUT', '3'))
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', '2'))
+STRIPE_MAX_CONNECTIONS = int(os.getenv('STRIPE_MAX_CONNECTIONS', '20'))
 
 # allauth settings
 ACCOUNT_LOGIN_METHODS = {'username', 'email'}
@@ -226,7 +427,9 @@ if 'DEVELOPMENT' in os.environ:
     DEFAULT_FROM_EMAIL = 'FitLife Hub <noreply@fitlife-hub.com>'
 
 else:
-    EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    EMAIL_BACKEND = os.environ.get(
+        'EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend'
+    )
     EMAIL_USE_TLS = True
     EMAIL_PORT = 587
     EMAIL_HOST = 'smtp.gmail.com'
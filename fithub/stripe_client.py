@@ -0,0 +1,113 @@
+"""
+The configured Stripe client.
+
+Import stripe from here rather than directly so the API key, base URL,
+retry policy and pooled HTTP client are set up exactly once:
+
+    from fithub.stripe_client import stripe
+
+Set STRIPE_API_BASE to point every call at a local mock server such as
+loadtest.stripe_stub.
+"""
+import asyncio
+import logging
+import ssl
+import time
+import weakref
+
+import httpx
+import stripe
+from django.conf import settings
+
+from fithub import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PooledHTTPClient(stripe.HTTPXClient):
+    """httpx transport with keep-alive pools and per-call timing.
+
+    The sync pool is shared by every thread. httpx async connections are
+    bound to the event loop that opened them, so one async pool is kept
+    per loop (uvicorn runs a single loop; async views under WSGI get a new
+    loop per request).
+    """
+
+    name = 'fithub-httpx'
+
+    def __init__(self, timeout, connect_timeout, max_connections):
+        super().__init__(timeout=None, allow_sync_methods=False)
+        self._client_kwargs = {
+            'verify': ssl.create_default_context(cafile=stripe.ca_bundle_path),
+            'timeout': httpx.Timeout(timeout, connect=connect_timeout),
+            'limits': httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        }
+        self._client = httpx.Client(**self._client_kwargs)
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(**self._client_kwargs)
+            self._async_clients[loop] = client
+        return client
+
+    async def request_async(self, method, url, headers, post_data=None):
+        args, kwargs = self._get_request_args_kwargs(
+            method, url, headers, post_data
+        )
+        try:
+            response = await self._async_client().request(*args, **kwargs)
+        except Exception as e:
+            self._handle_request_error(e)
+        return response.content, response.status_code, response.headers
+
+    async def close_async(self):
+        await self._async_client().aclose()
+        del self._async_clients[asyncio.get_running_loop()]
+
+    def request_with_retries(self, method, url, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().request_with_retries(method, url, *args, **kwargs)
+        finally:
+            _record(method, url, time.perf_counter() - start)
+
+    async def request_with_retries_async(self, method, url, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().request_with_retries_async(
+                method, url, *args, **kwargs
+            )
+        finally:
+            _record(method, url, time.perf_counter() - start)
+
+
+def _record(method, url, seconds):
+    metrics.record_stripe(seconds)
+    logger.debug(
+        'Stripe %s %s %.1fms',
+        method.upper(),
+        httpx.URL(url).path,
+        seconds * 1000,
+        extra={'stripe_ms': round(seconds * 1000, 2)},
+    )
+
+
+def configure():
+    """Apply the STRIPE_* settings to the stripe module."""
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.api_base = settings.STRIPE_API_BASE
+    stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+    stripe.default_http_client = PooledHTTPClient(
+        timeout=settings.STRIPE_TIMEOUT,
+        connect_timeout=settings.STRIPE_CONNECT_TIMEOUT,
+        max_connections=settings.STRIPE_MAX_CONNECTIONS,
+    )
+
+
+configure()
@@ -20,13 +20,11 @@ from django.views.generic import TemplateView
 from django.conf import settings
 from django.conf.urls.static import static
 from subscriptions.views import stripe_webhook
-from django.contrib.sitemaps.views import sitemap
-from core.sitemaps import StaticViewSitemap
-
-
-sitemaps = {
-    'static': StaticViewSitemap,
-}
+from core.sitemaps import sitemap_index, sitemap_section
+from fithub.decorators import query_budget
+from fithub.exports import EXPORTS
+from fithub.page_cache import public_page
+from fithub.views import csrf_token, export, metrics
 
 
 urlpatterns = [
@@ -40,13 +38,29 @@ urlpatterns = [
     ),
     path('core/', include('core.urls', namespace='core')),
     path('webhook/', stripe_webhook, name='stripe_webhook'),
+    path('metrics/', metrics, name='metrics'),
+    path('csrf/', csrf_token, name='csrf_token'),
+    *[
+        path(f'exports/{name}/', export, {'name': name}, name=f'export_{name}')
+        for name in EXPORTS
+    ],
     path(
         'sitemap.xml',
-        sitemap,
-        {'sitemaps': sitemaps},
-        name='django.contrib.sitemaps.views.sitemap'
+        query_budget(5)(sitemap_index),
+        name='sitemap_index'
+    ),
+    path(
+        'sitemap-<str:section>.xml',
+        query_budget(3)(sitemap_section),
+        name='sitemap_section'
+    ),
+    path(
+        '',
+        query_budget(2)(
+            public_page()(TemplateView.as_view(template_name='home.html'))
+        ),
+        name='home'
     ),
-    path('', TemplateView.as_view(template_name='home.html'), name='home'),
 ]
 if settings.DEBUG:
     urlpatterns += static(
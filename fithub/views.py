@@ -0,0 +1,41 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponse, JsonResponse
+from django.middleware.csrf import get_token
+from django.views.decorators.cache import never_cache
+
+from fithub.decorators import query_budget
+from fithub.exports import CONTENT_TYPES, EXPORTS
+from fithub.metrics import registry
+
+
+@query_budget(2)
+@staff_member_required
+def metrics(request):
+    """Per-view request metrics in the Prometheus text format."""
+    return HttpResponse(
+        registry.render_prometheus(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+@query_budget(2)
+@staff_member_required
+def export(request, name):
+    """Stream every row of an export; ?format=jsonl for JSON Lines.
+
+    The rows are read while the response streams, after the view (and
+    its query budget) has returned.
+    """
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in CONTENT_TYPES:
+        raise Http404(f"Unknown export format {fmt!r}")
+    return EXPORTS[name].response(request, name, fmt)
+
+
+@query_budget(0)
+@never_cache
+def csrf_token(request):
+    """A CSRF token for pages from the shared page cache, which carry a
+    placeholder instead (see static/js/csrf.js). Also sets the cookie.
+    """
+    return JsonResponse({'token': get_token(request)})
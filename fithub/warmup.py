@@ -0,0 +1,72 @@
+"""
+Preload the project's templates into the cached template loader.
+
+Called from fithub.wsgi and fithub.asgi when TEMPLATE_WARMUP is on, so
+each worker compiles every template once at boot instead of on the
+first request that needs it.
+"""
+import logging
+import time
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.template import TemplateSyntaxError, engines
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_SUFFIXES = ('.html', '.txt', '.xml')
+
+
+def django_engine():
+    return next(
+        engine for engine in engines.all()
+        if isinstance(engine, DjangoTemplates)
+    )
+
+
+def template_dirs():
+    """Template directories of the project and its own apps.
+
+    Third-party apps (admin, allauth) are skipped; their templates are
+    only compiled if a page actually uses them.
+    """
+    base = Path(settings.BASE_DIR).resolve()
+    dirs = [Path(d) for d in django_engine().engine.dirs]
+    for app_config in apps.get_app_configs():
+        app_path = Path(app_config.path).resolve()
+        if app_path.is_relative_to(base):
+            dirs.append(app_path / 'templates')
+    return [d for d in dirs if d.is_dir()]
+
+
+def template_names():
+    names = set()
+    for directory in template_dirs():
+        for path in directory.rglob('*'):
+            if path.suffix in TEMPLATE_SUFFIXES and path.is_file():
+                names.add(path.relative_to(directory).as_posix())
+    return sorted(names)
+
+
+def warm_templates():
+    """Compile every project template; returns the number loaded."""
+    start = time.perf_counter()
+    engine = django_engine()
+    loaded = 0
+    for name in template_names():
+        try:
+            engine.get_template(name)
+        except TemplateSyntaxError:
+            logger.exception("Template %s failed to compile", name)
+        else:
+            loaded += 1
+    elapsed = time.perf_counter() - start
+    logger.info(
+        "Preloaded %d templates in %.1fms",
+        loaded,
+        elapsed * 1000,
+        extra={'templates': loaded, 'duration_ms': round(elapsed * 1000, 2)},
+    )
+    return loaded
@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fithub.settings')
 
 application = get_wsgi_application()
+
+# Compile every template in this worker before it takes traffic.
+if settings.TEMPLATE_WARMUP:
+    from fithub.warmup import warm_templates
+    warm_templates()
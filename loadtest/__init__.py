@@ -0,0 +1,7 @@
+"""
+Load testing for FitLife Hub.
+
+Drives scripted user journeys against a locally running server, with a
+local Stripe stand-in that fakes Checkout Sessions, PaymentIntents and
+signed webhooks. See `python -m loadtest --help`.
+"""
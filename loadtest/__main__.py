@@ -0,0 +1,186 @@
+"""
+Command line entry point.
+
+    python -m loadtest seed --users 50
+    python -m loadtest run --serve gunicorn --workers 4 --users 20 \\
+        --duration 60
+
+Without --serve, start the app yourself with STRIPE_API_BASE pointing
+at the stand-in (http://127.0.0.1:12111 by default) and the same
+STRIPE_WEBHOOK_SECRET, then pass --url.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import django
+import requests
+
+DEFAULT_WEBHOOK_SECRET = 'whsec_loadtest'
+
+SERVER_COMMANDS = {
+    'gunicorn': [
+        'gunicorn', 'fithub.wsgi:application',
+        '--bind', '{host}:{port}', '--workers', '{workers}',
+    ],
+    'uvicorn': [
+        'uvicorn', 'fithub.asgi:application',
+        '--host', '{host}', '--port', '{port}', '--workers', '{workers}',
+    ],
+}
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fithub.settings')
+    django.setup()
+
+
+def start_server(kind, host, port, workers, env):
+    command = [
+        part.format(host=host, port=port, workers=workers)
+        for part in SERVER_COMMANDS[kind]
+    ]
+    process = subprocess.Popen(command, env=env)
+    url = f"http://{host}:{port}/"
+    for _ in range(100):
+        try:
+            requests.get(url, timeout=1)
+            return process
+        except requests.RequestException:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f"{kind} did not start on {url}")
+
+
+def cmd_seed(args):
+    setup_django()
+    from loadtest.seed import seed
+    seed(users=args.users, products=args.products, plans=args.plans)
+    print(
+        f"Seeded {args.users} users, {args.products} products, "
+        f"{args.plans} plans."
+    )
+
+
+def cmd_run(args):
+    setup_django()
+    from loadtest import seed
+    from loadtest.journeys import VirtualUser
+    from loadtest.stats import Stats
+    from loadtest.stripe_stub import StripeStub
+
+    catalogue = seed.catalogue()
+    if not catalogue['products'] or not catalogue['plans']:
+        raise SystemExit("No load-test data; run `python -m loadtest seed`.")
+
+    webhook_secret = os.environ.get(
+        'STRIPE_WEBHOOK_SECRET', DEFAULT_WEBHOOK_SECRET
+    )
+    stats = Stats()
+    stub = StripeStub(
+        args.url,
+        webhook_secret,
+        port=args.stripe_port,
+        latency=args.stripe_latency / 1000,
+        stats=stats,
+    ).start()
+
+    server = None
+    if args.serve:
+        env = dict(
+            os.environ,
+            STRIPE_API_BASE=stub.url,
+            STRIPE_SECRET_KEY='sk_test_loadtest',
+            STRIPE_WEBHOOK_SECRET=webhook_secret,
+            EMAIL_BACKEND='django.core.mail.backends.dummy.EmailBackend',
+        )
+        # Render pages without a collectstatic manifest.
+        env.setdefault(
+            'STATICFILES_BACKEND',
+            'django.contrib.staticfiles.storage.StaticFilesStorage',
+        )
+        env.setdefault('SECRET_KEY', 'loadtest-secret-key')
+        host, port = args.url.split('//', 1)[1].rstrip('/').split(':')
+        server = start_server(args.serve, host, port, args.workers, env)
+
+    print(
+        f"Running {args.users} users for {args.duration}s against "
+        f"{args.url} (Stripe stand-in at {stub.url})"
+    )
+    stats.started = time.perf_counter()
+    deadline = time.monotonic() + args.duration
+    threads = []
+    try:
+        for i in range(args.users):
+            user = VirtualUser(
+                args.url,
+                seed.USERNAME.format(i % args.user_pool),
+                seed.PASSWORD,
+                stats,
+                catalogue,
+                think_time=args.think_time,
+            )
+            thread = threading.Thread(
+                target=user.run, args=(deadline,), daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+            time.sleep(args.ramp_up / max(args.users, 1))
+        for thread in threads:
+            thread.join()
+    finally:
+        stub.stop()
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    elapsed = time.perf_counter() - stats.started
+    print(stats.render_table(elapsed))
+    if args.json:
+        stats.write_json(args.json, elapsed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m loadtest')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='create load-test data')
+    seed_parser.add_argument('--users', type=int, default=50)
+    seed_parser.add_argument('--products', type=int, default=50)
+    seed_parser.add_argument('--plans', type=int, default=3)
+    seed_parser.set_defaults(func=cmd_seed)
+
+    run_parser = commands.add_parser('run', help='run the user journeys')
+    run_parser.add_argument('--url', default='http://127.0.0.1:8000')
+    run_parser.add_argument('--serve', choices=sorted(SERVER_COMMANDS))
+    run_parser.add_argument('--workers', type=int, default=4)
+    run_parser.add_argument('--users', type=int, default=10)
+    run_parser.add_argument(
+        '--user-pool', type=int, default=50,
+        help='number of seeded accounts to spread virtual users over',
+    )
+    run_parser.add_argument('--duration', type=float, default=30)
+    run_parser.add_argument('--ramp-up', type=float, default=5)
+    run_parser.add_argument(
+        '--think-time', type=float, default=0.0,
+        help='mean pause between steps in seconds',
+    )
+    run_parser.add_argument('--stripe-port', type=int, default=12111)
+    run_parser.add_argument(
+        '--stripe-latency', type=float, default=0,
+        help='simulated Stripe API latency in ms',
+    )
+    run_parser.add_argument('--json', help='write results to this file')
+    run_parser.set_defaults(func=cmd_run)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
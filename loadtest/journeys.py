@@ -0,0 +1,151 @@
+"""
+Scripted user journeys.
+
+Each VirtualUser logs in once and then repeatedly picks a weighted
+journey until the run's deadline. Every request is timed and recorded
+under its route name in a shared loadtest.stats.Stats.
+"""
+import random
+import time
+from urllib.parse import urljoin
+
+import requests
+
+SEARCH_TERMS = ['mat', 'band', 'bottle', 'roller', 'kettlebell', 'bag']
+
+CHECKOUT_FORM = {
+    'full_name': 'Load Test',
+    'address': '1 Test Street',
+    'city': 'Dublin',
+    'postcode': 'D01 TEST',
+    'country': 'IE',
+    'email': 'loadtest@example.com',
+    'phone': '0851234567',
+}
+
+
+class VirtualUser:
+    def __init__(self, base_url, username, password, stats, catalogue,
+                 think_time=0.0):
+        self.base_url = base_url.rstrip('/') + '/'
+        self.username = username
+        self.password = password
+        self.stats = stats
+        self.product_ids = catalogue['products']
+        self.plan_ids = catalogue['plans']
+        self.think_time = think_time
+        self.http = requests.Session()
+
+    # -- plumbing -----------------------------------------------------
+
+    def request(self, name, method, path, **kwargs):
+        """Send one request without following redirects and record it."""
+        kwargs.setdefault('allow_redirects', False)
+        kwargs.setdefault('timeout', 30)
+        if method == 'POST':
+            headers = kwargs.setdefault('headers', {})
+            headers['X-CSRFToken'] = self.http.cookies.get('csrftoken', '')
+            headers['Referer'] = self.base_url
+        start = time.perf_counter()
+        try:
+            response = self.http.request(
+                method, urljoin(self.base_url, path), **kwargs
+            )
+        except requests.RequestException:
+            self.stats.record(name, time.perf_counter() - start, ok=False)
+            return None
+        self.stats.record(
+            name, time.perf_counter() - start, response.status_code < 400
+        )
+        return response
+
+    def follow(self, response, name):
+        """Follow one redirect hop, recording it under `name`."""
+        if response is None or not response.is_redirect:
+            return response
+        return self.request(name, 'GET', response.headers['Location'])
+
+    def pause(self):
+        if self.think_time:
+            time.sleep(random.uniform(0, 2 * self.think_time))
+
+    # -- journeys -----------------------------------------------------
+
+    def login(self):
+        self.request('account_login', 'GET', 'accounts/login/')
+        response = self.request(
+            'account_login', 'POST', 'accounts/login/',
+            data={'login': self.username, 'password': self.password},
+        )
+        return response is not None and response.status_code == 302
+
+    def browse(self):
+        self.request('store:product_list', 'GET', 'store/')
+        self.pause()
+        self.request(
+            'store:product_list?q', 'GET', 'store/',
+            params={'q': random.choice(SEARCH_TERMS)},
+        )
+        self.pause()
+        pk = random.choice(self.product_ids)
+        self.request('store:product_detail', 'GET', f'store/products/{pk}/')
+
+    def purchase(self):
+        pk = random.choice(self.product_ids)
+        self.request('store:product_detail', 'GET', f'store/products/{pk}/')
+        self.request('store:cart_add', 'POST', f'store/cart/add/{pk}/')
+        self.pause()
+        self.request('store:cart', 'GET', 'store/cart/')
+        self.request('store:checkout', 'GET', 'store/checkout/')
+        response = self.request(
+            'store:checkout', 'POST', 'store/checkout/', data=CHECKOUT_FORM
+        )
+        # Stripe stand-in: pays, fires the webhook, redirects to success.
+        response = self.follow(response, 'stripe:checkout')
+        self.follow(response, 'store:checkout_success')
+
+    def order_history(self):
+        self.request('store:order_history', 'GET', 'store/orders/')
+
+    def subscribe(self):
+        self.request('subscriptions:plan_list', 'GET', 'subscriptions/plans/')
+        self.pause()
+        plan_id = random.choice(self.plan_ids)
+        response = self.request(
+            'subscriptions:subscribe_plan', 'POST',
+            f'subscriptions/subscribe/{plan_id}/',
+        )
+        if response is not None and response.is_redirect and (
+            response.headers['Location'].startswith('http')
+            and not response.headers['Location'].startswith(self.base_url)
+        ):
+            response = self.follow(response, 'stripe:checkout')
+            self.follow(response, 'subscriptions:plan_list')
+
+    def post_progress(self):
+        self.request('core:progress_create', 'GET', 'core/progress/new/')
+        self.pause()
+        self.request(
+            'core:progress_create', 'POST', 'core/progress/new/',
+            data={'title': 'Load test workout', 'content': 'Ran 5k today.'},
+        )
+        self.request('core:progress_list', 'GET', 'core/')
+
+    JOURNEYS = (
+        ('browse', 50),
+        ('purchase', 15),
+        ('order_history', 10),
+        ('subscribe', 10),
+        ('post_progress', 15),
+    )
+
+    def run(self, deadline):
+        if not self.login():
+            self.stats.record('login_failed', 0, ok=False)
+            return
+        names = [name for name, _ in self.JOURNEYS]
+        weights = [weight for _, weight in self.JOURNEYS]
+        while time.monotonic() < deadline:
+            journey = random.choices(names, weights)[0]
+            getattr(self, journey)()
+            self.pause()
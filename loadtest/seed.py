@@ -0,0 +1,74 @@
+"""
+Seed the database with load-test users, products and plans.
+
+Needs Django configured (DJANGO_SETTINGS_MODULE); run it through
+`python -m loadtest seed`.
+"""
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+
+from allauth.account.models import EmailAddress
+from store.models import Product
+from subscriptions.models import Plan
+
+USERNAME = 'loadtest_user_{}'
+PASSWORD = 'loadtest-pass-2025'
+
+PRODUCT_NAMES = [
+    'Yoga Mat', 'Resistance Bands', 'Water Bottle', 'Foam Roller',
+    'Kettlebell', 'Gym Bag', 'Skipping Rope', 'Push-up Bar',
+]
+
+
+def seed(users=50, products=50, plans=3):
+    """Create (or reuse) verified users, stocked products and plans."""
+    password = make_password(PASSWORD)
+    for i in range(users):
+        user, _ = User.objects.get_or_create(
+            username=USERNAME.format(i),
+            defaults={
+                'email': f"loadtest{i}@example.com",
+                'password': password,
+            },
+        )
+        EmailAddress.objects.update_or_create(
+            user=user,
+            email=user.email,
+            defaults={'verified': True, 'primary': True},
+        )
+
+    for i in range(products):
+        Product.objects.update_or_create(
+            name=f"Load Test {PRODUCT_NAMES[i % len(PRODUCT_NAMES)]} {i}",
+            defaults={
+                'description': 'Seeded for load testing.',
+                'price': 10 + i % 40,
+                'stock': 1_000_000,
+            },
+        )
+
+    for i in range(plans):
+        Plan.objects.update_or_create(
+            stripe_price_id=f"price_loadtest_{i}",
+            defaults={
+                'name': f"Load Test Plan {i}",
+                'description': 'Seeded for load testing.',
+                'price': 9.99 + i * 10,
+                'interval': 'monthly' if i % 2 == 0 else 'yearly',
+                'is_active': True,
+            },
+        )
+
+
+def catalogue():
+    """Product and plan ids the journeys pick from."""
+    return {
+        'products': list(
+            Product.objects.filter(name__startswith='Load Test')
+            .values_list('id', flat=True)
+        ),
+        'plans': list(
+            Plan.objects.filter(stripe_price_id__startswith='price_loadtest_')
+            .values_list('id', flat=True)
+        ),
+    }
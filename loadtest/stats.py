@@ -0,0 +1,72 @@
+import json
+import threading
+import time
+from collections import defaultdict
+
+from fithub.metrics import quantile
+
+
+class Stats:
+    """Thread-safe latency samples per endpoint name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(list)
+        self._failures = defaultdict(int)
+        self.started = time.perf_counter()
+
+    def record(self, name, seconds, ok=True):
+        with self._lock:
+            self._samples[name].append(seconds)
+            if not ok:
+                self._failures[name] += 1
+
+    def rows(self, elapsed=None):
+        """Summary rows sorted by endpoint name (latencies in ms)."""
+        if elapsed is None:
+            elapsed = time.perf_counter() - self.started
+        with self._lock:
+            items = sorted(
+                (name, list(samples), self._failures[name])
+                for name, samples in self._samples.items()
+            )
+        rows = []
+        for name, samples, failures in items:
+            rows.append({
+                'endpoint': name,
+                'requests': len(samples),
+                'failures': failures,
+                'rps': round(len(samples) / elapsed, 2) if elapsed else 0,
+                'p50_ms': round(quantile(samples, 0.5) * 1000, 1),
+                'p95_ms': round(quantile(samples, 0.95) * 1000, 1),
+                'p99_ms': round(quantile(samples, 0.99) * 1000, 1),
+                'max_ms': round(max(samples) * 1000, 1),
+            })
+        return rows
+
+    def render_table(self, elapsed=None):
+        rows = self.rows(elapsed)
+        header = (
+            f"{'endpoint':<36} {'reqs':>7} {'fail':>5} {'rps':>8} "
+            f"{'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}"
+        )
+        lines = [header, '-' * len(header)]
+        for row in rows:
+            lines.append(
+                f"{row['endpoint']:<36} {row['requests']:>7} "
+                f"{row['failures']:>5} {row['rps']:>8} "
+                f"{row['p50_ms']:>8} {row['p95_ms']:>8} "
+                f"{row['p99_ms']:>8} {row['max_ms']:>8}"
+            )
+        total = sum(row['requests'] for row in rows)
+        failures = sum(row['failures'] for row in rows)
+        lines.append('-' * len(header))
+        lines.append(
+            f"{'total':<36} {total:>7} {failures:>5} "
+            f"{round(sum(row['rps'] for row in rows), 2):>8}"
+        )
+        return '\n'.join(lines)
+
+    def write_json(self, path, elapsed=None):
+        with open(path, 'w') as fh:
+            json.dump({'endpoints': self.rows(elapsed)}, fh, indent=2)
@@ -0,0 +1,232 @@
+"""
+A local stand-in for the Stripe API.
+
+Point the app at it with STRIPE_API_BASE. It implements just enough of
+the API for the journeys in loadtest.journeys:
+
+- POST   /v1/checkout/sessions     create a Checkout Session
+- POST   /v1/payment_intents       create a PaymentIntent
+- GET    /v1/subscriptions/<id>    retrieve a subscription
+- DELETE /v1/subscriptions/<id>    cancel a subscription
+- GET    /pay/<session id>         "pay" for a session: sends the signed
+                                   checkout.session.completed webhook to
+                                   the app, then redirects to success_url
+"""
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+import requests
+
+# Where each Checkout mode delivers its completion webhook.
+WEBHOOK_PATHS = {
+    'payment': '/store/webhook/oneoff/',
+    'subscription': '/webhook/',
+}
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """Build a Stripe-Signature header value for `payload`."""
+    if timestamp is None:
+        timestamp = int(time.time())
+    signed = f"{timestamp}.{payload}".encode('utf-8')
+    signature = hmac.new(
+        secret.encode('utf-8'), signed, hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def parse_form(body):
+    """Decode a Stripe form body, collecting metadata[...] keys."""
+    fields = {}
+    metadata = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        if key.startswith('metadata[') and key.endswith(']'):
+            metadata[key[len('metadata['):-1]] = value
+        else:
+            fields[key] = value
+    fields['metadata'] = metadata
+    return fields
+
+
+def _new_id(prefix):
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+class StripeStub:
+    """Threaded HTTP server faking the Stripe endpoints the app calls."""
+
+    def __init__(self, app_url, webhook_secret, host='127.0.0.1', port=0,
+                 latency=0.0, stats=None):
+        self.app_url = app_url.rstrip('/')
+        self.webhook_secret = webhook_secret
+        self.latency = latency
+        self.stats = stats
+        self.sessions = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def create_session(self, form):
+        session_id = _new_id('cs_test')
+        session = {
+            'id': session_id,
+            'object': 'checkout.session',
+            'mode': form.get('mode', 'payment'),
+            'customer_email': form.get('customer_email'),
+            'success_url': form.get('success_url'),
+            'cancel_url': form.get('cancel_url'),
+            'metadata': form['metadata'],
+            'payment_status': 'unpaid',
+            'url': f"{self.url}/pay/{session_id}",
+        }
+        if session['mode'] == 'subscription':
+            session['subscription'] = _new_id('sub')
+        with self._lock:
+            self.sessions[session_id] = session
+        return session
+
+    def create_payment_intent(self, form):
+        intent_id = _new_id('pi')
+        return {
+            'id': intent_id,
+            'object': 'payment_intent',
+            'amount': int(form.get('amount', 0)),
+            'currency': form.get('currency', 'eur'),
+            'metadata': form['metadata'],
+            'client_secret': f"{intent_id}_secret_{uuid.uuid4().hex[:12]}",
+            'status': 'requires_payment_method',
+        }
+
+    def complete_session(self, session_id):
+        """Mark a session paid and deliver its webhook to the app."""
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            return None
+        session['payment_status'] = 'paid'
+        event = {
+            'id': _new_id('evt'),
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'data': {'object': session},
+        }
+        self.send_webhook(event, WEBHOOK_PATHS[session['mode']])
+        return session
+
+    def send_webhook(self, event, path):
+        payload = json.dumps(event)
+        start = time.perf_counter()
+        response = requests.post(
+            self.app_url + path,
+            data=payload,
+            headers={
+                'Content-Type': 'application/json',
+                'Stripe-Signature': sign_payload(
+                    payload, self.webhook_secret
+                ),
+            },
+            timeout=30,
+        )
+        if self.stats is not None:
+            self.stats.record(
+                f"webhook {path}",
+                time.perf_counter() - start,
+                response.status_code == 200,
+            )
+        return response
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _not_found(self):
+                self._json(404, {'error': {
+                    'type': 'invalid_request_error',
+                    'message': f"Unrecognized request URL ({self.path})",
+                }})
+
+            def _form(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return parse_form(self.rfile.read(length).decode('utf-8'))
+
+            def _api_delay(self):
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+            def do_POST(self):
+                self._api_delay()
+                if self.path == '/v1/checkout/sessions':
+                    self._json(200, stub.create_session(self._form()))
+                elif self.path == '/v1/payment_intents':
+                    self._json(200, stub.create_payment_intent(self._form()))
+                else:
+                    self._not_found()
+
+            def do_GET(self):
+                if self.path.startswith('/pay/'):
+                    session = stub.complete_session(self.path[len('/pay/'):])
+                    if session is None:
+                        self._not_found()
+                        return
+                    self.send_response(303)
+                    self.send_header('Location', session['success_url'])
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                elif self.path.startswith('/v1/subscriptions/'):
+                    self._api_delay()
+                    sub_id = self.path.rsplit('/', 1)[-1]
+                    self._json(200, {
+                        'id': sub_id,
+                        'object': 'subscription',
+                        'status': 'active',
+                    })
+                else:
+                    self._not_found()
+
+            def do_DELETE(self):
+                self._api_delay()
+                if self.path.startswith('/v1/subscriptions/'):
+                    sub_id = self.path.rsplit('/', 1)[-1]
+                    self._json(200, {
+                        'id': sub_id,
+                        'object': 'subscription',
+                        'status': 'canceled',
+                    })
+                else:
+                    self._not_found()
+
+        return Handler
@@ -0,0 +1,88 @@
+import json
+from unittest.mock import patch
+
+import stripe
+from django.test import SimpleTestCase
+
+from .stats import Stats
+from .stripe_stub import StripeStub, parse_form, sign_payload
+
+
+class StripeStubTests(SimpleTestCase):
+    """Tests for the local Stripe stand-in used by the load tests."""
+
+    def setUp(self):
+        self.stub = StripeStub('http://app.test', 'whsec_test').start()
+        self.addCleanup(self.stub.stop)
+        api_base = patch.object(stripe, 'api_base', self.stub.url)
+        api_key = patch.object(stripe, 'api_key', 'sk_test_stub')
+        api_base.start()
+        api_key.start()
+        self.addCleanup(api_base.stop)
+        self.addCleanup(api_key.stop)
+
+    def test_signature_accepted_by_stripe_library(self):
+        # Webhooks signed by the stub verify with the real stripe library
+        payload = json.dumps({'id': 'evt_1', 'object': 'event'})
+        header = sign_payload(payload, 'whsec_test')
+        event = stripe.Webhook.construct_event(payload, header, 'whsec_test')
+        self.assertEqual(event['id'], 'evt_1')
+
+    def test_parse_form_collects_metadata(self):
+        # Stripe form encoding of metadata is folded into a dict
+        form = parse_form('mode=payment&metadata%5Buser_id%5D=7')
+        self.assertEqual(form['mode'], 'payment')
+        self.assertEqual(form['metadata'], {'user_id': '7'})
+
+    def test_checkout_session_create(self):
+        # The stripe library can create sessions against the stub
+        session = stripe.checkout.Session.create(
+            mode='subscription',
+            success_url='http://app.test/ok',
+            cancel_url='http://app.test/cancel',
+            metadata={'plan_id': 1, 'user_id': 2},
+        )
+        self.assertTrue(session.url.startswith(self.stub.url + '/pay/'))
+        self.assertTrue(session.subscription.startswith('sub_'))
+        self.assertEqual(session.metadata['plan_id'], '1')
+
+    def test_payment_intent_create(self):
+        # PaymentIntents come back with a client secret
+        intent = stripe.PaymentIntent.create(amount=1999, currency='eur')
+        self.assertEqual(intent.amount, 1999)
+        self.assertIn('_secret_', intent.client_secret)
+
+    def test_complete_session_sends_signed_webhook(self):
+        # Paying a session posts checkout.session.completed to the app
+        session = self.stub.create_session(parse_form(
+            'mode=payment&success_url=http%3A%2F%2Fapp.test%2Fok'
+        ))
+        with patch('loadtest.stripe_stub.requests.post') as mock_post:
+            mock_post.return_value.status_code = 200
+            self.stub.complete_session(session['id'])
+        url = mock_post.call_args.args[0]
+        kwargs = mock_post.call_args.kwargs
+        self.assertEqual(url, 'http://app.test/store/webhook/oneoff/')
+        event = stripe.Webhook.construct_event(
+            kwargs['data'], kwargs['headers']['Stripe-Signature'],
+            'whsec_test'
+        )
+        self.assertEqual(event['type'], 'checkout.session.completed')
+
+
+class StatsTests(SimpleTestCase):
+    """Tests for load test result aggregation."""
+
+    def test_rows_report_rps_and_percentiles(self):
+        # Percentiles and throughput are computed per endpoint
+        stats = Stats()
+        for ms in range(1, 101):
+            stats.record('store:product_list', ms / 1000)
+        stats.record('store:cart', 0.5, ok=False)
+        rows = {row['endpoint']: row for row in stats.rows(elapsed=10)}
+        listing = rows['store:product_list']
+        self.assertEqual(listing['requests'], 100)
+        self.assertEqual(listing['rps'], 10)
+        self.assertEqual(listing['p50_ms'], 50)
+        self.assertEqual(listing['p99_ms'], 99)
+        self.assertEqual(rows['store:cart']['failures'], 1)
@@ -0,0 +1,64 @@
+// Product admin: send the chosen image straight to S3 with a presigned
+// POST, so the file never streams through the Django worker. The form then
+// only submits the stored name in the hidden image_upload field.
+document.addEventListener('DOMContentLoaded', function() {
+  const upload = document.getElementById('id_image_upload');
+  const input = document.getElementById('id_image');
+  if (!upload || !input || !upload.dataset.presignUrl) return;
+
+  const form = input.form;
+  const csrfToken = form.querySelector('[name=csrfmiddlewaretoken]').value;
+  const status = document.createElement('div');
+  status.className = 'help';
+  input.after(status);
+  let pending = null;
+
+  async function presignAndUpload(file) {
+    const request = new FormData();
+    request.append('filename', file.name);
+    request.append('content_type', file.type);
+    const response = await fetch(upload.dataset.presignUrl, {
+      method: 'POST',
+      body: request,
+      headers: { 'X-CSRFToken': csrfToken },
+    });
+    const presigned = await response.json();
+    if (!response.ok) throw new Error(presigned.error || response.statusText);
+
+    const body = new FormData();
+    Object.entries(presigned.fields).forEach(([key, value]) => body.append(key, value));
+    body.append('file', file);
+    const s3Response = await fetch(presigned.url, { method: 'POST', body: body });
+    if (!s3Response.ok) throw new Error(`S3 responded ${s3Response.status}`);
+    return presigned.name;
+  }
+
+  input.addEventListener('change', function() {
+    const file = input.files[0];
+    upload.value = '';
+    if (!file) return;
+    status.textContent = `Uploading ${file.name}…`;
+    const current = presignAndUpload(file)
+      .then(function(name) {
+        upload.value = name;
+        input.value = '';
+        status.textContent = `Uploaded ${file.name}`;
+      }, function(error) {
+        // Leave the file in the input; it goes up with the form instead.
+        status.textContent = `Direct upload failed (${error.message}); the image will be sent with the form.`;
+      })
+      .finally(function() {
+        if (pending === current) pending = null;
+      });
+    pending = current;
+  });
+
+  form.addEventListener('submit', function(event) {
+    if (!pending) return;
+    event.preventDefault();
+    const submitter = event.submitter;
+    pending.then(function() {
+      form.requestSubmit(submitter);
+    });
+  });
+});
@@ -0,0 +1,27 @@
+// Pages from the shared page cache (fithub/page_cache.py) are rendered
+// with a placeholder where the CSRF token goes. Swap in this visitor's
+// token from the CSRF cookie, asking the server for one if there is none.
+(function() {
+  const script = document.currentScript;
+  const placeholder = script.dataset.placeholder;
+
+  function cookieToken() {
+    const prefix = script.dataset.cookie + '=';
+    const cookie = document.cookie.split('; ').find(c => c.startsWith(prefix));
+    return cookie ? decodeURIComponent(cookie.slice(prefix.length)) : null;
+  }
+
+  document.addEventListener('DOMContentLoaded', function() {
+    const inputs = document.querySelectorAll('input[name=csrfmiddlewaretoken]');
+    const pending = Array.from(inputs).filter(input => input.value === placeholder);
+    if (!pending.length) return;
+
+    const token = cookieToken();
+    const ready = token ? Promise.resolve(token) : fetch(script.dataset.tokenUrl, {
+      credentials: 'same-origin',
+    }).then(response => response.json()).then(data => data.token);
+    ready.then(function(token) {
+      pending.forEach(function(input) { input.value = token; });
+    });
+  });
+})();
@@ -1,26 +1,80 @@
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.core.files.storage import default_storage
+from django.http import Http404, JsonResponse
+from django.urls import path
+from django.utils.decorators import method_decorator
 from django.utils.html import format_html
+from django.views.decorators.http import require_POST
+
+from fithub.exports import admin_actions
+
+from .forms import OrderAdminForm, ProductAdminForm
 from .models import Product, Order, OrderItem, Review
+from .order_status import schedule_shipping_notifications, transition
+from .stock import low_stock
+
+DIRECT_UPLOAD_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'image/gif')
+
+
+def request_low_stock(request):
+    """low_stock(), looked up once per request: with a database or Redis
+    cache every lookup is a round trip."""
+    if not hasattr(request, 'low_stock'):
+        request.low_stock = low_stock()
+    return request.low_stock
+
+
+class LowStockFilter(admin.SimpleListFilter):
+    title = 'stock level'
+    parameter_name = 'stock_level'
+
+    def lookups(self, request, model_admin):
+        return [('low', 'Low stock'), ('out', 'Out of stock')]
+
+    def queryset(self, request, queryset):
+        index = request_low_stock(request)
+        if self.value() == 'low':
+            return queryset.filter(pk__in=list(index))
+        if self.value() == 'out':
+            return queryset.filter(
+                pk__in=[pk for pk, (stock, _) in index.items() if not stock]
+            )
+        return queryset
 
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
+    form = ProductAdminForm
     list_display = ('name', 'price', 'stock', 'stock_status')
     search_fields = ('name', 'description')
-    list_filter = ('created_at',)
+    list_filter = (LowStockFilter, 'created_at')
     list_editable = ('price', 'stock')
     ordering = ('-created_at',)
 
+    def get_changelist_instance(self, request):
+        # Hand each row its entry in the low-stock index, read once for
+        # the page, for stock_status
+        changelist = super().get_changelist_instance(request)
+        index = request_low_stock(request)
+        for product in changelist.result_list:
+            product.low_stock = index.get(product.pk)
+        return changelist
+
     def stock_status(self, obj):
-        if obj.stock == 0:
-            color = 'red'
-            text = 'Out of Stock'
-        elif obj.stock < 10:
-            color = 'orange'
-            text = 'Low Stock'
-        else:
+        # From the cached low-stock index, which also knows how many
+        # units unpaid checkouts hold, rather than a query per row
+        entry = obj.low_stock
+        if entry is None:
             color = 'green'
             text = 'In Stock'
+        else:
+            stock, reserved = entry
+            color = 'orange' if stock else 'red'
+            text = 'Low Stock' if stock else 'Out of Stock'
+            if reserved:
+                text = f'{text} ({reserved} reserved)'
         return format_html(
             '<span style="color: {}; font-weight: bold;">{}</span>',
             color,
@@ -28,6 +82,46 @@ class ProductAdmin(admin.ModelAdmin):
         )
     stock_status.short_description = 'Stock Status'
 
+    class Media:
+        js = ('js/admin_direct_upload.js',)
+
+    def get_urls(self):
+        return [
+            path(
+                'presign-upload/',
+                self.admin_site.admin_view(self.presign_upload_view),
+                name='store_product_presign_upload',
+            ),
+            *super().get_urls(),
+        ]
+
+    @method_decorator(require_POST)
+    def presign_upload_view(self, request):
+        """Presigned POST for uploading a product image directly to S3."""
+        if not (
+            self.has_add_permission(request)
+            or self.has_change_permission(request)
+        ):
+            raise PermissionDenied
+        if not hasattr(default_storage, 'presigned_post'):
+            raise Http404("Direct uploads need the S3 media storage.")
+        filename = request.POST.get('filename', '')
+        content_type = request.POST.get('content_type', '')
+        if not filename or content_type not in DIRECT_UPLOAD_TYPES:
+            return JsonResponse(
+                {'error': "Choose a JPEG, PNG, WebP or GIF image."},
+                status=400,
+            )
+        name = Product._meta.get_field('image').generate_filename(
+            None, filename
+        )
+        return JsonResponse(default_storage.presigned_post(
+            name,
+            content_type,
+            max_size=settings.DIRECT_UPLOAD_MAX_SIZE,
+            expires=settings.DIRECT_UPLOAD_EXPIRES,
+        ))
+
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -40,18 +134,62 @@ class OrderItemInline(admin.TabularInline):
     line_total.short_description = 'Line Total'
 
 
+def status_action(status):
+    """Admin action moving the selected orders to `status`, with one
+    UPDATE for all of them (see store.order_status)."""
+    label = dict(Order.STATUS_CHOICES)[status]
+
+    @admin.action(
+        description=f"Mark selected orders as {label.lower()}",
+        permissions=['change'],
+    )
+    def action(modeladmin, request, queryset):
+        moved, skipped = transition(queryset, status)
+        if moved:
+            modeladmin.message_user(
+                request, f"{len(moved)} orders marked as {label.lower()}."
+            )
+        if skipped:
+            modeladmin.message_user(
+                request,
+                f"{skipped} orders left unchanged: their status can't "
+                f"change to {label.lower()}.",
+                messages.WARNING,
+            )
+    action.__name__ = f'mark_{status}'
+    return action
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
+    form = OrderAdminForm
     list_display = (
         'id', 'user', 'total_display', 'status', 'created_at', 'updated_at'
     )
     inlines = [OrderItemInline]
+    actions = [
+        status_action('paid'),
+        status_action('shipped'),
+        status_action('canceled'),
+        *admin_actions('orders'),
+    ]
     list_filter = ('status', 'created_at')
     search_fields = ('user__username', 'user__email', 'id')
     readonly_fields = ('created_at', 'updated_at', 'total_display')
-    list_editable = ('status',)
     ordering = ('-created_at',)
 
+    def save_model(self, request, obj, form, change):
+        shipped = (
+            change
+            and 'status' in form.changed_data
+            and obj.status == 'shipped'
+        )
+        if shipped:
+            obj.shipping_email_pending = True
+        super().save_model(request, obj, form, change)
+        if shipped:
+            schedule_shipping_notifications([obj.pk])
+
     def total_display(self, obj):
         return f"€{obj.total_cents / 100:.2f}"
     total_display.short_description = 'Total'
@@ -74,6 +212,7 @@ class ReviewAdmin(admin.ModelAdmin):
     search_fields = ('product__name', 'user__username', 'comment')
     readonly_fields = ('created_at',)
     ordering = ('-created_at',)
+    actions = admin_actions('reviews')
 
     def rating_stars(self, obj):
         stars = '⭐' * obj.rating
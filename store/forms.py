@@ -1,5 +1,10 @@
 from django import forms
-from .models import Review
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+from .models import Order, Product, Review
+from .order_status import can_transition
 
 COUNTRY_CHOICES = [
     ('', 'Select Country'),
@@ -33,3 +38,68 @@ class CheckoutForm(forms.Form):
     country = forms.ChoiceField(choices=COUNTRY_CHOICES, label="Country")
     email = forms.EmailField(max_length=100, label="Email")
     phone = forms.CharField(max_length=20, label="Phone")
+
+
+class ProductAdminForm(forms.ModelForm):
+    """Product admin form that also accepts an image uploaded to S3.
+
+    static/js/admin_direct_upload.js uploads the chosen file with a
+    presigned POST and puts the stored name in `image_upload`, so only the
+    name passes through Django.
+    """
+    image_upload = forms.CharField(required=False, widget=forms.HiddenInput)
+
+    class Meta:
+        model = Product
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if hasattr(default_storage, 'presigned_post'):
+            self.fields['image_upload'].widget.attrs['data-presign-url'] = (
+                reverse('admin:store_product_presign_upload')
+            )
+
+    def clean_image_upload(self):
+        name = self.cleaned_data['image_upload']
+        upload_to = Product._meta.get_field('image').upload_to
+        if not name:
+            return name
+        if not (name.startswith(upload_to) and default_storage.exists(name)):
+            raise forms.ValidationError(
+                "The uploaded image could not be found. "
+                "Please choose it again."
+            )
+        # S3 enforces the policy's size limit; check anyway for stand-ins
+        if default_storage.size(name) > settings.DIRECT_UPLOAD_MAX_SIZE:
+            default_storage.delete(name)
+            raise forms.ValidationError("The uploaded image is too large.")
+        return name
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('image_upload'):
+            cleaned_data['image'] = cleaned_data['image_upload']
+        return cleaned_data
+
+
+class OrderAdminForm(forms.ModelForm):
+    """Order admin form that only allows the moves in
+    store.order_status.TRANSITIONS."""
+
+    class Meta:
+        model = Order
+        fields = '__all__'
+
+    def clean_status(self):
+        status = self.cleaned_data['status']
+        current = self.instance.status if self.instance.pk else None
+        if (
+            current
+            and status != current
+            and not can_transition(current, status)
+        ):
+            raise forms.ValidationError(
+                f"A {current} order can't be marked {status}."
+            )
+        return status
@@ -0,0 +1,162 @@
+"""
+Responsive derivatives of product images.
+
+Every product image gets JPEG and WebP copies at the widths in WIDTHS
+(never wider than the original), written through the default storage,
+which is custom_storages.MediaStorage when USE_AWS is set. The names
+are recorded on Product.image_variants and rendered as srcset by the
+product_images template tags.
+
+Resizing a large upload takes long enough that it should not happen in
+the request that saved the product, so saves only schedule the work on
+a small background thread pool once the transaction commits. That pool
+dies with the process; the row itself records what is left to do (see
+Product.image_variants_pending()), and the build_image_derivatives
+management command builds it synchronously. Schedule the command to
+catch builds a restart lost.
+
+An image that can't be decoded is recorded as failed on the row, so
+neither saves nor the command try it again until a new one is uploaded.
+"""
+import io
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+from django.contrib.staticfiles import finders
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from fithub.cache_versions import bump_version
+from store.models import Product
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = (320, 480, 640, 960)
+FORMATS = {
+    'jpeg': ('JPEG', 'jpg', {'quality': 80, 'optimize': True,
+                             'progressive': True}),
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 6}),
+}
+DERIVATIVES_DIR = 'products/derivatives'
+
+# Errors that mean the stored image will never decode; anything else
+# (storage unreachable, say) is tried again
+UNDECODABLE = (
+    FileNotFoundError, UnidentifiedImageError, Image.DecompressionBombError
+)
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='images')
+
+
+def open_source(name):
+    """Open a product image by its stored name.
+
+    Uploads are in media storage; the seeded catalogue refers to files in
+    static/img/products/.
+    """
+    if name.startswith('products/'):
+        with default_storage.open(name) as f:
+            return Image.open(io.BytesIO(f.read()))
+    path = finders.find(f'img/products/{name}')
+    if path is None:
+        raise FileNotFoundError(name)
+    return Image.open(path)
+
+
+def derivative_widths(width):
+    """WIDTHS up to `width`, plus the original width if it is smaller."""
+    widths = [w for w in WIDTHS if w <= width]
+    if width < WIDTHS[-1] and width not in widths:
+        widths.append(width)
+    return widths
+
+
+def encode(image, fmt):
+    pil_format, _, options = FORMATS[fmt]
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def delete_variants(variants):
+    for fmt in FORMATS:
+        for _, name in variants.get(fmt, ()):
+            default_storage.delete(name)
+
+
+def build_variants(product):
+    """Write the derivatives for `product` and record them on the row."""
+    start = time.perf_counter()
+    source = open_source(product.image.name)
+    source = ImageOps.exif_transpose(source).convert('RGB')
+    stem = PurePosixPath(product.image.name).stem
+    variants = {
+        'source': product.image.name,
+        'width': source.width,
+        'height': source.height,
+        **{fmt: [] for fmt in FORMATS},
+    }
+    for width in derivative_widths(source.width):
+        height = round(source.height * width / source.width)
+        resized = source.resize((width, height), Image.LANCZOS)
+        for fmt, (_, extension, _) in FORMATS.items():
+            name = default_storage.save(
+                f'{DERIVATIVES_DIR}/{stem}-{width}w.{extension}',
+                ContentFile(encode(resized, fmt)),
+            )
+            variants[fmt].append([width, name])
+
+    delete_variants(product.image_variants)
+    Product.objects.filter(pk=product.pk).update(image_variants=variants)
+    product.image_variants = variants
+    # update() skips the signal that invalidates cached product pages
+    bump_version('products')
+    elapsed = time.perf_counter() - start
+    logger.info(
+        "Built image variants for product %s in %.1fms",
+        product.pk,
+        elapsed * 1000,
+        extra={'product_id': product.pk,
+               'duration_ms': round(elapsed * 1000, 2)},
+    )
+    return variants
+
+
+def mark_undecodable(product, error):
+    """Record that `product`'s image can't be decoded, keeping the
+    variants of the previous image for the next build to delete."""
+    variants = {**product.image_variants, 'failed': product.image.name}
+    Product.objects.filter(pk=product.pk).update(image_variants=variants)
+    product.image_variants = variants
+    logger.warning(
+        "Product %s: can't decode image %r: %s",
+        product.pk, product.image.name, error,
+        extra={'product_id': product.pk},
+    )
+
+
+def _build_in_background(product_id):
+    close_old_connections()
+    try:
+        product = Product.objects.filter(pk=product_id).first()
+        if product and product.image_variants_pending():
+            try:
+                build_variants(product)
+            except UNDECODABLE as e:
+                mark_undecodable(product, e)
+    except Exception:
+        logger.exception("Building image variants failed for product %s",
+                         product_id)
+    finally:
+        connection.close()
+
+
+def schedule_variants(product_id):
+    """Build the product's derivatives in the background after commit."""
+    transaction.on_commit(
+        lambda: _executor.submit(_build_in_background, product_id)
+    )
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from store.images import UNDECODABLE, build_variants, mark_undecodable
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the resized JPEG/WebP variants of product images, including "
+        "any a restart kept the background builds from finishing. Products "
+        "whose variants are current, or whose image can't be decoded, are "
+        "skipped unless --force."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='*', type=int)
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Rebuild variants that are already up to date.",
+        )
+
+    def handle(self, *args, product_ids, force, **options):
+        products = Product.objects.exclude(image='').order_by('pk')
+        if product_ids:
+            products = products.filter(pk__in=product_ids)
+        built = failed = 0
+        for product in products:
+            if not product.image_variants_pending() and not force:
+                continue
+            try:
+                build_variants(product)
+            except UNDECODABLE as e:
+                mark_undecodable(product, e)
+                failed += 1
+                self.stderr.write(f"{product.pk} {product.image.name}: {e}")
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f"{product.pk} {product.image.name}: {e}")
+            else:
+                built += 1
+                self.stdout.write(f"{product.pk} {product.image.name}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Built variants for {built} products ({failed} failed)"
+        ))
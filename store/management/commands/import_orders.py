@@ -0,0 +1,11 @@
+from fithub.imports import ImportCommand, OrderImporter
+
+
+class Command(ImportCommand):
+    help = (
+        "Import order history from a CSV or JSON Lines file laid out like "
+        "the orders export: one row per item, the rows of an order sharing "
+        "its order_id. Orders belong to existing users, by username. "
+        "Running it twice imports the orders twice."
+    )
+    importer = OrderImporter
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from store.stock import release_expired
+
+
+class Command(BaseCommand):
+    help = (
+        "Give back the stock held by checkouts that expired unpaid. Run it "
+        "every few minutes, e.g. from Heroku Scheduler."
+    )
+
+    def handle(self, *args, **options):
+        released = release_expired()
+        self.stdout.write(self.style.SUCCESS(
+            f"Released {released} expired stock reservations"
+        ))
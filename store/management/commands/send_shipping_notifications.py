@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from store.order_status import send_pending_shipping_notifications
+
+
+class Command(BaseCommand):
+    help = (
+        "Email customers whose orders shipped but were never told, because "
+        "the background job was lost in a restart or the mail failed. Run "
+        "it every few minutes, e.g. from Heroku Scheduler."
+    )
+
+    def handle(self, *args, **options):
+        sent = send_pending_shipping_notifications()
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {sent} pending shipping notifications"
+        ))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_order_stripe_session_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='shipping_email_pending',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+    ]
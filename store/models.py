@@ -1,5 +1,18 @@
+import logging
+
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.templatetags.static import static
+
+from fithub.cache_versions import bump_after_commit
+
+logger = logging.getLogger(__name__)
+
+# Shown for products without a picture, or whose picture is missing
+PLACEHOLDER_IMAGE = 'img/default-product.jpg'
 
 
 class Product(models.Model):
@@ -8,12 +21,59 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=8, decimal_places=2, default=0.00)
     stock = models.PositiveIntegerField(default=0)
     image = models.ImageField(upload_to='products/', blank=True)
+    # Resized JPEG/WebP copies of `image`, built by store.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
+    def image_url(self):
+        """URL of the original image.
+
+        Uploads live in media storage under products/; the seeded catalogue
+        names files shipped in static/img/products/. One that isn't there
+        gets the placeholder, since the manifest storage raises for files
+        it didn't collect.
+        """
+        if self.image.name.startswith('products/'):
+            return self.image.url
+        try:
+            return static(f'img/products/{self.image.name}')
+        except ValueError:
+            logger.warning(
+                "Product %s: no static image %r", self.pk, self.image.name
+            )
+            return static(PLACEHOLDER_IMAGE)
+
+    def has_image_variants(self):
+        return self.image_variants.get('source') == self.image.name
+
+    def image_variants_pending(self):
+        """True if the image's variants are yet to be built: they are
+        neither current nor failed for this image."""
+        return (
+            bool(self.image)
+            and not self.has_image_variants()
+            and self.image_variants.get('failed') != self.image.name
+        )
+
+    def image_srcset(self, fmt):
+        """srcset value for one variant format ('jpeg' or 'webp')."""
+        if not self.has_image_variants():
+            return ''
+        return ', '.join(
+            f'{default_storage.url(name)} {width}w'
+            for width, name in self.image_variants[fmt]
+        )
+
+    def thumbnail_url(self):
+        """Smallest JPEG variant, or the original until variants exist."""
+        if self.has_image_variants():
+            return default_storage.url(self.image_variants['jpeg'][0][1])
+        return self.image_url()
+
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -29,6 +89,16 @@ class Order(models.Model):
         choices=STATUS_CHOICES,
         default='pending'
     )
+    # The Checkout Session paid for, so a webhook delivered twice can't
+    # make two orders
+    stripe_session_id = models.CharField(
+        max_length=255, unique=True, null=True, blank=True
+    )
+    # Set when the order ships, cleared once the customer is emailed;
+    # see store.order_status
+    shipping_email_pending = models.BooleanField(
+        default=False, db_index=True, editable=False
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -68,6 +138,32 @@ class OrderItem(models.Model):
         )
 
 
+class StockReservation(models.Model):
+    """Units of a product held for a checkout until it is paid for or
+    expires; see store.stock."""
+    token = models.UUIDField(db_index=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    product = models.ForeignKey(
+        Product,
+        related_name='reservations',
+        on_delete=models.CASCADE
+    )
+    quantity = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    # Set when the payment webhook turns the reservation into an order
+    order = models.ForeignKey(
+        Order,
+        related_name='reservations',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True
+    )
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product} for {self.user}"
+
+
 class Review(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(
@@ -81,3 +177,22 @@ class Review(models.Model):
 
     def __str__(self):
         return f"{self.rating} stars by {self.user.username}"
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def bump_products_version(sender, **kwargs):
+    bump_after_commit('products', 'stock')
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def bump_reviews_version(sender, **kwargs):
+    bump_after_commit('reviews')
+
+
+@receiver(post_save, sender=Product)
+def schedule_image_variants(sender, instance, raw, **kwargs):
+    if not raw and instance.image_variants_pending():
+        from store.images import schedule_variants
+        schedule_variants(instance.pk)
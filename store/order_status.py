@@ -0,0 +1,170 @@
+"""
+The order status pipeline.
+
+    pending ──> paid ──> shipped
+       │          │
+       └──────────┴──> canceled
+
+Orders only move along TRANSITIONS. transition() moves many orders at
+once: it locks the chosen orders, moves those whose status allows it
+with a single UPDATE and leaves the rest alone.
+
+Customers whose orders ship are emailed after the transaction commits.
+One background job handles the whole batch, loading the orders
+NOTIFY_BATCH_SIZE at a time and sending each group over one SMTP
+connection, so the admin request that shipped them never waits on mail.
+
+The job runs in this process and dies with it, so shipping an order
+also sets Order.shipping_email_pending in the same UPDATE, and each
+batch clears it once sent. The send_shipping_notifications command
+sends whatever a restart or a mail error left pending; a customer may
+get an email twice, but not none.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .models import Order
+
+logger = logging.getLogger(__name__)
+
+TRANSITIONS = {
+    'pending': ('paid', 'canceled'),
+    'paid': ('shipped', 'canceled'),
+    'shipped': (),
+    'canceled': (),
+}
+
+# Orders loaded and mailed per SMTP connection
+NOTIFY_BATCH_SIZE = 200
+
+# How long the background job gets before the sweep sends its emails
+NOTIFY_SWEEP_AFTER = timedelta(minutes=10)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='orders')
+
+
+def can_transition(from_status, to_status):
+    return to_status in TRANSITIONS.get(from_status, ())
+
+
+def sources(to_status):
+    """The statuses an order can move to `to_status` from."""
+    return [
+        status for status, targets in TRANSITIONS.items()
+        if to_status in targets
+    ]
+
+
+def transition(queryset, to_status):
+    """Move the orders in `queryset` that may go to `to_status` there.
+
+    Returns (ids of the orders moved, number of orders left alone).
+    """
+    if to_status not in TRANSITIONS:
+        raise ValueError(f"Unknown order status {to_status!r}")
+    with transaction.atomic():
+        rows = list(
+            queryset.select_for_update(of=('self',))
+            .values_list('pk', 'status')
+        )
+        moved = [
+            pk for pk, status in rows if can_transition(status, to_status)
+        ]
+        if moved:
+            changes = {'status': to_status, 'updated_at': timezone.now()}
+            if to_status == 'shipped':
+                changes['shipping_email_pending'] = True
+            Order.objects.filter(
+                pk__in=moved, status__in=sources(to_status)
+            ).update(**changes)
+            if to_status == 'shipped':
+                schedule_shipping_notifications(moved)
+    return moved, len(rows) - len(moved)
+
+
+def shipping_message(order):
+    user = order.user
+    return EmailMessage(
+        "Your FitLife Hub order has shipped",
+        f"Hi {user.first_name or user.username},\n\n"
+        f"Your order #{order.pk} is on its way.\n\n"
+        "FitLife Hub Team",
+        settings.DEFAULT_FROM_EMAIL,
+        [user.email],
+    )
+
+
+def send_shipping_notifications(order_ids):
+    """Email the customers of those of `order_ids` still waiting for
+    their shipping email, and clear the orders' pending flag.
+
+    Returns the number of messages sent.
+    """
+    order_ids = list(order_ids)
+    sent = 0
+    for start in range(0, len(order_ids), NOTIFY_BATCH_SIZE):
+        orders = list(
+            Order.objects
+            .filter(
+                pk__in=order_ids[start:start + NOTIFY_BATCH_SIZE],
+                shipping_email_pending=True,
+            )
+            .select_related('user')
+            .only('user__username', 'user__first_name', 'user__email')
+            .order_by('pk')
+        )
+        messages = [
+            shipping_message(order) for order in orders if order.user.email
+        ]
+        if messages:
+            with get_connection() as mail:
+                sent += mail.send_messages(messages)
+        if orders:
+            Order.objects.filter(
+                pk__in=[order.pk for order in orders]
+            ).update(shipping_email_pending=False)
+    return sent
+
+
+def send_pending_shipping_notifications(now=None):
+    """Send the shipping emails that no background job sent.
+
+    Orders shipped within NOTIFY_SWEEP_AFTER are left to their job.
+    Returns the number of messages sent.
+    """
+    now = now or timezone.now()
+    order_ids = list(
+        Order.objects.filter(
+            shipping_email_pending=True,
+            updated_at__lte=now - NOTIFY_SWEEP_AFTER,
+        ).order_by('pk').values_list('pk', flat=True)
+    )
+    return send_shipping_notifications(order_ids)
+
+
+def _notify_in_background(order_ids):
+    close_old_connections()
+    try:
+        send_shipping_notifications(order_ids)
+    except Exception:
+        logger.exception(
+            "Sending shipping notifications failed for %d orders",
+            len(order_ids),
+        )
+    finally:
+        connection.close()
+
+
+def schedule_shipping_notifications(order_ids):
+    """Queue the shipping emails for `order_ids` as one background job,
+    after the transaction commits."""
+    order_ids = list(order_ids)
+    transaction.on_commit(
+        lambda: _executor.submit(_notify_in_background, order_ids)
+    )
@@ -0,0 +1,272 @@
+"""
+Holding stock for checkouts.
+
+Stock is taken when a checkout starts, not when Stripe reports the
+payment, so two buyers can't both pay for the last unit. reserve()
+takes every line with a conditional UPDATE (stock = stock - quantity
+WHERE stock >= quantity), all or nothing, and records what it took as
+StockReservations. The Stripe Checkout Session expires after
+STOCK_RESERVATION_TTL, but never sooner than Stripe allows, and its
+reservations a few minutes after it, so a session can't still be paid
+once its stock is given back. The payment webhook turns them into an
+order with fill_checkout(); release_expired(), run by the
+release_expired_reservations command, gives back the stock of
+checkouts that were never paid.
+
+Product.stock is therefore the stock still free for new checkouts.
+low_stock() lists the products running out, for the admin.
+"""
+import logging
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from fithub.cache_versions import bump_after_commit, get_version
+
+from .models import Product, StockReservation
+
+logger = logging.getLogger(__name__)
+
+# Paid reservations are kept this long, so that Stripe retrying a webhook
+# (for up to three days) finds its checkout already filled.
+KEEP_FILLED = timedelta(days=30)
+RELEASE_BATCH_SIZE = 500
+# Stripe rejects a Checkout Session that expires sooner than this after
+# it is created
+STRIPE_MIN_SESSION_LIFETIME = 30 * 60
+# Slack for the Stripe API call's latency and clock skew
+SESSION_EXPIRY_MARGIN = 60
+# Reservations outlive their session by this much
+RESERVATION_GRACE = 5 * 60
+# The version counter keeps the index current; this bounds its lifetime
+LOW_STOCK_TIMEOUT = 60 * 60
+
+
+class OutOfStock(Exception):
+    def __init__(self, product, available):
+        super().__init__(
+            f"Only {available} units of {product.name} are available."
+        )
+        self.product = product
+        self.available = available
+
+
+def take(product_id, quantity, returning=0):
+    """Take `quantity` units of a product if that many are left, after
+    giving back the `returning` units an earlier checkout held."""
+    return bool(
+        Product.objects.filter(pk=product_id, stock__gte=quantity - returning)
+        .update(stock=F('stock') + returning - quantity)
+    )
+
+
+def give_back(quantities):
+    """Return stock taken earlier; `quantities` maps product id to
+    units."""
+    for product_id, quantity in sorted(quantities.items()):
+        Product.objects.filter(pk=product_id).update(
+            stock=F('stock') + quantity
+        )
+
+
+def session_lifetime():
+    return max(settings.STOCK_RESERVATION_TTL, STRIPE_MIN_SESSION_LIFETIME)
+
+
+def session_expires_at(reserved_until):
+    """The Unix time a Checkout Session for a reservation held until
+    `reserved_until` should expire: comfortably past Stripe's minimum,
+    counted from now, and no later than the reservation.
+
+    Call it just before creating the session.
+    """
+    return min(
+        int(time.time()) + session_lifetime() + SESSION_EXPIRY_MARGIN,
+        int(reserved_until.timestamp()),
+    )
+
+
+def held(reservations):
+    """{product id: units} held by `reservations`."""
+    quantities = Counter()
+    for product_id, quantity in reservations.values_list(
+        'product_id', 'quantity'
+    ):
+        quantities[product_id] += quantity
+    return quantities
+
+
+def held_by(user):
+    """{product id: units} held by `user`'s unpaid checkouts."""
+    return held(StockReservation.objects.filter(user=user, order__isnull=True))
+
+
+def reserve(user, lines):
+    """Hold the (product, quantity) `lines` for `user` and return the
+    checkout's (token, expiry).
+
+    A user has one checkout open at a time: the stock their earlier
+    unpaid checkouts hold is given back, so submitting twice or going
+    back and retrying doesn't hold the cart twice. An earlier session
+    paid anyway is filled from free stock by fill_checkout().
+
+    Raises OutOfStock, holding nothing new and keeping the earlier
+    checkouts, if any line can't be filled.
+    """
+    token = uuid.uuid4()
+    expires_at = timezone.now() + timedelta(
+        seconds=session_lifetime() + RESERVATION_GRACE
+    )
+    wanted = Counter()
+    products = {}
+    for product, quantity in lines:
+        wanted[product.pk] += quantity
+        products[product.pk] = product
+    with transaction.atomic():
+        earlier = StockReservation.objects.select_for_update().filter(
+            user=user, order__isnull=True
+        )
+        returning = held(earlier)
+        # Products in id order, so concurrent checkouts lock rows in the
+        # same order and can't deadlock
+        for product_id in sorted(wanted.keys() | returning.keys()):
+            if not take(product_id, wanted[product_id],
+                        returning[product_id]):
+                available = Product.objects.filter(pk=product_id).values_list(
+                    'stock', flat=True
+                ).first() or 0
+                raise OutOfStock(
+                    products[product_id], available + returning[product_id]
+                )
+        earlier.delete()
+        StockReservation.objects.bulk_create(
+            StockReservation(
+                token=token, user=user, product=product, quantity=quantity,
+                expires_at=expires_at,
+            )
+            for product, quantity in lines
+        )
+    bump_after_commit('stock')
+    return token, expires_at
+
+
+def release(token, user=None):
+    """Give back the stock of a checkout that won't be paid for; only if
+    it is `user`'s, when given."""
+    with transaction.atomic():
+        reservations = StockReservation.objects.select_for_update().filter(
+            token=token, order__isnull=True
+        )
+        if user is not None:
+            reservations = reservations.filter(user=user)
+        give_back(held(reservations))
+        reservations.delete()
+    bump_after_commit('stock')
+
+
+def fill_checkout(token, cart):
+    """The (product, quantity) lines to fill a paid checkout's order
+    with, and the reservations they came from; None if an order was
+    already made for this checkout.
+
+    Call it inside a transaction. A checkout whose reservations were
+    released, or that was started before reservations existed, takes
+    its stock from `cart` now; lines that can't be filled are logged
+    and left out.
+    """
+    reservations = []
+    if token:
+        reservations = list(
+            StockReservation.objects.select_for_update(of=('self',))
+            .filter(token=token)
+            .select_related('product')
+        )
+        if any(reservation.order_id for reservation in reservations):
+            return None
+    if reservations:
+        lines = [(r.product, r.quantity) for r in reservations]
+        return lines, reservations
+
+    products = Product.objects.in_bulk([int(pk) for pk in cart])
+    lines = []
+    for product_id, quantity in cart.items():
+        product = products.get(int(product_id))
+        if product is None or not take(product.pk, quantity):
+            logger.error(
+                "Paid checkout %s: product %s x %s could not be filled",
+                token, product_id, quantity,
+            )
+            continue
+        lines.append((product, quantity))
+    bump_after_commit('stock')
+    return lines, []
+
+
+def release_expired(now=None, batch_size=RELEASE_BATCH_SIZE):
+    """Give back the stock of unpaid reservations that have expired and
+    forget paid ones older than KEEP_FILLED.
+
+    Returns the number of reservations released.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(order__isnull=True, expires_at__lte=now)
+                .order_by('pk')
+                .values_list('pk', 'product_id', 'quantity')[:batch_size]
+            )
+            if not batch:
+                break
+            quantities = Counter()
+            for _, product_id, quantity in batch:
+                quantities[product_id] += quantity
+            give_back(quantities)
+            StockReservation.objects.filter(
+                pk__in=[pk for pk, _, _ in batch]
+            ).delete()
+        released += len(batch)
+    StockReservation.objects.filter(
+        order__isnull=False, created_at__lt=now - KEEP_FILLED
+    ).delete()
+    if released:
+        bump_after_commit('stock')
+    return released
+
+
+def low_stock():
+    """{product id: (stock, reserved)} for every product with fewer than
+    LOW_STOCK_THRESHOLD units left, where `reserved` is the units held by
+    unpaid checkouts.
+
+    Cached until stock next changes.
+    """
+    key = f"low-stock:{get_version('stock')}"
+    index = cache.get(key)
+    if index is None:
+        index = {
+            pk: (stock, reserved)
+            for pk, stock, reserved in Product.objects.filter(
+                stock__lt=settings.LOW_STOCK_THRESHOLD
+            ).annotate(
+                reserved=Coalesce(
+                    Sum(
+                        'reservations__quantity',
+                        filter=Q(reservations__order__isnull=True),
+                    ),
+                    0,
+                )
+            ).values_list('pk', 'stock', 'reserved')
+        }
+        cache.set(key, index, LOW_STOCK_TIMEOUT)
+    return index
@@ -0,0 +1,23 @@
+from django import template
+
+register = template.Library()
+
+
+@register.inclusion_tag('store/product_picture.html')
+def product_picture(product, css_class='', sizes='100vw', loading='lazy'):
+    """<picture> for a product image with WebP and JPEG srcsets.
+
+    Until store.images has built the derivatives this falls back to the
+    original image, and to the default image for products without one.
+    """
+    variants = product.image_variants if product.has_image_variants() else {}
+    return {
+        'product': product,
+        'css_class': css_class,
+        'sizes': sizes,
+        'loading': loading,
+        'webp_srcset': product.image_srcset('webp'),
+        'jpeg_srcset': product.image_srcset('jpeg'),
+        'width': variants.get('width'),
+        'height': variants.get('height'),
+    }
@@ -1,7 +1,32 @@
+import io
+import json
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.conf import settings
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
-from .models import Product, Order, OrderItem, Review
+import boto3
+import requests
+from moto import mock_aws
+from PIL import Image
+
+from fithub.cache_versions import get_version
+
+from . import images, order_status, stock
+from .models import Product, Order, OrderItem, Review, StockReservation
 
 User = get_user_model()
 
@@ -9,6 +34,7 @@ User = get_user_model()
 class StoreTests(TestCase):
     """Tests for store app: Products, cart, orders, reviews."""
     def setUp(self):
+        cache.clear()
         # Create a reusable test user and a sample product used across tests
         self.user = User.objects.create_user(
             username='testuser',
@@ -402,6 +428,48 @@ class StoreTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'store/checkout.html')
 
+    def test_checkout_post_redirects_to_stripe(self):
+        # A valid checkout form creates a Stripe session asynchronously
+        self.client.login(username='testuser', password='pass')
+        self.client.post(reverse('store:cart_add', args=[self.product.pk]))
+        data = {
+            'full_name': 'Test User', 'address': '1 Main St',
+            'city': 'Dublin', 'postcode': 'D01', 'country': 'IE',
+            'email': 'test@example.com', 'phone': '0123',
+        }
+        with patch('stripe.checkout.Session.create_async') as mock_create:
+            mock_create.return_value = MagicMock(
+                url='https://stripe.test/session'
+            )
+            response = self.client.post(reverse('store:checkout'), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, 'https://stripe.test/session')
+        kwargs = mock_create.await_args.kwargs
+        self.assertEqual(kwargs['customer_email'], 'test@example.com')
+        self.assertEqual(kwargs['metadata']['user_id'], self.user.id)
+
+    def test_checkout_insufficient_stock(self):
+        # Asking for more than is in stock redirects back to the cart
+        self.client.login(username='testuser', password='pass')
+        session = self.client.session
+        session['cart'] = {str(self.product.pk): self.product.stock + 1}
+        session.save()
+        response = self.client.get(reverse('store:checkout'))
+        self.assertRedirects(response, reverse('store:cart'))
+
+    def test_oneoff_checkout(self):
+        # Buying a single product goes straight to a Stripe session
+        self.client.login(username='testuser', password='pass')
+        url = reverse('store:oneoff_checkout', args=[self.product.pk])
+        with patch('stripe.checkout.Session.create_async') as mock_create:
+            mock_create.return_value = MagicMock(
+                url='https://stripe.test/oneoff'
+            )
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        metadata = mock_create.await_args.kwargs['metadata']
+        self.assertEqual(metadata['product_id'], self.product.pk)
+
     def test_clear_cart(self):
         # Clear cart endpoint should empty the session cart
         self.client.login(username='testuser', password='pass')
@@ -588,3 +656,726 @@ class StoreTests(TestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "Out of Stock")
+
+
+class CartCountTests(TestCase):
+    """Tests for the cached cart item count in the navbar."""
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='cartuser', email='cart@example.com', password='pass'
+        )
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(
+            name="Band", description="Stretchy.", price=5, stock=10
+        )
+
+    def test_add_to_cart_returns_count(self):
+        url = reverse('store:cart_add', args=[self.product.pk])
+        self.client.post(url)
+        response = self.client.post(url)
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_badge_shows_count_from_cache(self):
+        self.client.get(reverse('home'))
+        self.client.post(reverse('store:cart_add', args=[self.product.pk]))
+        self.client.post(reverse('store:buy_now', args=[self.product.pk]))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('home'))
+        self.assertContains(
+            response,
+            '<span id="cart-count" class="badge rounded-pill bg-primary">'
+            '1</span>',
+            html=True,
+        )
+        self.assertFalse(
+            any('django_session' in q['sql'] for q in ctx.captured_queries)
+        )
+
+    def test_badge_falls_back_to_session(self):
+        session = self.client.session
+        session['cart'] = {str(self.product.pk): 3}
+        session.save()
+        response = self.client.get(reverse('home'))
+        self.assertContains(
+            response,
+            '<span id="cart-count" class="badge rounded-pill bg-primary">'
+            '3</span>',
+            html=True,
+        )
+
+    def test_empty_cart_hides_badge(self):
+        self.client.post(reverse('store:cart_add', args=[self.product.pk]))
+        self.client.post(reverse('store:cart_clear'))
+        self.assertContains(
+            self.client.get(reverse('home')), 'bg-primary d-none'
+        )
+
+
+class ProductImageTests(TestCase):
+    """Tests for the responsive product image derivatives."""
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = self.settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 800), 'orange').save(buffer, 'JPEG')
+        with patch('store.images.schedule_variants'):
+            self.product = Product.objects.create(
+                name="Photo Product",
+                description="Has a picture.",
+                price=9.99,
+                stock=2,
+                image=SimpleUploadedFile('photo.jpg', buffer.getvalue()),
+            )
+
+    def test_build_variants(self):
+        variants = images.build_variants(self.product)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image_variants, variants)
+        self.assertTrue(self.product.has_image_variants())
+        self.assertEqual((variants['width'], variants['height']), (1200, 800))
+        self.assertEqual(
+            [w for w, _ in variants['webp']], [320, 480, 640, 960]
+        )
+        for width, name in variants['webp']:
+            with default_storage.open(name) as f, Image.open(f) as image:
+                self.assertEqual(image.format, 'WEBP')
+                self.assertEqual(
+                    image.size, (width, round(width * 800 / 1200))
+                )
+
+    def test_rebuild_deletes_old_variants(self):
+        old = images.build_variants(self.product)
+        images.build_variants(self.product)
+        for _, name in old['jpeg'] + old['webp']:
+            self.assertFalse(default_storage.exists(name))
+
+    def test_small_image_is_not_upscaled(self):
+        self.assertEqual(images.derivative_widths(500), [320, 480, 500])
+        self.assertEqual(images.derivative_widths(2000), [320, 480, 640, 960])
+
+    def test_save_schedules_build_after_commit(self):
+        self.product.name = "Renamed"
+        with patch.object(images._executor, 'submit') as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.save()
+        submit.assert_called_once_with(
+            images._build_in_background, self.product.pk
+        )
+
+    def test_current_variants_are_not_rebuilt(self):
+        images.build_variants(self.product)
+        self.product.refresh_from_db()
+        with patch('store.images.schedule_variants') as schedule:
+            self.product.save()
+        schedule.assert_not_called()
+
+    def test_undecodable_image_is_not_rescheduled(self):
+        self.product.image = SimpleUploadedFile('broken.jpg', b'not a jpeg')
+        with patch('store.images.schedule_variants'):
+            self.product.save()
+        with self.assertLogs('store.images', 'WARNING'):
+            images._build_in_background(self.product.pk)
+        self.product.refresh_from_db()
+        self.assertEqual(
+            self.product.image_variants['failed'], self.product.image.name
+        )
+        self.assertFalse(self.product.image_variants_pending())
+        with patch('store.images.schedule_variants') as schedule:
+            self.product.save()
+        schedule.assert_not_called()
+
+        # Uploading another image tries again
+        self.product.image = SimpleUploadedFile('new.jpg', b'not a jpeg')
+        with patch('store.images.schedule_variants') as schedule:
+            self.product.save()
+        schedule.assert_called_once_with(self.product.pk)
+
+    def test_product_list_renders_srcset(self):
+        images.build_variants(self.product)
+        response = self.client.get(reverse('store:product_list'))
+        self.assertContains(response, '<source type="image/webp" srcset=')
+        self.assertContains(response, 'photo-960w.webp 960w')
+        self.assertContains(response, 'width="1200" height="800"')
+
+    def test_product_list_falls_back_to_original(self):
+        response = self.client.get(reverse('store:product_list'))
+        self.assertContains(response, self.product.image.url)
+        self.assertNotContains(response, 'srcset')
+
+    def test_missing_static_image_falls_back_to_placeholder(self):
+        # The manifest storage raises for a file collectstatic never saw
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        with open(f'{static_root}/staticfiles.json', 'w') as manifest:
+            manifest.write(
+                '{"version": "1.1", "paths": {"img/default-product.jpg": '
+                '"img/default-product.abc123.jpg"}}'
+            )
+        self.product.image = 'missing.jpg'
+        storages = {
+            **settings.STORAGES,
+            'staticfiles': {
+                'BACKEND': 'django.contrib.staticfiles.storage.'
+                           'ManifestStaticFilesStorage',
+            },
+        }
+        with self.settings(STATIC_ROOT=static_root, STORAGES=storages):
+            with self.assertLogs('store.models', 'WARNING'):
+                url = self.product.image_url()
+        self.assertTrue(url.endswith('img/default-product.abc123.jpg'))
+
+    def test_seeded_images_exist(self):
+        with open(settings.BASE_DIR / 'store/fixtures/products.json') as f:
+            names = [
+                row['fields']['image'] for row in json.load(f)
+                if row['fields'].get('image')
+            ]
+        for name in names:
+            self.assertTrue(
+                (settings.BASE_DIR / 'static/img/products' / name).exists(),
+                name,
+            )
+
+    def test_management_command_backfills(self):
+        out = io.StringIO()
+        call_command('build_image_derivatives', stdout=out)
+        self.product.refresh_from_db()
+        self.assertTrue(self.product.has_image_variants())
+        self.assertIn('Built variants for 1 products', out.getvalue())
+
+    def test_management_command_skips_undecodable_images(self):
+        self.product.image = SimpleUploadedFile('broken.jpg', b'not a jpeg')
+        with patch('store.images.schedule_variants'):
+            self.product.save()
+        err = io.StringIO()
+        with self.assertLogs('store.images', 'WARNING'):
+            call_command('build_image_derivatives', stdout=io.StringIO(),
+                         stderr=err)
+        self.assertIn('broken', err.getvalue())
+        out = io.StringIO()
+        call_command('build_image_derivatives', stdout=out)
+        self.assertIn('Built variants for 0 products (0 failed)',
+                      out.getvalue())
+
+
+class ProductDirectUploadTests(TestCase):
+    """Tests for admin product images uploaded straight to S3."""
+    def setUp(self):
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        boto3.client('s3', region_name='us-east-1').create_bucket(
+            Bucket='fithub-test'
+        )
+        override = self.settings(STORAGES={
+            **settings.STORAGES,
+            'default': {
+                'BACKEND': 'custom_storages.MediaStorage',
+                'OPTIONS': {
+                    'bucket_name': 'fithub-test',
+                    'region_name': 'us-east-1',
+                },
+            },
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass'
+        )
+        self.client.force_login(self.admin)
+        self.presign_url = reverse('admin:store_product_presign_upload')
+
+    def presign(self, **data):
+        return self.client.post(self.presign_url, data)
+
+    def upload(self, content=b'jpeg bytes'):
+        post = self.presign(
+            filename='mat.jpg', content_type='image/jpeg'
+        ).json()
+        response = requests.post(
+            post['url'], data=post['fields'],
+            files={'file': ('mat.jpg', content)},
+        )
+        self.assertLess(response.status_code, 300)
+        return post['name']
+
+    def add_product(self, image_upload):
+        with patch('store.images.schedule_variants'):
+            return self.client.post(reverse('admin:store_product_add'), {
+                'name': 'Mat',
+                'description': 'Grippy.',
+                'price': '20.00',
+                'stock': '4',
+                'image_upload': image_upload,
+            })
+
+    def test_add_form_wires_up_direct_upload(self):
+        response = self.client.get(reverse('admin:store_product_add'))
+        self.assertContains(response, f'data-presign-url="{self.presign_url}"')
+        self.assertContains(response, 'js/admin_direct_upload.js')
+
+    def test_presign_returns_post_for_products_dir(self):
+        response = self.presign(filename='mat.jpg', content_type='image/jpeg')
+        self.assertEqual(response.status_code, 200)
+        post = response.json()
+        self.assertTrue(post['name'].startswith('products/mat-'))
+        self.assertEqual(post['fields']['Content-Type'], 'image/jpeg')
+        self.assertIn('policy', post['fields'])
+
+    def test_presign_rejects_non_images(self):
+        response = self.presign(filename='x.html', content_type='text/html')
+        self.assertEqual(response.status_code, 400)
+
+    def test_presign_requires_staff(self):
+        self.client.logout()
+        response = self.presign(filename='mat.jpg', content_type='image/jpeg')
+        self.assertEqual(response.status_code, 302)
+
+    def test_presign_needs_s3_storage(self):
+        with self.settings(STORAGES={
+            **settings.STORAGES,
+            'default': {
+                'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            },
+        }):
+            response = self.presign(
+                filename='mat.jpg', content_type='image/jpeg'
+            )
+        self.assertEqual(response.status_code, 404)
+
+    def test_admin_saves_uploaded_name(self):
+        name = self.upload()
+        response = self.add_product(name)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Product.objects.get(name='Mat').image.name, name)
+
+    def test_admin_rejects_unknown_upload(self):
+        response = self.add_product('products/missing.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Product.objects.filter(name='Mat').exists())
+
+    def test_admin_rejects_oversized_upload(self):
+        name = self.upload(b'x' * 100)
+        with self.settings(DIRECT_UPLOAD_MAX_SIZE=10):
+            response = self.add_product(name)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Product.objects.filter(name='Mat').exists())
+
+
+class OrderStatusTests(TestCase):
+    """Tests for the order status pipeline and its admin actions."""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass'
+        )
+        self.customer = User.objects.create_user(
+            username='customer', email='customer@example.com',
+            first_name='Cara',
+        )
+        self.paid = [
+            Order.objects.create(user=self.customer, status='paid')
+            for _ in range(5)
+        ]
+        self.pending = Order.objects.create(user=self.customer)
+        self.shipped = Order.objects.create(
+            user=self.customer, status='shipped'
+        )
+
+    def test_transitions(self):
+        self.assertTrue(order_status.can_transition('pending', 'paid'))
+        self.assertTrue(order_status.can_transition('paid', 'shipped'))
+        self.assertFalse(order_status.can_transition('pending', 'shipped'))
+        self.assertFalse(order_status.can_transition('shipped', 'paid'))
+        self.assertEqual(
+            order_status.sources('canceled'), ['pending', 'paid']
+        )
+
+    def test_bulk_transition_is_one_update(self):
+        # One locking read and one UPDATE, inside a savepoint here
+        with patch.object(order_status._executor, 'submit') as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertNumQueries(4):
+                    moved, skipped = order_status.transition(
+                        Order.objects.all(), 'shipped'
+                    )
+        self.assertEqual(sorted(moved), [order.pk for order in self.paid])
+        self.assertEqual(skipped, 2)
+        self.assertEqual(
+            Order.objects.filter(status='shipped').count(), 6
+        )
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.status, 'pending')
+        self.assertEqual(
+            sorted(Order.objects.filter(shipping_email_pending=True)
+                   .values_list('pk', flat=True)),
+            sorted(moved),
+        )
+        # All the notifications go out as one job
+        submit.assert_called_once_with(
+            order_status._notify_in_background, moved
+        )
+
+    def test_unknown_status(self):
+        with self.assertRaises(ValueError):
+            order_status.transition(Order.objects.all(), 'lost')
+
+    def test_shipping_notifications(self):
+        no_email = User.objects.create_user(username='noemail')
+        order = Order.objects.create(user=no_email, status='shipped')
+        ids = [o.pk for o in self.paid] + [order.pk]
+        Order.objects.filter(pk__in=ids).update(shipping_email_pending=True)
+        # A read and an UPDATE clearing the flag per batch
+        with patch.object(order_status, 'NOTIFY_BATCH_SIZE', 4):
+            with self.assertNumQueries(4):
+                sent = order_status.send_shipping_notifications(ids)
+        self.assertEqual(sent, 5)
+        self.assertFalse(
+            Order.objects.filter(shipping_email_pending=True).exists()
+        )
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].to, ['customer@example.com'])
+        self.assertIn(f'#{self.paid[0].pk}', mail.outbox[0].body)
+        self.assertIn('Hi Cara', mail.outbox[0].body)
+
+    def test_notifications_are_sent_once(self):
+        self.paid[0].shipping_email_pending = True
+        self.paid[0].save()
+        ids = [self.paid[0].pk, self.paid[1].pk]
+        self.assertEqual(order_status.send_shipping_notifications(ids), 1)
+        self.assertEqual(order_status.send_shipping_notifications(ids), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failed_mail_stays_pending(self):
+        self.paid[0].shipping_email_pending = True
+        self.paid[0].save()
+        with patch(
+            'django.core.mail.backends.locmem.EmailBackend.send_messages',
+            side_effect=OSError('SMTP down'),
+        ), self.assertRaises(OSError):
+            order_status.send_shipping_notifications([self.paid[0].pk])
+        self.paid[0].refresh_from_db()
+        self.assertTrue(self.paid[0].shipping_email_pending)
+
+    def test_sweep_sends_notifications_a_restart_lost(self):
+        # The job was queued but the process died before it ran
+        with patch.object(order_status._executor, 'submit'):
+            with self.captureOnCommitCallbacks(execute=True):
+                moved, _ = order_status.transition(
+                    Order.objects.filter(pk=self.paid[0].pk), 'shipped'
+                )
+        # The sweep leaves recent shipments to their job
+        call_command('send_shipping_notifications', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+
+        later = timezone.now() + order_status.NOTIFY_SWEEP_AFTER
+        with patch('django.utils.timezone.now', return_value=later):
+            out = io.StringIO()
+            call_command('send_shipping_notifications', stdout=out)
+        self.assertIn('Sent 1 pending shipping notifications', out.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(f'#{moved[0]}', mail.outbox[0].body)
+
+    def test_admin_action(self):
+        self.client.force_login(self.admin)
+        with patch.object(order_status._executor, 'submit') as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    reverse('admin:store_order_changelist'),
+                    {
+                        'action': 'mark_shipped',
+                        '_selected_action': [
+                            self.paid[0].pk, self.pending.pk
+                        ],
+                    },
+                    follow=True,
+                )
+        self.assertContains(response, '1 orders marked as shipped.')
+        self.assertContains(response, '1 orders left unchanged')
+        self.paid[0].refresh_from_db()
+        self.assertEqual(self.paid[0].status, 'shipped')
+        submit.assert_called_once()
+
+    def test_admin_form_rejects_invalid_transition(self):
+        self.client.force_login(self.admin)
+        response = self.client.post(
+            reverse('admin:store_order_change', args=[self.shipped.pk]),
+            {
+                'user': self.customer.pk,
+                'status': 'pending',
+                'items-TOTAL_FORMS': 0,
+                'items-INITIAL_FORMS': 0,
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "can&#x27;t be marked pending")
+        self.shipped.refresh_from_db()
+        self.assertEqual(self.shipped.status, 'shipped')
+
+
+class StockReservationTests(TestCase):
+    """Tests for holding stock from checkout until payment."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='pass'
+        )
+        self.rope = Product.objects.create(
+            name='Rope', description='Skipping.', price='10.00', stock=3
+        )
+        self.mat = Product.objects.create(
+            name='Mat', description='Yoga.', price='25.00', stock=20
+        )
+
+    def stock(self, product):
+        product.refresh_from_db()
+        return product.stock
+
+    def webhook(self, metadata, session_id=None):
+        event = {
+            'type': 'checkout.session.completed',
+            'data': {'object': {'id': session_id, 'metadata': metadata}},
+        }
+        with patch('stripe.Webhook.construct_event', return_value=event):
+            return self.client.post(
+                reverse('store:oneoff_webhook'), data='{}',
+                content_type='application/json',
+                HTTP_STRIPE_SIGNATURE='t=0,v1=test',
+            )
+
+    def test_reserve_is_all_or_nothing(self):
+        token, expires_at = stock.reserve(
+            self.user, [(self.rope, 2), (self.mat, 1)]
+        )
+        self.assertEqual(self.stock(self.rope), 1)
+        self.assertEqual(
+            StockReservation.objects.filter(token=token).count(), 2
+        )
+        self.assertGreater(expires_at, timezone.now())
+        other = User.objects.create_user(username='other')
+        with self.assertRaisesMessage(
+            stock.OutOfStock, 'Only 1 units of Rope are available.'
+        ):
+            stock.reserve(other, [(self.mat, 5), (self.rope, 2)])
+        # The mat line taken first was put back
+        self.assertEqual(self.stock(self.mat), 19)
+        self.assertEqual(StockReservation.objects.count(), 2)
+
+    def test_reserve_again_gives_back_earlier_checkout(self):
+        # A retried checkout swaps the user's hold rather than adding one
+        first, _ = stock.reserve(self.user, [(self.rope, 2), (self.mat, 5)])
+        second, _ = stock.reserve(self.user, [(self.rope, 3)])
+        self.assertEqual(self.stock(self.rope), 0)
+        self.assertEqual(self.stock(self.mat), 20)
+        self.assertEqual(
+            list(StockReservation.objects.values_list('token', flat=True)),
+            [second],
+        )
+        # Failing keeps the checkout the user already has
+        with self.assertRaises(stock.OutOfStock):
+            stock.reserve(self.user, [(self.rope, 4)])
+        self.assertEqual(self.stock(self.rope), 0)
+        self.assertEqual(StockReservation.objects.get().token, second)
+
+    def test_checkout_reserves_for_the_stripe_session(self):
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['cart'] = {str(self.rope.pk): 3}
+        session.save()
+        data = {
+            'full_name': 'Buyer', 'address': '1 Road', 'city': 'Dublin',
+            'postcode': 'D01', 'country': 'IE',
+            'email': 'buyer@example.com', 'phone': '123',
+        }
+        with patch('stripe.checkout.Session.create_async') as create:
+            create.return_value = MagicMock(url='https://stripe.test/s')
+            self.client.post(reverse('store:checkout'), data)
+            kwargs = create.await_args.kwargs
+        reservation = StockReservation.objects.get()
+        self.assertEqual(kwargs['metadata']['reservation'],
+                         str(reservation.token))
+        # Stripe rejects sessions expiring within 30 minutes; the stock
+        # stays held until the session is over
+        self.assertGreaterEqual(kwargs['expires_at'], time.time() + 1800)
+        self.assertLessEqual(
+            kwargs['expires_at'], reservation.expires_at.timestamp()
+        )
+        self.assertEqual(self.stock(self.rope), 0)
+        # Submitting again moves the hold to the new session
+        with patch('stripe.checkout.Session.create_async') as create:
+            create.return_value = MagicMock(url='https://stripe.test/s')
+            self.client.post(reverse('store:checkout'), data)
+            kwargs = create.await_args.kwargs
+        reservation = StockReservation.objects.get()
+        self.assertEqual(kwargs['metadata']['reservation'],
+                         str(reservation.token))
+        self.assertEqual(self.stock(self.rope), 0)
+        # The stock is gone, so another buyer's checkout can't oversell it
+        other = User.objects.create_user(username='other')
+        self.client.force_login(other)
+        session = self.client.session
+        session['cart'] = {str(self.rope.pk): 1}
+        session.save()
+        with patch('stripe.checkout.Session.create_async') as create:
+            response = self.client.post(reverse('store:checkout'), data)
+        self.assertRedirects(response, reverse('store:cart'))
+        create.assert_not_called()
+
+    def test_cancel_url_gives_back_the_stock(self):
+        self.client.force_login(self.user)
+        url = reverse('store:oneoff_checkout', args=[self.rope.pk])
+        with patch('stripe.checkout.Session.create_async') as create:
+            create.return_value = MagicMock(url='https://stripe.test/s')
+            self.client.get(url)
+            cancel_url = create.await_args.kwargs['cancel_url']
+        self.assertEqual(self.stock(self.rope), 2)
+        # Another user can't release it
+        other = User.objects.create_user(username='other')
+        self.client.force_login(other)
+        self.client.get(cancel_url)
+        self.assertEqual(self.stock(self.rope), 2)
+        self.client.force_login(self.user)
+        # Within checkout_cancel's budget for a one-product checkout
+        with self.assertNumQueries(7):
+            response = self.client.get(cancel_url)
+        self.assertTemplateUsed(response, 'store/checkout_cancel.html')
+        self.assertEqual(self.stock(self.rope), 3)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_buy_now_session_expires_after_stripe_minimum(self):
+        self.client.force_login(self.user)
+        url = reverse('store:oneoff_checkout', args=[self.rope.pk])
+        with self.settings(STOCK_RESERVATION_TTL=60), patch(
+            'stripe.checkout.Session.create_async'
+        ) as create:
+            create.return_value = MagicMock(url='https://stripe.test/s')
+            self.client.get(url)
+            expires_at = create.await_args.kwargs['expires_at']
+        self.assertGreaterEqual(expires_at, time.time() + 1800)
+        self.assertLessEqual(
+            expires_at, StockReservation.objects.get().expires_at.timestamp()
+        )
+
+    def test_failed_stripe_session_releases_stock(self):
+        self.client.force_login(self.user)
+        url = reverse('store:oneoff_checkout', args=[self.rope.pk])
+        with patch(
+            'stripe.checkout.Session.create_async',
+            side_effect=RuntimeError('Stripe is down'),
+        ):
+            with self.assertLogs('django.request', 'ERROR'):
+                with self.assertRaises(RuntimeError):
+                    self.client.get(url)
+        self.assertEqual(self.stock(self.rope), 3)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_webhook_fills_order_from_reservations_once(self):
+        token, _ = stock.reserve(self.user, [(self.rope, 2)])
+        metadata = {
+            'user_id': str(self.user.pk),
+            'cart': str({str(self.rope.pk): 2}),
+            'reservation': str(token),
+        }
+        self.assertEqual(self.webhook(metadata).status_code, 200)
+        order = Order.objects.get()
+        self.assertEqual(order.total_cents, 2000)
+        self.assertEqual(order.items.get().quantity, 2)
+        self.assertEqual(StockReservation.objects.get().order, order)
+        # Taken once, at checkout
+        self.assertEqual(self.stock(self.rope), 1)
+        # A retried event doesn't make a second order
+        self.webhook(metadata)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_webhook_without_reservation_takes_what_it_can(self):
+        # e.g. the reservation expired and was released before payment
+        metadata = {
+            'user_id': str(self.user.pk),
+            'cart': str({str(self.rope.pk): 5, str(self.mat.pk): 2}),
+            'reservation': '00000000-0000-0000-0000-000000000000',
+        }
+        with self.assertLogs('store.stock', 'ERROR'):
+            self.webhook(metadata)
+        order = Order.objects.get()
+        self.assertEqual(order.items.get().product, self.mat)
+        self.assertEqual(order.total_cents, 5000)
+        self.assertEqual(self.stock(self.rope), 3)
+        self.assertEqual(self.stock(self.mat), 18)
+
+    def test_retried_webhook_without_reservation_makes_one_order(self):
+        # The second delivery's stock is given back with its rollback
+        metadata = {
+            'user_id': str(self.user.pk),
+            'cart': str({str(self.mat.pk): 2}),
+        }
+        for _ in range(2):
+            response = self.webhook(metadata, session_id='cs_test_retry')
+            self.assertEqual(response.status_code, 200)
+        order = Order.objects.get()
+        self.assertEqual(order.stripe_session_id, 'cs_test_retry')
+        self.assertEqual(self.stock(self.mat), 18)
+
+    def test_release_expired_reservations(self):
+        other = User.objects.create_user(username='other')
+        expired, _ = stock.reserve(self.user, [(self.rope, 2)])
+        live, _ = stock.reserve(other, [(self.mat, 4)])
+        StockReservation.objects.filter(token=expired).update(
+            expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        out = io.StringIO()
+        call_command('release_expired_reservations', stdout=out)
+        self.assertIn('Released 1 expired stock reservations', out.getvalue())
+        self.assertEqual(self.stock(self.rope), 3)
+        self.assertEqual(self.stock(self.mat), 16)
+        self.assertEqual(StockReservation.objects.get().token, live)
+
+    def test_low_stock_index(self):
+        stock.reserve(self.user, [(self.rope, 1)])
+        self.assertEqual(stock.low_stock(), {self.rope.pk: (2, 1)})
+        with self.assertNumQueries(0):
+            stock.low_stock()
+        other = User.objects.create_user(username='other')
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.reserve(other, [(self.rope, 2)])
+        self.assertEqual(stock.low_stock(), {self.rope.pk: (0, 3)})
+
+    def test_paid_checkout_bumps_stock_after_commit(self):
+        # Until the order commits, the index must keep its old key
+        metadata = {
+            'user_id': str(self.user.pk),
+            'cart': str({str(self.mat.pk): 2}),
+        }
+        before = get_version('stock')
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.webhook(metadata)
+        self.assertEqual(get_version('stock'), before)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_version('stock'), before)
+
+    def test_admin_stock_status(self):
+        admin_user = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass'
+        )
+        self.client.force_login(admin_user)
+        stock.reserve(self.user, [(self.rope, 1)])
+        url = reverse('admin:store_product_changelist')
+        # One look at the index for the page, not one per row
+        with patch(
+            'store.admin.low_stock', wraps=stock.low_stock
+        ) as lookup:
+            response = self.client.get(url, {'stock_level': 'low'})
+            response = self.client.get(url)
+        self.assertEqual(lookup.call_count, 2)
+        self.assertContains(response, 'Low Stock (1 reserved)')
+        self.assertContains(response, 'In Stock')
+        response = self.client.get(url, {'stock_level': 'low'})
+        self.assertEqual(
+            [p.name for p in response.context['cl'].result_list], ['Rope']
+        )
@@ -1,5 +1,8 @@
+from django.core.cache import cache
 from django.core.mail import send_mail
 from django.conf import settings
+from django.http import Http404
+from .models import Product
 
 
 def send_order_confirmation_email(user, order):
@@ -18,3 +21,63 @@ def send_order_confirmation_email(user, order):
         [user.email],
         fail_silently=False,
     )
+
+
+def _pair_cart(cart, products):
+    pairs = []
+    for prod_id, qty in cart.items():
+        product = products.get(int(prod_id))
+        if product is None:
+            raise Http404("No Product matches the given query.")
+        pairs.append((product, qty))
+    return pairs
+
+
+def get_cart_products(cart):
+    """Resolve a session cart into (product, quantity) pairs.
+
+    All products are fetched in a single query instead of one per line.
+    """
+    products = Product.objects.in_bulk([int(pk) for pk in cart])
+    return _pair_cart(cart, products)
+
+
+async def aget_cart_products(cart):
+    """Async version of get_cart_products()."""
+    products = await Product.objects.ain_bulk([int(pk) for pk in cart])
+    return _pair_cart(cart, products)
+
+
+def _cart_count_key(session_key):
+    return f'cart-count:{session_key}'
+
+
+def save_cart(request, cart):
+    """Store `cart` in the session and update its cached item count."""
+    request.session['cart'] = cart
+    count = sum(cart.values())
+    if request.session.session_key:
+        cache.set(
+            _cart_count_key(request.session.session_key),
+            count,
+            settings.SESSION_COOKIE_AGE,
+        )
+    return count
+
+
+def cart_count(request):
+    """Number of items in the session cart, for the navbar badge.
+
+    Read from the cache, keyed by the session cookie, so rendering the
+    badge does not load the session. Only a miss falls back to it.
+    """
+    session = getattr(request, 'session', None)
+    if session is None or not session.session_key:
+        return 0
+    session_key = session.session_key
+    key = _cart_count_key(session_key)
+    count = cache.get(key)
+    if count is None:
+        count = sum(session.get('cart', {}).values())
+        cache.set(key, count, settings.SESSION_COOKIE_AGE)
+    return count
@@ -1,12 +1,18 @@
-from pyexpat.errors import messages
-import stripe
 import ast
+import uuid
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponse
-from django.shortcuts import redirect, render, get_object_or_404
+from django.contrib import messages
+from django.shortcuts import (
+    redirect, render, get_object_or_404, aget_object_or_404,
+)
 from django.contrib.admin.views.decorators import staff_member_required
-from .models import Product, Order, OrderItem, Review
+from .models import Product, Order, OrderItem, Review, StockReservation
 from django.http import JsonResponse
 from django.urls import reverse
 from django.contrib.auth.decorators import login_required
@@ -14,9 +20,22 @@ from .forms import ReviewForm
 from django.contrib.auth.models import User
 from django.views.decorators.http import require_POST
 from .forms import CheckoutForm
-from store.utils import send_order_confirmation_email
-
-
+from store.utils import (
+    send_order_confirmation_email, get_cart_products, aget_cart_products,
+    save_cart,
+)
+from fithub.conditional import conditional_page
+from fithub.decorators import query_budget
+from fithub.page_cache import public_page
+from fithub.stripe_client import stripe
+from store.stock import (
+    OutOfStock, fill_checkout, held_by, release, reserve,
+    session_expires_at,
+)
+
+
+@query_budget(3)
+@public_page('products')
 def product_list(request):
     """Display all products with search and filter."""
     products = Product.objects.all()
@@ -44,9 +63,11 @@ def product_list(request):
     })
 
 
+@query_budget(4)
+@conditional_page('products', 'reviews')
 def product_detail(request, pk):
     product = get_object_or_404(Product, pk=pk)
-    reviews = product.reviews.all()
+    reviews = product.reviews.select_related('user')
     can_review = request.user.is_authenticated
 
     if request.method == 'POST' and can_review:
@@ -67,14 +88,14 @@ def product_detail(request, pk):
     })
 
 
+@query_budget(3)
 @login_required
 def cart_view(request):
     """Display the user's cart stored in session."""
     cart = request.session.get('cart', {})  # {product_id: qty}
     items = []
     total = 0
-    for prod_id, qty in cart.items():
-        product = get_object_or_404(Product, pk=prod_id)
+    for product, qty in get_cart_products(cart):
         line_total = product.price * qty
         items.append({
             'product': product,
@@ -85,17 +106,21 @@ def cart_view(request):
     return render(request, 'store/cart.html', {'items': items, 'total': total})
 
 
+@query_budget(2)
 @login_required
 def add_to_cart(request, pk):
     """AJAX endpoint to add a product to the session cart."""
     if request.method == 'POST':
         cart = request.session.get('cart', {})
         cart[str(pk)] = cart.get(str(pk), 0) + 1
-        request.session['cart'] = cart
-        return JsonResponse({'message': 'Added to cart!'}, status=200)
+        count = save_cart(request, cart)
+        return JsonResponse(
+            {'message': 'Added to cart!', 'count': count}, status=200
+        )
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 
+@query_budget(5)
 @login_required
 @require_POST
 def cart_update(request, pk):
@@ -106,75 +131,94 @@ def cart_update(request, pk):
         cart[str(pk)] = quantity
     else:
         cart.pop(str(pk), None)
-    request.session['cart'] = cart
+    save_cart(request, cart)
     return redirect('store:cart')
 
 
+@query_budget(5)
 @login_required
 @require_POST
 def cart_remove(request, pk):
     """Remove a product from the cart."""
     cart = request.session.get('cart', {})
     cart.pop(str(pk), None)
-    request.session['cart'] = cart
+    save_cart(request, cart)
     return redirect('store:cart')
 
 
+@query_budget(3)
 @require_POST
 @login_required
-def create_payment_intent(request):
-    cart = request.session.get('cart', {})
+async def create_payment_intent(request):
+    cart = await request.session.aget('cart', {})
+    user = await request.auser()
     total = 0
-    for prod_id, qty in cart.items():
-        product = Product.objects.get(pk=prod_id)
+    for product, qty in await aget_cart_products(cart):
         total += product.price * qty
 
     try:
-        intent = stripe.PaymentIntent.create(
+        intent = await stripe.PaymentIntent.create_async(
             amount=int(total * 100),
             currency='eur',
-            metadata={'user_id': request.user.id, 'cart': str(cart)},
+            metadata={'user_id': user.id, 'cart': str(cart)},
         )
         return JsonResponse({'clientSecret': intent.client_secret})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=400)
 
 
+@query_budget(5)
 @require_POST
 @login_required
 def clear_cart(request):
-    request.session['cart'] = {}
+    save_cart(request, {})
     return JsonResponse({'message': 'Cart cleared'})
 
 
+@query_budget(5)
 @require_POST
 @login_required
 def buy_now(request, pk):
     """Add product to cart and redirect to checkout."""
     cart = request.session.get('cart', {})
     cart[str(pk)] = 1  # Set quantity to 1 for Buy Now
-    request.session['cart'] = cart
+    save_cart(request, cart)
     return redirect('store:checkout')
 
 
+def cancel_url(request, token):
+    """Where Stripe sends a buyer who leaves checkout: checkout_cancel,
+    told which reservation to give back."""
+    return request.build_absolute_uri(
+        f"{reverse('store:checkout_cancel')}?"
+        f"{urlencode({'reservation': token})}"
+    )
+
+
+@query_budget(4)
 @login_required
-def checkout_view(request):
-    cart = request.session.get('cart', {})
+async def checkout_view(request):
+    cart = await request.session.aget('cart', {})
     if not cart:
         return redirect('store:product_list')
+    # Reuse the user loaded by login_required when the template's context
+    # processors read request.user.
+    request.user = user = await request.auser()
 
     items = []
     line_items = []
     total = 0
 
-    # Check stock availability
-    for prod_id, qty in cart.items():
-        product = get_object_or_404(Product, pk=prod_id)
-        if product.stock < qty:
+    # Check stock availability; a new checkout gives back what the
+    # user's earlier ones hold, so that counts as available
+    held = await sync_to_async(held_by)(user)
+    for product, qty in await aget_cart_products(cart):
+        available = product.stock + held.get(product.pk, 0)
+        if available < qty:
             messages.error(
                 request,
                 (
-                    f"Sorry, only {product.stock} units of "
+                    f"Sorry, only {available} units of "
                     f"{product.name} are available."
                 )
             )
@@ -199,70 +243,109 @@ def checkout_view(request):
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
         if form.is_valid():
-            session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                customer_email=request.user.email,
-                line_items=line_items,
-                mode='payment',
-                success_url=request.build_absolute_uri(
-                    reverse('store:checkout_success')
-                ),
-                cancel_url=request.build_absolute_uri(
-                    reverse('store:checkout_cancel')
-                ),
-                metadata={'user_id': request.user.id, 'cart': str(cart)}
-            )
+            # Hold the stock until the payment arrives or the session
+            # expires, so a concurrent checkout can't sell it too
+            try:
+                token, expires_at = await sync_to_async(reserve)(
+                    user,
+                    [(item['product'], item['quantity']) for item in items],
+                )
+            except OutOfStock as e:
+                messages.error(request, f"Sorry, {e}")
+                return redirect('store:cart')
+            try:
+                session = await stripe.checkout.Session.create_async(
+                    payment_method_types=['card'],
+                    customer_email=user.email,
+                    line_items=line_items,
+                    mode='payment',
+                    success_url=request.build_absolute_uri(
+                        reverse('store:checkout_success')
+                    ),
+                    cancel_url=cancel_url(request, token),
+                    expires_at=session_expires_at(expires_at),
+                    metadata={
+                        'user_id': user.id,
+                        'cart': str(cart),
+                        'reservation': str(token),
+                    },
+                )
+            except Exception:
+                await sync_to_async(release)(token)
+                raise
             return redirect(session.url, code=303)
     else:
         form = CheckoutForm()
 
-    return render(request, 'store/checkout.html', {
+    return await sync_to_async(render)(request, 'store/checkout.html', {
         'form': form,
         'items': items,
         'total': total,
+        'STRIPE_PUBLIC_KEY': settings.STRIPE_PUBLIC_KEY,
     })
 
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
-
+@query_budget(9)
 @login_required
-def oneoff_checkout(request, pk):
-    product = get_object_or_404(Product, pk=pk)
-    session = stripe.checkout.Session.create(
-        payment_method_types=['card'],
-        customer_email=request.user.email,
-        line_items=[{
-            'price_data': {
-                'currency': 'eur',
-                'product_data': {'name': product.name},
-                'unit_amount': int(product.price * 100),
+async def oneoff_checkout(request, pk):
+    product = await aget_object_or_404(Product, pk=pk)
+    user = await request.auser()
+    try:
+        token, expires_at = await sync_to_async(reserve)(user, [(product, 1)])
+    except OutOfStock as e:
+        messages.error(request, f"Sorry, {e}")
+        return redirect('store:product_detail', pk=product.pk)
+    try:
+        session = await stripe.checkout.Session.create_async(
+            payment_method_types=['card'],
+            customer_email=user.email,
+            line_items=[{
+                'price_data': {
+                    'currency': 'eur',
+                    'product_data': {'name': product.name},
+                    'unit_amount': int(product.price * 100),
+                },
+                'quantity': 1,
+            }],
+            mode='payment',
+            success_url=request.build_absolute_uri(
+                reverse('store:checkout_success')
+            ),
+            cancel_url=cancel_url(request, token),
+            expires_at=session_expires_at(expires_at),
+            metadata={
+                'product_id': product.id,
+                'user_id': user.id,
+                'reservation': str(token),
             },
-            'quantity': 1,
-        }],
-        mode='payment',
-        success_url=request.build_absolute_uri(
-            reverse('store:checkout_success')
-        ),
-        cancel_url=request.build_absolute_uri(
-            reverse('store:checkout_cancel')
-        ),
-        metadata={'product_id': product.id, 'user_id': request.user.id}
-    )
+        )
+    except Exception:
+        await sync_to_async(release)(token)
+        raise
     return redirect(session.url, code=303)
 
 
+@query_budget(5)
 @login_required
 def checkout_success(request):
-    request.session['cart'] = {}
+    save_cart(request, {})
     return render(request, 'store/checkout_success.html')
 
 
+@query_budget(7)
 @login_required
 def checkout_cancel(request):
+    # Give back the stock the abandoned checkout held
+    try:
+        token = uuid.UUID(request.GET.get('reservation', ''))
+    except ValueError:
+        pass
+    else:
+        release(token, user=request.user)
     return render(request, 'store/checkout_cancel.html')
 
 
+@query_budget(7)
 @csrf_exempt
 def oneoff_webhook(request):
     payload = request.body
@@ -275,69 +358,56 @@ def oneoff_webhook(request):
         return HttpResponse(status=400)
 
     if event['type'] == 'checkout.session.completed':
-        sess = event['data']['object']
-        user_id = sess['metadata'].get('user_id')
-        cart_str = sess['metadata'].get('cart')
-        if cart_str:
-            cart = ast.literal_eval(cart_str)
-            user = User.objects.get(id=user_id)
-            total = 0
-
-            # Calculate total and check stock again
-            for prod_id, qty in cart.items():
-                product = Product.objects.get(pk=prod_id)
-                if product.stock < qty:
-                    # Log error or handle insufficient stock
-                    continue
-                line_total = product.price * qty
-                total += line_total
-
-            order = Order.objects.create(
-                user=user,
-                total_cents=int(total * 100),
-                status='paid'
-            )
-
-            # Create order items and reduce stock
-            for prod_id, qty in cart.items():
-                product = Product.objects.get(pk=prod_id)
-                if product.stock >= qty:
-                    OrderItem.objects.create(
+        session = event['data']['object']
+        metadata = session['metadata']
+        user = User.objects.get(id=metadata.get('user_id'))
+        if metadata.get('cart'):
+            cart = ast.literal_eval(metadata['cart'])
+        else:
+            # Buy Now: a single unit of one product
+            cart = {metadata.get('product_id'): 1}
+
+        try:
+            with transaction.atomic():
+                filled = fill_checkout(metadata.get('reservation'), cart)
+                if filled is None:
+                    # A retried event for a checkout that has its order
+                    return HttpResponse(status=200)
+                lines, reservations = filled
+                if not lines:
+                    return HttpResponse(status=200)
+                order = Order.objects.create(
+                    user=user,
+                    total_cents=int(
+                        sum(product.price * qty for product, qty in lines)
+                        * 100
+                    ),
+                    status='paid',
+                    stripe_session_id=session.get('id'),
+                )
+                OrderItem.objects.bulk_create(
+                    OrderItem(
                         order=order,
                         product=product,
                         quantity=qty,
                         unit_price=product.price
                     )
-                    # Reduce stock
-                    product.stock -= qty
-                    product.save()
-
-            send_order_confirmation_email(user, order)
-        else:
-            product_id = sess['metadata'].get('product_id')
-            user = User.objects.get(id=user_id)
-            product = Product.objects.get(pk=product_id)
-
-            if product.stock >= 1:
-                order = Order.objects.create(
-                    user=user,
-                    total_cents=int(product.price * 100),
-                    status='paid'
-                )
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    quantity=1,
-                    unit_price=product.price
+                    for product, qty in lines
                 )
-                # Reduce stock
-                product.stock -= 1
-                product.save()
-                send_order_confirmation_email(user, order)
+                StockReservation.objects.filter(
+                    pk__in=[reservation.pk for reservation in reservations]
+                ).update(order=order)
+        except IntegrityError:
+            # Another delivery of this event made the order first; rolling
+            # back gave back any stock this one took
+            return HttpResponse(status=200)
+
+        send_order_confirmation_email(user, order)
 
     return HttpResponse(status=200)
 
 
+@query_budget(5)
 @login_required
 def order_history(request):
     """Display user's order history with detailed information."""
@@ -355,15 +425,23 @@ def order_history(request):
     return render(request, 'store/order_history.html', {'orders': orders})
 
 
+@query_budget(5)
 @login_required
 def order_detail(request, order_id):
     """Display detailed view of a single order."""
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = get_object_or_404(
+        Order.objects.select_related('user').prefetch_related(
+            'items__product'
+        ),
+        id=order_id,
+        user=request.user
+    )
     order.total_amount = order.total_cents / 100
 
     return render(request, 'store/order_detail.html', {'order': order})
 
 
+@query_budget(3)
 @login_required
 def review_create(request, product_pk):
     product = get_object_or_404(Product, pk=product_pk)
@@ -387,6 +465,7 @@ def review_create(request, product_pk):
     )
 
 
+@query_budget(4)
 @login_required
 def review_edit(request, pk):
     review = get_object_or_404(Review, pk=pk, user=request.user)
@@ -405,6 +484,7 @@ def review_edit(request, pk):
     )
 
 
+@query_budget(4)
 @login_required
 def review_delete(request, pk):
     review = get_object_or_404(Review, pk=pk, user=request.user)
@@ -419,14 +499,21 @@ def review_delete(request, pk):
     )
 
 
+@query_budget(4)
 @staff_member_required
 def admin_dashboard(request):
     from subscriptions.models import Subscription
     products = Product.objects.all()
-    reviews = Review.objects.all()
+    reviews = Review.objects.select_related('product', 'user')
     subscriptions = Subscription.objects.all()
     return render(request, 'admin_dashboard.html', {
         'products': products,
         'reviews': reviews,
         'subscriptions': subscriptions,
+        'exports': [
+            ('orders', 'Orders and items'),
+            ('subscriptions', 'Subscriptions'),
+            ('reviews', 'Reviews'),
+            ('newsletter', 'Newsletter subscribers'),
+        ],
     })
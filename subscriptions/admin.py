@@ -1,5 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
+from fithub.exports import admin_actions
+from fithub.stripe_client import stripe
 from .models import Plan, Subscription
 
 
@@ -87,14 +89,12 @@ class SubscriptionAdmin(admin.ModelAdmin):
         'cancel_subscriptions',
         'sync_with_stripe',
         'fix_duplicate_active',
+        *admin_actions('subscriptions'),
     ]
 
     def cancel_subscriptions(self, request, queryset):
-        import stripe
-        from django.conf import settings
         from django.utils import timezone
 
-        stripe.api_key = settings.STRIPE_SECRET_KEY
         count = 0
 
         for sub in queryset.filter(status='active'):
@@ -124,11 +124,8 @@ class SubscriptionAdmin(admin.ModelAdmin):
     cancel_subscriptions.short_description = "Cancel selected subscriptions"
 
     def sync_with_stripe(self, request, queryset):
-        import stripe
-        from django.conf import settings
         from django.utils import timezone
 
-        stripe.api_key = settings.STRIPE_SECRET_KEY
         synced = 0
         errors = 0
 
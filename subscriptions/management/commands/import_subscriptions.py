@@ -0,0 +1,11 @@
+from fithub.imports import ImportCommand, SubscriptionImporter
+
+
+class Command(ImportCommand):
+    help = (
+        "Import subscriptions from a CSV or JSON Lines file laid out like "
+        "the subscriptions export, for existing users and plans (by "
+        "username and plan name). Stripe subscription ids already in use "
+        "are skipped."
+    )
+    importer = SubscriptionImporter
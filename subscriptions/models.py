@@ -1,6 +1,10 @@
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 
+from fithub.cache_versions import bump_after_commit
+
 
 class Plan(models.Model):
     INTERVAL_CHOICES = [('monthly', 'Monthly'), ('yearly', 'Yearly')]
@@ -39,3 +43,9 @@ class Subscription(models.Model):
 
     def __str__(self):
         return f"{self.user.username} → {self.plan.name}"
+
+
+@receiver(post_save, sender=Plan)
+@receiver(post_delete, sender=Plan)
+def bump_plans_version(sender, **kwargs):
+    bump_after_commit('plans')
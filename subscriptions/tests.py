@@ -2,7 +2,7 @@ from django.test import TestCase
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from datetime import date, timedelta
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 from .models import Plan, Subscription
 
 User = get_user_model()
@@ -420,7 +420,7 @@ class SubscriptionViewTests(TestCase):
             status='active'
         )
         url = reverse('subscriptions:subscribe_plan', args=[self.plan.id])
-        with patch('stripe.checkout.Session.create') as mock_create:
+        with patch('stripe.checkout.Session.create_async') as mock_create:
             mock_create.return_value = MagicMock(
                 url='http://stripe.example.com'
             )
@@ -473,7 +473,9 @@ class SubscriptionViewTests(TestCase):
             status='active'
         )
         url = reverse('subscriptions:cancel_subscription', args=[sub.id])
-        with patch('stripe.Subscription.delete') as mock_delete:
+        with patch(
+            'stripe.Subscription.cancel_async', new_callable=AsyncMock
+        ) as mock_delete:
             mock_delete.return_value = None
             response = self.client.post(url)
         self.assertRedirects(
@@ -511,7 +513,9 @@ class SubscriptionViewTests(TestCase):
             status='active'
         )
         url = reverse('subscriptions:cancel_subscription', args=[sub.id])
-        with patch('stripe.Subscription.delete') as mock_delete:
+        with patch(
+            'stripe.Subscription.cancel_async', new_callable=AsyncMock
+        ) as mock_delete:
             import stripe
             mock_delete.side_effect = stripe.error.StripeError('API Error')
             response = self.client.post(url)
@@ -644,7 +648,9 @@ class SubscriptionViewTests(TestCase):
         url = reverse(
             'subscriptions:cancel_subscription', args=[subscription.id]
         )
-        with patch('stripe.Subscription.delete') as mock_delete:
+        with patch(
+            'stripe.Subscription.cancel_async', new_callable=AsyncMock
+        ) as mock_delete:
             import stripe
             # InvalidRequestError requires message and param arguments
             mock_delete.side_effect = stripe.error.InvalidRequestError(
@@ -676,3 +682,150 @@ class SubscriptionViewTests(TestCase):
         self.assertEqual(sub.user.username, 'subuser')
         self.assertEqual(sub.plan.name, 'Monthly')
         self.assertEqual(sub.plan.price, 9.99)
+
+
+class StripeWebhookTests(TestCase):
+    """Tests for the Stripe subscription webhook."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='hookuser',
+            email='hook@example.com',
+            password='pass'
+        )
+        self.plan = Plan.objects.create(
+            name='Monthly',
+            description='Monthly plan',
+            price=9.99,
+            interval='monthly',
+            is_active=True,
+            stripe_price_id='price_monthly_test'
+        )
+        self.url = reverse('stripe_webhook')
+
+    def post_event(self, event):
+        with patch('stripe.Webhook.construct_event', return_value=event):
+            return self.client.post(
+                self.url,
+                data='{}',
+                content_type='application/json',
+                HTTP_STRIPE_SIGNATURE='t=1,v1=test'
+            )
+
+    def test_invalid_signature_logged_and_rejected(self):
+        # A bad signature is rejected with a warning, not printed
+        with self.assertLogs('subscriptions.views', level='WARNING') as logs:
+            response = self.client.post(
+                self.url,
+                data='{}',
+                content_type='application/json',
+                HTTP_STRIPE_SIGNATURE='bad'
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid Stripe webhook signature', logs.output[0])
+
+    def test_checkout_completed_creates_subscription(self):
+        # A completed checkout creates an active subscription
+        event = {
+            'id': 'evt_1',
+            'type': 'checkout.session.completed',
+            'data': {'object': {
+                'customer_email': self.user.email,
+                'subscription': 'sub_new',
+                'metadata': {
+                    'plan_id': str(self.plan.id),
+                    'user_id': str(self.user.id),
+                },
+            }},
+        }
+        response = self.post_event(event)
+        self.assertEqual(response.status_code, 200)
+        sub = Subscription.objects.get(stripe_sub_id='sub_new')
+        self.assertEqual(sub.status, 'active')
+        self.assertEqual(sub.user, self.user)
+
+    def checkout_event(self, stripe_sub_id):
+        return {
+            'id': f'evt_{stripe_sub_id}',
+            'type': 'checkout.session.completed',
+            'data': {'object': {
+                'customer_email': self.user.email,
+                'subscription': stripe_sub_id,
+                'metadata': {
+                    'plan_id': str(self.plan.id),
+                    'user_id': str(self.user.id),
+                },
+            }},
+        }
+
+    def test_retried_checkout_records_one_subscription(self):
+        # Stripe delivering the event again is answered without a change
+        event = self.checkout_event('sub_retry')
+        self.assertEqual(self.post_event(event).status_code, 200)
+        self.assertEqual(self.post_event(event).status_code, 200)
+        self.assertEqual(Subscription.objects.count(), 1)
+
+    def test_newer_checkout_cancels_other_active_subscription(self):
+        # Two checkouts completed for one user: only the newest stays
+        Subscription.objects.create(
+            user=self.user,
+            plan=self.plan,
+            stripe_sub_id='sub_first',
+            start_date='2025-01-01',
+            status='active'
+        )
+        with patch('stripe.Subscription.delete') as delete, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.post_event(self.checkout_event('sub_second'))
+        delete.assert_called_once_with('sub_first')
+        self.assertEqual(
+            Subscription.objects.get(stripe_sub_id='sub_first').status,
+            'canceled'
+        )
+        self.assertEqual(
+            Subscription.objects.get(status='active').stripe_sub_id,
+            'sub_second'
+        )
+
+    def test_stripe_cancellation_waits_for_commit(self):
+        # Stripe isn't called while the user's row is locked
+        Subscription.objects.create(
+            user=self.user,
+            plan=self.plan,
+            stripe_sub_id='sub_first',
+            start_date='2025-01-01',
+            status='active'
+        )
+        with patch('stripe.Subscription.delete') as delete, \
+                self.captureOnCommitCallbacks() as callbacks:
+            self.post_event(self.checkout_event('sub_second'))
+            delete.assert_not_called()
+        with patch('stripe.Subscription.delete') as delete:
+            for callback in callbacks:
+                callback()
+        delete.assert_called_once_with('sub_first')
+
+    def test_event_timing_logged_with_event_type(self):
+        # Each handled event logs its type, id and duration as fields
+        Subscription.objects.create(
+            user=self.user,
+            plan=self.plan,
+            stripe_sub_id='sub_del',
+            start_date='2025-01-01',
+            status='active'
+        )
+        event = {
+            'id': 'evt_2',
+            'type': 'customer.subscription.deleted',
+            'data': {'object': {'id': 'sub_del'}},
+        }
+        with self.assertLogs('subscriptions.views', level='INFO') as logs:
+            self.post_event(event)
+        timing = logs.records[-1]
+        self.assertEqual(timing.event_type, 'customer.subscription.deleted')
+        self.assertEqual(timing.event_id, 'evt_2')
+        self.assertGreaterEqual(timing.duration_ms, 0)
+        self.assertEqual(
+            Subscription.objects.get(stripe_sub_id='sub_del').status,
+            'canceled'
+        )
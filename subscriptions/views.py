@@ -1,8 +1,12 @@
-import stripe
+import logging
+import time
 # from datetime import date, timedelta
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
-from django.shortcuts import render, get_object_or_404, redirect
+from django.db import transaction
+from django.shortcuts import (
+    render, get_object_or_404, aget_object_or_404, redirect,
+)
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponse
@@ -11,11 +15,16 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from .models import Subscription, Plan
+from fithub.decorators import query_budget
+from fithub.page_cache import public_page
+from fithub.stripe_client import stripe
 
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+logger = logging.getLogger(__name__)
 
 
+@query_budget(7)
+@public_page('plans')
 def plan_list(request):
     plans = Plan.objects.filter(is_active=True)
     user_active_plan_ids = []
@@ -77,16 +86,18 @@ def plan_list(request):
     )
 
 
+@query_budget(4)
 @login_required
-def subscribe_plan(request, plan_id):
-    plan = get_object_or_404(Plan, pk=plan_id, is_active=True)
+async def subscribe_plan(request, plan_id):
+    plan = await aget_object_or_404(Plan, pk=plan_id, is_active=True)
+    user = await request.auser()
 
     # Check for existing active subscription to THIS specific plan
-    existing_active = Subscription.objects.filter(
-        user=request.user,
+    existing_active = await Subscription.objects.filter(
+        user=user,
         plan=plan,
         status='active'
-    ).first()
+    ).afirst()
 
     if existing_active:
         messages.error(
@@ -96,10 +107,10 @@ def subscribe_plan(request, plan_id):
         return redirect('subscriptions:my_subscription')
 
     # Check if user has ANY other active subscription
-    other_active_subscription = Subscription.objects.filter(
-        user=request.user,
+    other_active_subscription = await Subscription.objects.filter(
+        user=user,
         status='active'
-    ).exclude(plan=plan).first()
+    ).exclude(plan=plan).select_related('plan').afirst()
 
     if other_active_subscription:
         messages.warning(
@@ -124,7 +135,7 @@ def subscribe_plan(request, plan_id):
     # Create Stripe Checkout Session with metadata
     metadata = {
         'plan_id': plan.id,
-        'user_id': request.user.id,
+        'user_id': user.id,
     }
 
     # Add existing subscription info to metadata if switching plans
@@ -133,8 +144,8 @@ def subscribe_plan(request, plan_id):
         metadata['old_stripe_sub_id'] = other_active_subscription.stripe_sub_id
         metadata['switching_plans'] = 'true'
 
-    session = stripe.checkout.Session.create(
-        customer_email=request.user.email,
+    session = await stripe.checkout.Session.create_async(
+        customer_email=user.email,
         payment_method_types=['card'],
         line_items=[{
             'price': plan.stripe_price_id,
@@ -152,25 +163,24 @@ def subscribe_plan(request, plan_id):
     return redirect(session.url, code=303)
 
 
+@query_budget(4)
 @login_required
-def cancel_subscription(request, sub_id):
-    subscription = get_object_or_404(
+async def cancel_subscription(request, sub_id):
+    subscription = await aget_object_or_404(
         Subscription,
         pk=sub_id,
-        user=request.user
+        user=await request.auser()
     )
 
     if subscription.status == 'active':
-        import stripe
-        stripe.api_key = settings.STRIPE_SECRET_KEY
         try:
             # Cancel the subscription on Stripe
-            stripe.Subscription.delete(subscription.stripe_sub_id)
+            await stripe.Subscription.cancel_async(subscription.stripe_sub_id)
 
             # Update the local database record immediately
             subscription.status = 'canceled'
             subscription.end_date = timezone.now().date()
-            subscription.save()
+            await subscription.asave()
 
             messages.success(
                 request,
@@ -185,7 +195,7 @@ def cancel_subscription(request, sub_id):
             )
             subscription.status = 'canceled'
             subscription.end_date = timezone.now().date()
-            subscription.save()
+            await subscription.asave()
         except stripe.error.StripeError as e:
             messages.error(
                 request,
@@ -208,6 +218,7 @@ def cancel_subscription(request, sub_id):
     return redirect('subscriptions:my_subscription')
 
 
+@query_budget(5)
 @login_required
 def my_subscription(request):
     from datetime import date
@@ -215,6 +226,7 @@ def my_subscription(request):
     # Get the most recent ACTIVE subscription first
     active_subscription = (
         Subscription.objects
+        .select_related('plan')
         .filter(user=request.user, status='active')
         .order_by('-start_date')
         .first()
@@ -223,6 +235,7 @@ def my_subscription(request):
     # If no active subscription, get the most recent canceled one
     subscription = active_subscription or (
         Subscription.objects
+        .select_related('plan')
         .filter(user=request.user)
         .order_by('-start_date')
         .first()
@@ -232,6 +245,7 @@ def my_subscription(request):
     if subscription:
         all_subscriptions = (
             Subscription.objects
+            .select_related('plan')
             .filter(user=request.user)
             .exclude(id=subscription.id)
             .order_by('-start_date')
@@ -260,16 +274,208 @@ def my_subscription(request):
     )
 
 
+@query_budget(2)
 def subscription_success(request):
     """Show a success message after subscribing."""
     return render(request, 'subscriptions/subscription_success.html')
 
 
+@query_budget(2)
 def subscription_cancel(request):
     """Show a cancellation message if user cancels checkout."""
     return render(request, 'subscriptions/subscription_cancel.html')
 
 
+@transaction.atomic
+def checkout_completed(session, log_extra):
+    """Record the subscription a completed Checkout Session paid for.
+
+    The user's row is locked first, so Stripe delivering an event twice,
+    or two of their checkouts completing together, are handled one after
+    the other: an event whose subscription is already recorded is
+    skipped, and the newest subscription cancels any other active one.
+
+    Returns an error response, or None once the event is handled.
+    """
+    customer_email = session.get('customer_email')
+    stripe_sub_id = session.get('subscription')
+    metadata = session.get('metadata', {})
+    plan_id = metadata.get('plan_id')
+    user_id = metadata.get('user_id')
+    old_subscription_id = metadata.get('old_subscription_id')
+    old_stripe_sub_id = metadata.get('old_stripe_sub_id')
+    switching_plans = metadata.get('switching_plans') == 'true'
+
+    try:
+        # Get and lock the user, and get the plan
+        users = User.objects.select_for_update()
+        if user_id:
+            user = users.get(id=user_id)
+        else:
+            user = users.get(email=customer_email)
+        plan = Plan.objects.get(id=plan_id)
+    except User.DoesNotExist:
+        logger.warning(
+            "User not found: %s", customer_email or user_id,
+            extra=log_extra
+        )
+        return HttpResponse(status=400)
+    except Plan.DoesNotExist:
+        logger.warning("Plan not found: %s", plan_id, extra=log_extra)
+        return HttpResponse(status=400)
+
+    if Subscription.objects.filter(stripe_sub_id=stripe_sub_id).exists():
+        logger.info(
+            "Subscription %s already recorded", stripe_sub_id,
+            extra=log_extra
+        )
+        return None
+
+    start_date = timezone.now().date()
+
+    # Calculate next payment date
+    if plan.interval == 'monthly':
+        next_payment_date = start_date + relativedelta(months=1)
+    elif plan.interval == 'yearly':
+        next_payment_date = start_date + relativedelta(years=1)
+    else:
+        next_payment_date = None
+
+    # Stripe subscriptions to cancel once the transaction commits, so
+    # the user's row isn't locked while Stripe is called
+    to_cancel = []
+
+    # STEP 1: Handle plan switching - cancel old subscription FIRST
+    if switching_plans and old_subscription_id:
+        try:
+            old_sub = Subscription.objects.get(
+                id=old_subscription_id,
+                user=user
+            )
+            # Only cancel if still active
+            if old_sub.status == 'active':
+                if old_stripe_sub_id or old_sub.stripe_sub_id:
+                    to_cancel.append(
+                        old_stripe_sub_id or old_sub.stripe_sub_id
+                    )
+
+                # Update old subscription in database
+                old_sub.status = 'canceled'
+                old_sub.end_date = timezone.now().date()
+                old_sub.save()
+                logger.info(
+                    "Canceled old subscription #%s (plan %s) for user %s",
+                    old_sub.id,
+                    old_sub.plan_id,
+                    user.email,
+                    extra=log_extra
+                )
+        except Subscription.DoesNotExist:
+            logger.warning(
+                "Old subscription %s not found",
+                old_subscription_id,
+                extra=log_extra
+            )
+
+    # STEP 2: Check if renewing a canceled subscription to the SAME plan
+    old_canceled_subscription = Subscription.objects.filter(
+        user=user,
+        plan=plan,
+        status='canceled'
+    ).order_by('-end_date').first()
+
+    if old_canceled_subscription and not switching_plans:
+        # Renewing the same canceled plan - update existing record
+        old_canceled_subscription.stripe_sub_id = stripe_sub_id
+        old_canceled_subscription.status = 'active'
+        old_canceled_subscription.start_date = start_date
+        old_canceled_subscription.next_payment_date = next_payment_date
+        old_canceled_subscription.end_date = None
+        old_canceled_subscription.save()
+        logger.info(
+            "Subscription renewed: user %s, plan %s (ID: %s)",
+            user.email,
+            plan.name,
+            old_canceled_subscription.id,
+            extra=log_extra
+        )
+        subscription = old_canceled_subscription
+    else:
+        # STEP 3: Create new subscription for different plan
+        new_sub = Subscription.objects.create(
+            user=user,
+            plan=plan,
+            stripe_sub_id=stripe_sub_id,
+            status='active',
+            start_date=start_date,
+            next_payment_date=next_payment_date,
+            end_date=None,
+        )
+        logger.info(
+            "New subscription created: user %s, plan %s (ID: %s)",
+            user.email,
+            plan.name,
+            new_sub.id,
+            extra=log_extra
+        )
+        subscription = new_sub
+
+    # Cancel any other active subscription: a user has one at a time.
+    # Without a switch this only happens when two checkouts completed,
+    # and the customer is paying for both.
+    active_subs = Subscription.objects.filter(
+        user=user, status='active'
+    ).exclude(pk=subscription.pk)
+    for old_sub in active_subs:
+        if old_sub.stripe_sub_id:
+            to_cancel.append(old_sub.stripe_sub_id)
+        old_sub.status = 'canceled'
+        old_sub.end_date = timezone.now().date()
+        old_sub.save()
+        logger.info(
+            "Canceled subscription #%s (plan %s)",
+            old_sub.id,
+            old_sub.plan_id,
+            extra=log_extra
+        )
+
+    if to_cancel:
+        transaction.on_commit(
+            lambda: cancel_on_stripe(to_cancel, log_extra)
+        )
+    return None
+
+
+def cancel_on_stripe(stripe_sub_ids, log_extra):
+    """Cancel subscriptions on Stripe that are already canceled here.
+
+    Errors are logged rather than raised: the webhook has been handled,
+    and Stripe's own cancellation webhook finds nothing left to update.
+    """
+    for stripe_sub_id in dict.fromkeys(stripe_sub_ids):
+        try:
+            stripe.Subscription.delete(stripe_sub_id)
+            logger.info(
+                "Canceled Stripe subscription: %s",
+                stripe_sub_id,
+                extra=log_extra
+            )
+        except stripe.error.InvalidRequestError:
+            logger.info(
+                "Subscription already canceled on Stripe: %s",
+                stripe_sub_id,
+                extra=log_extra
+            )
+        except stripe.error.StripeError as e:
+            logger.error(
+                "Error canceling Stripe subscription %s: %s",
+                stripe_sub_id,
+                e,
+                extra=log_extra
+            )
+
+
+@query_budget(9)
 @csrf_exempt
 def stripe_webhook(request):
     payload = request.body
@@ -281,177 +487,49 @@ def stripe_webhook(request):
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
         )
     except ValueError as e:
-        print("Invalid payload:", e)
+        logger.warning("Invalid Stripe webhook payload: %s", e)
         return HttpResponse(status=400)
     except stripe.error.SignatureVerificationError as e:
-        print("Invalid signature:", e)
+        logger.warning("Invalid Stripe webhook signature: %s", e)
         return HttpResponse(status=400)
     except Exception as e:
-        print("Webhook error:", e)
+        logger.error("Stripe webhook error: %s", e)
         return HttpResponse(status=400)
 
-    print(f"Stripe event received: {event['type']}")
+    event_type = event['type']
+    log_extra = {'event_type': event_type, 'event_id': event.get('id')}
+    started = time.perf_counter()
+    logger.info("Stripe event received: %s", event_type, extra=log_extra)
 
     # Handle successful checkout
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        customer_email = session.get('customer_email')
-        stripe_sub_id = session.get('subscription')
-        plan_id = session.get('metadata', {}).get('plan_id')
-        user_id = session.get('metadata', {}).get('user_id')
-        old_subscription_id = (
-            session.get('metadata', {}).get('old_subscription_id')
-        )
-        old_stripe_sub_id = (
-            session.get('metadata', {}).get('old_stripe_sub_id')
-        )
-        metadata = session.get('metadata', {})
-        switching_plans_value = metadata.get('switching_plans')
-        switching_plans = switching_plans_value == 'true'
-
-        try:
-            # Get user and plan
-            if user_id:
-                user = User.objects.get(id=user_id)
-            else:
-                user = User.objects.get(email=customer_email)
-            plan = Plan.objects.get(id=plan_id)
-        except User.DoesNotExist:
-            print(f"User not found: {customer_email or user_id}")
-            return HttpResponse(status=400)
-        except Plan.DoesNotExist:
-            print(f"Plan not found: {plan_id}")
-            return HttpResponse(status=400)
-
-        start_date = timezone.now().date()
-
-        # Calculate next payment date
-        if plan.interval == 'monthly':
-            next_payment_date = start_date + relativedelta(months=1)
-        elif plan.interval == 'yearly':
-            next_payment_date = start_date + relativedelta(years=1)
-        else:
-            next_payment_date = None
-
-        # STEP 1: Handle plan switching - cancel old subscription FIRST
-        if switching_plans:
-            if old_subscription_id:
-                try:
-                    old_sub = Subscription.objects.get(
-                        id=old_subscription_id,
-                        user=user
-                    )
-                    # Only cancel if still active
-                    if old_sub.status == 'active':
-                        # Cancel on Stripe first
-                        if old_stripe_sub_id or old_sub.stripe_sub_id:
-                            try:
-                                stripe.Subscription.delete(
-                                    old_stripe_sub_id or old_sub.stripe_sub_id
-                                )
-                                print(
-                                    f"✓ Canceled old Stripe subscription: "
-                                    f"{old_stripe_sub_id or old_sub.stripe_sub_id}"
-                                )
-                            except stripe.error.InvalidRequestError:
-                                print(
-                                    "Old subscription already canceled on Stripe: "
-                                    f"{old_stripe_sub_id or old_sub.stripe_sub_id}"
-                                )
-                            except stripe.error.StripeError as e:
-                                print(f"Error canceling old Stripe subscription: {e}")
-
-                        # Update old subscription in database
-                        old_sub.status = 'canceled'
-                        old_sub.end_date = timezone.now().date()
-                        old_sub.save()
-                        print(
-                            f"✓ Canceled old subscription #{old_sub.id} "
-                            f"({old_sub.plan.name}) for user {user.email}"
-                        )
-                except Subscription.DoesNotExist:
-                    print(f"Old subscription {old_subscription_id} not found")
-            else:
-                # Fallback: Find and cancel any active subscription
-                # for this user
-                active_subs = Subscription.objects.filter(
-                    user=user,
-                    status='active'
-                ).exclude(plan=plan)
-
-                for old_sub in active_subs:
-                    try:
-                        stripe.Subscription.delete(old_sub.stripe_sub_id)
-                        print(
-                            f"✓ Canceled Stripe subscription: "
-                            f"{old_sub.stripe_sub_id}"
-                        )
-                    except Exception:
-                        pass
-
-                    old_sub.status = 'canceled'
-                    old_sub.end_date = timezone.now().date()
-                    old_sub.save()
-                    print(
-                        f"✓ Canceled subscription #{old_sub.id} "
-                        f"({old_sub.plan.name})"
-                    )
-
-        # STEP 2: Check if renewing a canceled subscription to the SAME plan
-        old_canceled_subscription = Subscription.objects.filter(
-            user=user,
-            plan=plan,
-            status='canceled'
-        ).order_by('-end_date').first()
-
-        if old_canceled_subscription and not switching_plans:
-            # Renewing the same canceled plan - update existing record
-            old_canceled_subscription.stripe_sub_id = stripe_sub_id
-            old_canceled_subscription.status = 'active'
-            old_canceled_subscription.start_date = start_date
-            old_canceled_subscription.next_payment_date = next_payment_date
-            old_canceled_subscription.end_date = None
-            old_canceled_subscription.save()
-            print(
-                f"✓ Subscription RENEWED: User {user.email} → {plan.name} "
-                f"(ID: {old_canceled_subscription.id})"
-            )
-        else:
-            # STEP 3: Create new subscription for different plan
-            new_sub = Subscription.objects.create(
-                user=user,
-                plan=plan,
-                stripe_sub_id=stripe_sub_id,
-                status='active',
-                start_date=start_date,
-                next_payment_date=next_payment_date,
-                end_date=None,
-            )
-            print(
-                f"✓ NEW subscription created: User {user.email} → {plan.name} "
-                f"(ID: {new_sub.id})"
-            )
+    if event_type == 'checkout.session.completed':
+        response = checkout_completed(event['data']['object'], log_extra)
+        if response is not None:
+            return response
 
     # Handle subscription cancellation
-    elif event['type'] == 'customer.subscription.deleted':
+    elif event_type == 'customer.subscription.deleted':
         stripe_sub_id = event['data']['object']['id']
         try:
             sub = Subscription.objects.get(stripe_sub_id=stripe_sub_id)
             sub.status = 'canceled'
             sub.end_date = timezone.now().date()
             sub.save()
-            print(
-                f"✓ Subscription canceled via webhook: {stripe_sub_id} "
-                f"for user {sub.user.email}"
+            logger.info(
+                "Subscription canceled via webhook: %s for user %s",
+                stripe_sub_id,
+                sub.user.email,
+                extra=log_extra
             )
         except Subscription.DoesNotExist:
-            print(
-                f"Subscription not found for cancel webhook: "
-                f"{stripe_sub_id}"
+            logger.warning(
+                "Subscription not found for cancel webhook: %s",
+                stripe_sub_id,
+                extra=log_extra
             )
 
     # Handle subscription updates (status changes, etc.)
-    elif event['type'] == 'customer.subscription.updated':
+    elif event_type == 'customer.subscription.updated':
         subscription_data = event['data']['object']
         stripe_sub_id = subscription_data['id']
         stripe_status = subscription_data['status']
@@ -471,14 +549,24 @@ def stripe_webhook(request):
                 sub.status = 'past_due'
 
             sub.save()
-            print(
-                f"✓ Subscription updated via webhook: {stripe_sub_id} - "
-                f"Status: {stripe_status}"
+            logger.info(
+                "Subscription updated via webhook: %s - Status: %s",
+                stripe_sub_id,
+                stripe_status,
+                extra=log_extra
             )
         except Subscription.DoesNotExist:
-            print(
-                f"Subscription not found for update webhook: "
-                f"{stripe_sub_id}"
+            logger.warning(
+                "Subscription not found for update webhook: %s",
+                stripe_sub_id,
+                extra=log_extra
             )
 
+    duration_ms = (time.perf_counter() - started) * 1000
+    logger.info(
+        "Stripe event %s handled in %.1fms",
+        event_type,
+        duration_ms,
+        extra={**log_extra, 'duration_ms': round(duration_ms, 2)}
+    )
     return HttpResponse(status=200)
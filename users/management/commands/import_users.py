@@ -0,0 +1,11 @@
+from fithub.imports import ImportCommand, UserImporter
+
+
+class Command(ImportCommand):
+    help = (
+        "Import members from a CSV or JSON Lines file with username, email, "
+        "first_name, last_name and date_joined columns. Existing usernames "
+        "are skipped. New users get an empty profile and an unusable "
+        "password, which they replace through password reset."
+    )
+    importer = UserImporter
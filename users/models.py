@@ -1,12 +1,47 @@
-from django.db import models
-from django.db.models.signals import post_save
+from functools import partial
+
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 
+from core.models import ProgressUpdate
+from fithub.context_processors import forget_nav_user
+from subscriptions.models import Subscription
+
 
 User = get_user_model()
 
 
+class ProfileManager(models.Manager):
+    def for_user(self, user):
+        """`user`'s profile, created the first time it is asked for.
+
+        Profiles aren't made when users are, so saving a user costs no
+        extra INSERT. The INSERT ignores a conflict on the unique
+        user_id, so when two requests create the same profile at once
+        both read back the one row that won, without the savepoint
+        get_or_create() would need.
+        """
+        try:
+            return user.profile
+        except Profile.DoesNotExist:
+            pass
+        self.bulk_create([self.model(user=user)], ignore_conflicts=True)
+        profile = self.get(user=user)
+        user.profile = profile
+        return profile
+
+    def bulk_create_for(self, users, batch_size=None):
+        """Create missing profiles for saved `users` in one INSERT per
+        batch; users who already have one are skipped."""
+        return self.bulk_create(
+            [self.model(user=user) for user in users],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.TextField(blank=True)
@@ -14,11 +49,26 @@ class Profile(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProfileManager()
+
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
 
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    if created:
-        Profile.objects.create(user=instance)
+@receiver(post_delete, sender=User)
+def refresh_nav_user(sender, instance, **kwargs):
+    # The name, staff flag or password may have changed. Forgetting it
+    # before the commit would let another request cache the old row again.
+    transaction.on_commit(partial(forget_nav_user, instance.pk))
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_save, sender=ProgressUpdate)
+@receiver(post_delete, sender=ProgressUpdate)
+def forget_profile_summary(sender, instance, **kwargs):
+    from users.summary import forget_summary
+    transaction.on_commit(partial(forget_summary, instance.user_id))
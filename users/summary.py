@@ -0,0 +1,123 @@
+"""
+The member summary on the profile pages: their profile, their latest
+subscription and their most recent progress updates.
+
+It takes one query for each part: the subscription comes with its plan
+and the updates without their full text. The summary is then cached per
+user until their profile, one of their subscriptions or one of their
+progress updates is saved or deleted (see the receivers in
+users.models), so repeat visits run no queries for it. Only plain values
+are cached, not model instances, so entries stay readable when the
+models change. The cached subscription holds its plan's name, which
+other members share, so the key also holds the 'plans' version: editing
+a plan moves every summary to a new key.
+"""
+from django.core.cache import cache
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.functions import Left
+from django.utils.text import Truncator
+
+from core.models import ProgressUpdate
+from fithub.cache_versions import get_version
+from subscriptions.models import Subscription
+
+from .models import Profile
+
+# Invalidation keeps entries current; this only bounds how long the
+# summary of a member who stopped visiting stays in the cache.
+SUMMARY_TIMEOUT = 60 * 60
+RECENT_UPDATES = 3
+EXCERPT_WORDS = 20
+# Enough text for EXCERPT_WORDS words of any sensible length
+EXCERPT_CHARS = 300
+
+
+def _key(user_id, plans_version):
+    return f'profile-summary:{user_id}:{plans_version}'
+
+
+def forget_summary(*user_ids):
+    plans_version = get_version('plans')
+    cache.delete_many([_key(user_id, plans_version) for user_id in user_ids])
+
+
+def latest_subscription(user):
+    """The user's most recent active subscription, or failing that their
+    most recent one, with its plan."""
+    return (
+        Subscription.objects
+        .filter(user=user)
+        .select_related('plan')
+        .order_by(
+            Case(
+                When(status='active', then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            ),
+            '-start_date',
+        )
+        .first()
+    )
+
+
+def recent_updates(user):
+    """The user's latest progress updates with a short excerpt in place
+    of their content."""
+    updates = list(
+        ProgressUpdate.objects
+        .filter(user=user)
+        .only('title', 'created_at')
+        .annotate(preview=Left('content', EXCERPT_CHARS))
+        .order_by('-created_at')[:RECENT_UPDATES]
+    )
+    for update in updates:
+        update.excerpt = Truncator(update.preview).words(EXCERPT_WORDS)
+        if (
+            len(update.preview) == EXCERPT_CHARS
+            and update.excerpt == update.preview
+        ):
+            update.excerpt += '…'
+    return updates
+
+
+def _subscription_values(subscription):
+    if subscription is None:
+        return None
+    return {
+        'plan': {'name': subscription.plan.name},
+        'status': subscription.status,
+        'start_date': subscription.start_date,
+        'next_payment_date': subscription.next_payment_date,
+        'end_date': subscription.end_date,
+    }
+
+
+def profile_summary(user):
+    """{'profile', 'subscription', 'recent_updates'} for `user`, as
+    dicts: the profile's bio and fitness_goal, the subscription's plan
+    name, status and dates, and each update's title, created_at and
+    excerpt."""
+    key = _key(user.pk, get_version('plans'))
+    summary = cache.get(key)
+    if summary is None:
+        profile = Profile.objects.for_user(user)
+        summary = {
+            # Not the instance, which would carry the user row with it
+            'profile': {
+                'bio': profile.bio,
+                'fitness_goal': profile.fitness_goal,
+            },
+            'subscription': _subscription_values(
+                latest_subscription(user)
+            ),
+            'recent_updates': [
+                {
+                    'title': update.title,
+                    'created_at': update.created_at,
+                    'excerpt': update.excerpt,
+                }
+                for update in recent_updates(user)
+            ],
+        }
+        cache.set(key, summary, SUMMARY_TIMEOUT)
+    return summary
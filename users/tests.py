@@ -1,6 +1,11 @@
+from datetime import date
+
+from django.core.cache import cache
 from django.test import TestCase
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from core.models import ProgressUpdate
+from subscriptions.models import Plan, Subscription
 from .models import Profile
 
 User = get_user_model()
@@ -10,6 +15,7 @@ class UserProfileTests(TestCase):
     """Tests for the users app focusing on Profile creation and views."""
 
     def setUp(self):
+        cache.clear()
         # Create a reusable test user for the profile-related tests
         self.user = User.objects.create_user(
             username='testuser',
@@ -17,9 +23,126 @@ class UserProfileTests(TestCase):
             password='pass'
         )
 
-    def test_profile_created_on_user_creation(self):
-        # Creating a User should also create a related profile via signal
-        self.assertTrue(Profile.objects.filter(user=self.user).exists())
+    def test_profile_created_on_first_access(self):
+        # Saving a User doesn't insert a profile; asking for it does, once
+        self.assertFalse(Profile.objects.filter(user=self.user).exists())
+        profile = Profile.objects.for_user(self.user)
+        self.assertEqual(profile.user, self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(Profile.objects.for_user(self.user), profile)
+        # A profile another request created is found, not duplicated
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(Profile.objects.for_user(user), profile)
+        self.assertEqual(Profile.objects.filter(user=self.user).count(), 1)
+
+    def test_bulk_create_for_users(self):
+        # Users and their profiles in one INSERT each; existing skipped
+        Profile.objects.for_user(self.user)
+        users = [User(username=f'member{i}') for i in range(3)]
+        with self.assertNumQueries(2):
+            User.objects.bulk_create(users)
+            Profile.objects.bulk_create_for(users + [self.user])
+        self.assertEqual(Profile.objects.count(), 4)
+
+    def test_profile_page_without_profile(self):
+        self.client.login(username='testuser', password='pass')
+        response = self.client.get(reverse('users:profile'))
+        self.assertContains(response, 'No bio yet.')
+
+    def test_profile_summary_cached_until_changed(self):
+        # A repeat visit only loads the session and the user
+        self.client.login(username='testuser', password='pass')
+        url = reverse('users:profile')
+        self.client.get(url)
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        plan = Plan.objects.create(
+            name='Gold', description='All in.', price='9.99',
+            interval='monthly',
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscription.objects.create(
+                user=self.user, plan=plan, stripe_sub_id='sub_1',
+                start_date=date(2025, 1, 1), status='canceled',
+            )
+        self.assertContains(self.client.get(url), 'Gold')
+        with self.captureOnCommitCallbacks(execute=True):
+            ProgressUpdate.objects.create(
+                user=self.user, title='Deadlift PB', content='Pulled 200kg.'
+            )
+        self.assertContains(self.client.get(url), 'Deadlift PB')
+        profile = Profile.objects.for_user(self.user)
+        profile.bio = 'Lifter'
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.save()
+        self.assertContains(self.client.get(url), 'Lifter')
+
+    def test_profile_summary_forgotten_after_commit(self):
+        # Another request could re-cache the old summary between a save
+        # and its commit, so the entry is only dropped once it commits
+        self.client.login(username='testuser', password='pass')
+        url = reverse('users:profile')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks() as callbacks:
+            ProgressUpdate.objects.create(
+                user=self.user, title='Deadlift PB', content='Pulled 200kg.'
+            )
+            self.assertNotContains(self.client.get(url), 'Deadlift PB')
+        for callback in callbacks:
+            callback()
+        self.assertContains(self.client.get(url), 'Deadlift PB')
+
+    def test_profile_summary_shows_edited_plan(self):
+        # The cached subscription's plan isn't served after a plan edit
+        plan = Plan.objects.create(
+            name='Gold', description='All in.', price='9.99',
+            interval='monthly',
+        )
+        Subscription.objects.create(
+            user=self.user, plan=plan, stripe_sub_id='sub_1',
+            start_date=date(2025, 1, 1), status='active',
+        )
+        self.client.login(username='testuser', password='pass')
+        url = reverse('users:profile')
+        self.assertContains(self.client.get(url), 'Gold')
+        plan.name = 'Platinum'
+        with self.captureOnCommitCallbacks(execute=True):
+            plan.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'Platinum')
+        self.assertNotContains(response, 'Gold')
+
+    def test_profile_prefers_active_subscription(self):
+        # An active subscription is shown before a newer canceled one
+        plans = [
+            Plan.objects.create(
+                name=name, description='Plan.', price='9.99',
+                interval='monthly',
+            )
+            for name in ('Gold', 'Silver')
+        ]
+        Subscription.objects.create(
+            user=self.user, plan=plans[0], stripe_sub_id='sub_1',
+            start_date=date(2024, 1, 1), status='active',
+        )
+        Subscription.objects.create(
+            user=self.user, plan=plans[1], stripe_sub_id='sub_2',
+            start_date=date(2025, 1, 1), status='canceled',
+        )
+        self.client.login(username='testuser', password='pass')
+        response = self.client.get(reverse('users:profile'))
+        subscription = response.context['subscription']
+        self.assertEqual(subscription['plan']['name'], 'Gold')
+
+    def test_recent_updates_show_an_excerpt(self):
+        ProgressUpdate.objects.create(
+            user=self.user, title='Long', content='word ' * 1000
+        )
+        self.client.login(username='testuser', password='pass')
+        response = self.client.get(reverse('users:profile'))
+        update = response.context['recent_updates'][0]
+        self.assertEqual(update['excerpt'], 'word ' * 19 + 'word…')
+        self.assertNotIn('content', update)
 
     def test_profile_view_requires_login(self):
         # The profile view should redirect anonymous users to login
@@ -143,28 +266,28 @@ class UserProfileTests(TestCase):
     def test_profile_str_method(self):
         # The Profile model's __str__ should include the username
         # for readability
-        profile = Profile.objects.get(user=self.user)
+        profile = Profile.objects.for_user(self.user)
         self.assertEqual(str(profile), f"{self.user.username}'s Profile")
 
     def test_profile_bio_field_blank(self):
         # Newly created profiles should have empty bio by default
-        profile = Profile.objects.get(user=self.user)
+        profile = Profile.objects.for_user(self.user)
         self.assertEqual(profile.bio, '')
 
     def test_profile_fitness_goal_field_blank(self):
         # Newly created profiles should have empty fitness_goal by default
-        profile = Profile.objects.get(user=self.user)
+        profile = Profile.objects.for_user(self.user)
         self.assertEqual(profile.fitness_goal, '')
 
     def test_profile_timestamps_exist(self):
         # Profile should have created_at and updated_at timestamps
-        profile = Profile.objects.get(user=self.user)
+        profile = Profile.objects.for_user(self.user)
         self.assertIsNotNone(profile.created_at)
         self.assertIsNotNone(profile.updated_at)
 
     def test_profile_one_to_one_relationship(self):
         # Each user should have exactly one profile
-        profile = Profile.objects.get(user=self.user)
+        profile = Profile.objects.for_user(self.user)
         self.assertEqual(self.user.profile, profile)
 
     def test_profile_edit_bio_long_text(self):
@@ -218,6 +341,7 @@ class UserProfileTests(TestCase):
 
     def test_profile_edit_form_initial_values(self):
         # Form should be pre-populated with existing profile data
+        Profile.objects.for_user(self.user)
         self.user.profile.bio = 'Existing bio'
         self.user.profile.fitness_goal = 'Existing goal'
         self.user.profile.save()
@@ -256,6 +380,7 @@ class UserProfileTests(TestCase):
 
     def test_profile_view_shows_bio(self):
         # Profile view should display the user's bio
+        Profile.objects.for_user(self.user)
         self.user.profile.bio = 'Test bio'
         self.user.profile.save()
 
@@ -266,6 +391,7 @@ class UserProfileTests(TestCase):
 
     def test_profile_view_shows_fitness_goal(self):
         # Profile view should display the user's fitness goal
+        Profile.objects.for_user(self.user)
         self.user.profile.fitness_goal = 'Test goal'
         self.user.profile.save()
 
@@ -290,8 +416,8 @@ class UserProfileTests(TestCase):
             email='test2@example.com',
             password='pass'
         )
-        profile1 = Profile.objects.get(user=self.user)
-        profile2 = Profile.objects.get(user=user2)
+        profile1 = Profile.objects.for_user(self.user)
+        profile2 = Profile.objects.for_user(user2)
         self.assertNotEqual(profile1.id, profile2.id)
         self.assertNotEqual(profile1.user_id, profile2.user_id)
 
@@ -302,6 +428,7 @@ class UserProfileTests(TestCase):
             email='test2@example.com',
             password='pass'
         )
+        Profile.objects.for_user(user2)
 
         self.client.login(username='testuser', password='pass')
         url = reverse('users:profile_edit')
@@ -333,7 +460,7 @@ class UserProfileTests(TestCase):
 
     def test_profile_created_at_not_modifiable(self):
         # created_at should not change after profile creation
-        profile = Profile.objects.get(user=self.user)
+        profile = Profile.objects.for_user(self.user)
         original_created_at = profile.created_at
 
         self.client.login(username='testuser', password='pass')
@@ -348,7 +475,7 @@ class UserProfileTests(TestCase):
 
     def test_profile_updated_at_changes_on_edit(self):
         # updated_at should change when profile is updated
-        profile = Profile.objects.get(user=self.user)
+        profile = Profile.objects.for_user(self.user)
         original_updated_at = profile.updated_at
 
         # Small delay to ensure timestamp difference
@@ -4,8 +4,9 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .forms import SignUpForm, ProfileForm
 from .models import Profile
-from subscriptions.models import Subscription
+from .summary import profile_summary
 from datetime import date
+from fithub.decorators import query_budget
 
 
 def signup_view(request):
@@ -22,71 +23,33 @@ def signup_view(request):
     return render(request, 'users/signup.html', {'form': form})
 
 
-@login_required
-def profile(request):
-    from datetime import date
-
-    # Get the most recent ACTIVE subscription first,
-    # then fall back to most recent
-    active_subscription = (
-        Subscription.objects
-        .filter(user=request.user, status='active')
-        .order_by('-start_date')
-        .first()
-    )
-
-    # If no active subscription, get the most recent one (could be canceled)
-    subscription = active_subscription or (
-        Subscription.objects
-        .filter(user=request.user)
-        .order_by('-start_date')
-        .first()
-    )
-
-    # Get recent progress updates
-    from core.models import ProgressUpdate
-    recent_updates = ProgressUpdate.objects.filter(
-        user=request.user
-    ).order_by('-created_at')[:3]
-
-    days_until_next_payment = None
+def days_until_payment(subscription):
     if (
         subscription
-        and subscription.status == 'active'
-        and subscription.next_payment_date
+        and subscription['status'] == 'active'
+        and subscription['next_payment_date']
     ):
-        next_payment = subscription.next_payment_date
-        days_until_next_payment = (next_payment - date.today()).days
+        return (subscription['next_payment_date'] - date.today()).days
+    return None
+
 
+@query_budget(5)
+@login_required
+def profile(request):
+    summary = profile_summary(request.user)
     return render(request, 'users/profile.html', {
-        'subscription': subscription,
-        'recent_updates': recent_updates,
-        'days_until_next_payment': days_until_next_payment,
+        **summary,
+        'days_until_next_payment': days_until_payment(
+            summary['subscription']
+        ),
         'today': date.today(),
     })
 
 
+@query_budget(5)
 @login_required
 def profile_edit(request):
-    profile, created = Profile.objects.get_or_create(user=request.user)
-
-    # Get the most recent subscription
-    subscription = (
-        Subscription.objects
-        .filter(user=request.user)
-        .order_by('-start_date')
-        .first()
-    )
-
-    days_until_next_payment = None
-    if (
-        subscription
-        and subscription.next_payment_date
-        and subscription.status == 'active'
-    ):
-        next_payment = subscription.next_payment_date
-        days_until_next_payment = (next_payment - date.today()).days
-
+    profile = Profile.objects.for_user(request.user)
     if request.method == 'POST':
         form = ProfileForm(request.POST, request.FILES, instance=profile)
         if form.is_valid():
@@ -96,13 +59,14 @@ def profile_edit(request):
     else:
         form = ProfileForm(instance=profile)
 
+    subscription = profile_summary(request.user)['subscription']
     return render(
         request,
         'users/profile_edit.html',
         {
             'form': form,
             'subscription': subscription,
-            'days_until_next_payment': days_until_next_payment,
+            'days_until_next_payment': days_until_payment(subscription),
             'today': date.today(),
         }
     )